@@ -0,0 +1,187 @@
+# benchmarks/gnn_precision.py
+"""
+So sánh fp32 với int8 / bf16 (src/utils/cpu_inference.py) cho GNN Step 5 và verifier Step 7 trên CPU:
+độ lệch so với fp32 (cùng trọng số) và throughput.
+
+Ví dụ:
+    python -m benchmarks.gnn_precision --graphs 1000 --threads 4
+    python -m benchmarks.gnn_precision --report-out precision.json --min-cosine 0.99
+
+Đồ thị giả lập cùng metadata (như các query của một batch); trọng số lấy từ models/*.pth nếu có,
+không thì khởi tạo ngẫu nhiên (seed cố định). Exit code 1 nếu độ lệch vượt ngưỡng.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch_geometric.data import Batch
+from torch_geometric.nn import HGTConv
+
+from src.models.dual_tower_gnn import CoGCoT_DualTower_GNN
+from src.models.verifier import MultiSignalVerifier
+from src.modules.step5_reasoning import GNN_HIDDEN_CHANNELS, GNN_MODEL_PATH, GNN_QUERY_DIM
+from src.modules.step7_verification import VERIFIER_MODEL_PATH
+from src.utils.cpu_inference import autocast, bf16_supported, configure_threads, prepare_model
+from src.utils.hetero_graph import SubgraphIndex
+
+logger = logging.getLogger("GNN_PRECISION")
+
+NODE_TYPES = ["Drug", "Disease", "Effect/Phenotype"]
+RELATIONS = [("Drug", "INDICATION", "Disease"), ("Drug", "DRUG_EFFECT", "Effect/Phenotype"),
+             ("Disease", "PHENOTYPE_PRESENT", "Effect/Phenotype"), ("Drug", "DRUG_DRUG", "Drug")]
+
+
+def _graph(rng, num_nodes: int, num_edges: int):
+    """Một query giả lập: CKG có đủ mọi loại node/quan hệ (cùng metadata) + PSG bệnh nhân -> quan sát."""
+    labels = NODE_TYPES + list(rng.choice(NODE_TYPES, size=max(num_nodes - len(NODE_TYPES), 0)))
+    nodes = [{"id": f"n{i}", "label": label} for i, label in enumerate(labels)]
+    by_label = {t: [n["id"] for n in nodes if n["label"] == t] for t in NODE_TYPES}
+    edges = []
+    for i in range(max(num_edges, len(RELATIONS))):
+        src_t, rel, dst_t = RELATIONS[i % len(RELATIONS)]
+        edges.append({"source": rng.choice(by_label[src_t]), "target": rng.choice(by_label[dst_t]), "type": rel})
+    ckg = SubgraphIndex(nodes).to_hetero_data(edges, rng.standard_normal((len(nodes), GNN_QUERY_DIM)))
+    psg_nodes = [{"id": "patient", "label": "Patient"}, {"id": "obs", "label": "Observation"}]
+    psg = SubgraphIndex(psg_nodes).to_hetero_data([{"source": "patient", "target": "obs", "type": "HAS_OBSERVATION"}],
+                                                  rng.standard_normal((len(psg_nodes), GNN_QUERY_DIM)))
+    return ckg, psg, torch.tensor(rng.standard_normal(GNN_QUERY_DIM), dtype=torch.float32)
+
+
+def _run_gnn(model, precision, graphs, batch_size):
+    thoughts, t0 = [], time.perf_counter()
+    with torch.no_grad(), autocast(precision):
+        for i in range(0, len(graphs), batch_size):
+            chunk = graphs[i:i + batch_size]
+            _, steps = model.forward_batch(Batch.from_data_list([g[0] for g in chunk]), Batch.from_data_list([g[1] for g in chunk]),
+                                           torch.stack([g[2] for g in chunk]))
+            thoughts.append(np.stack(steps, axis=1))   # [B, steps, hidden]
+    return np.concatenate(thoughts), time.perf_counter() - t0
+
+
+def _run_verifier(model, precision, features):
+    t0 = time.perf_counter()
+    with torch.no_grad(), autocast(precision):
+        conf = torch.sigmoid(model(torch.tensor(features)).float()).squeeze(-1).numpy()
+    return conf, time.perf_counter() - t0
+
+
+def _cosine(a, b):
+    a, b = a.reshape(-1, a.shape[-1]), b.reshape(-1, b.shape[-1])
+    return np.sum(a * b, axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+
+
+def run(args) -> dict:
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    threads = configure_threads(args.threads)
+    graphs = [_graph(rng, args.nodes, args.edges) for _ in range(args.graphs)]
+
+    gnn = CoGCoT_DualTower_GNN(graphs[0][0].metadata(), graphs[0][1].metadata(), GNN_HIDDEN_CHANNELS, GNN_QUERY_DIM, args.think_steps)
+    if GNN_MODEL_PATH.exists():
+        gnn.load_state_dict(torch.load(GNN_MODEL_PATH, map_location="cpu"), strict=False)
+    gnn.eval()
+    with torch.no_grad():   # Khởi tạo các Linear lazy trước khi quantize
+        gnn(*graphs[0])
+
+    verifier = MultiSignalVerifier(input_dim=8)
+    if VERIFIER_MODEL_PATH.exists():
+        verifier.load_state_dict(torch.load(VERIFIER_MODEL_PATH, map_location="cpu"))
+    verifier.eval()
+    features = rng.uniform(0.0, 1.0, size=(args.paths, 8)).astype(np.float32)
+    features[:, 4] = rng.integers(1, 4, size=args.paths)   # độ dài path
+
+    precisions = ["fp32", "int8"] + (["bf16"] if bf16_supported() else [])
+    ref_thoughts = ref_conf = None
+    report = {"config": {"graphs": args.graphs, "nodes": args.nodes, "edges": args.edges, "think_steps": args.think_steps,
+                         "batch_size": args.batch_size, "paths": args.paths, "threads": threads, "seed": args.seed,
+                         "trained_gnn": GNN_MODEL_PATH.exists(), "trained_verifier": VERIFIER_MODEL_PATH.exists()},
+              "precisions": {}}
+    for precision in precisions:
+        gnn_p = prepare_model(gnn, precision, skip=(HGTConv,))
+        verifier_p = prepare_model(verifier, precision)
+        _run_gnn(gnn_p, precision, graphs[:args.batch_size], args.batch_size)   # warm-up
+        thoughts, gnn_s = _run_gnn(gnn_p, precision, graphs, args.batch_size)
+        conf, verifier_s = _run_verifier(verifier_p, precision, features)
+        if precision == "fp32":
+            ref_thoughts, ref_conf = thoughts, conf
+        cos = _cosine(thoughts, ref_thoughts)
+        report["precisions"][precision] = {
+            "gnn_graphs_per_s": round(args.graphs / max(gnn_s, 1e-9), 2),
+            "gnn_graphs_per_s_per_thread": round(args.graphs / max(gnn_s, 1e-9) / threads, 2),
+            "gnn_speedup_vs_fp32": None,
+            "thought_cosine_min": round(float(cos.min()), 6),
+            "thought_cosine_mean": round(float(cos.mean()), 6),
+            "thought_max_abs_diff": round(float(np.abs(thoughts - ref_thoughts).max()), 6),
+            "verifier_paths_per_s": round(args.paths / max(verifier_s, 1e-9), 2),
+            "verifier_max_abs_diff": round(float(np.abs(conf - ref_conf).max()), 6),
+            # Quyết định của Step 7: > 0.5 giữ path, > 0.8 Graph-Strict
+            "verifier_agreement_0.5": round(float(np.mean((conf > 0.5) == (ref_conf > 0.5))), 6),
+            "verifier_agreement_0.8": round(float(np.mean((conf > 0.8) == (ref_conf > 0.8))), 6),
+        }
+    base = report["precisions"]["fp32"]["gnn_graphs_per_s"]
+    for stats in report["precisions"].values():
+        stats["gnn_speedup_vs_fp32"] = round(stats["gnn_graphs_per_s"] / max(base, 1e-9), 3)
+    return report
+
+
+def violations(report: dict, min_cosine: float, min_agreement: float) -> list:
+    found = []
+    for precision, stats in report["precisions"].items():
+        if stats["thought_cosine_min"] < min_cosine:
+            found.append(f"{precision}: thought cosine {stats['thought_cosine_min']} < {min_cosine}")
+        for key in ("verifier_agreement_0.5", "verifier_agreement_0.8"):
+            if stats[key] < min_agreement:
+                found.append(f"{precision}: {key} {stats[key]} < {min_agreement}")
+    return found
+
+
+def print_report(report: dict):
+    c = report["config"]
+    print(f"\n{'=' * 96}")
+    print(f"📊 GNN/VERIFIER PRECISION: {c['graphs']} graphs x {c['nodes']} nodes / {c['edges']} edges | threads={c['threads']}")
+    print(f"{'=' * 96}")
+    print(f"{'precision':<10}{'graphs/s':>12}{'/thread':>10}{'speedup':>10}{'cos min':>12}{'max |Δ|':>12}{'verif |Δ|':>12}{'agree@.5':>10}")
+    for precision, st in report["precisions"].items():
+        print(f"{precision:<10}{st['gnn_graphs_per_s']:>12.1f}{st['gnn_graphs_per_s_per_thread']:>10.1f}{st['gnn_speedup_vs_fp32']:>10.2f}"
+              f"{st['thought_cosine_min']:>12.5f}{st['thought_max_abs_diff']:>12.5f}{st['verifier_max_abs_diff']:>12.5f}{st['verifier_agreement_0.5']:>10.3f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Accuracy parity and CPU throughput of int8/bf16 GNN + verifier vs fp32.")
+    parser.add_argument("--graphs", type=int, default=500, help="Number of synthetic per-query graphs.")
+    parser.add_argument("--nodes", type=int, default=60, help="Nodes per CKG graph.")
+    parser.add_argument("--edges", type=int, default=150, help="Edges per CKG graph.")
+    parser.add_argument("--think-steps", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=64, help="Graphs per forward_batch call.")
+    parser.add_argument("--paths", type=int, default=5000, help="Candidate path feature vectors for the verifier.")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: MEDCOT_TORCH_THREADS / torch default).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Minimum cosine of thought vectors vs fp32.")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="Minimum verifier decision agreement vs fp32.")
+    parser.add_argument("--report-out", type=str, default=None, help="Write the JSON report to this path.")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run(args)
+    print_report(report)
+
+    if args.report_out:
+        Path(args.report_out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"💾 Report saved to {args.report_out}")
+
+    found = violations(report, args.min_cosine, args.min_agreement)
+    if found:
+        print("❌ Accuracy parity check failed:")
+        for v in found:
+            print(f"   - {v}")
+        sys.exit(1)
+    print("✅ int8/bf16 within tolerance of fp32.")
+
+
+if __name__ == "__main__":
+    main_cli()
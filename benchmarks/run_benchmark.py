@@ -0,0 +1,176 @@
+# benchmarks/run_benchmark.py
+"""
+Benchmark end-to-end (Step 0 -> 10) hoàn toàn offline trên đồ thị giả lập kiểu PrimeKG.
+
+Ví dụ:
+    python -m benchmarks.run_benchmark --edges 100000 --queries 50
+    python -m benchmarks.run_benchmark --edges 1000000 --mode batch --batch-size 16
+    python -m benchmarks.run_benchmark --report-out bench.json --baseline bench_main.json --max-regression 0.2
+
+Báo cáo p50/p95/p99 theo từng stage (mili-giây) và throughput (queries/s).
+Khi có `--baseline`, script trả exit code 1 nếu p95 của một stage chậm hơn baseline quá `--max-regression`.
+"""
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks import stubs, synthetic_kg
+
+logger = logging.getLogger("BENCHMARK")
+
+PERCENTILES = (50, 95, 99)
+
+
+def _profiles_of(state) -> list:
+    return [log["metadata"]["profile"] for log in state.logs if log.get("step") == "PROFILE" and log.get("metadata")]
+
+
+def _summarize(samples: dict) -> dict:
+    report = {}
+    for stage, values in sorted(samples.items()):
+        arr = np.asarray(values, dtype=np.float64)
+        report[stage] = {"n": len(values), "mean_ms": round(float(arr.mean()), 3),
+                         **{f"p{p}_ms": round(float(np.percentile(arr, p)), 3) for p in PERCENTILES}}
+    return report
+
+
+def run(args) -> dict:
+    import main
+    from src.utils.disk_cache import all_cache_stats
+
+    t0 = time.perf_counter()
+    kg = synthetic_kg.generate(num_edges=args.edges, seed=args.seed)
+    logger.info(f"🧪 Synthetic KG: {kg.num_nodes:,} nodes / {kg.num_edges:,} edges ({time.perf_counter() - t0:.2f}s)")
+
+    services = stubs.RemoteServicesStub(latency_ms=args.remote_latency_ms)
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="medcot_bench_"))
+    fake_db = stubs.install(kg, services, workdir)
+    cfg = {"use_gcot": not args.no_gcot, "use_cache": args.result_cache}
+
+    queries = synthetic_kg.generate_queries(kg, args.warmup + args.queries, seed=args.seed)
+    warmup, measured = queries[:args.warmup], queries[args.warmup:]
+
+    def _reset_caches():
+        from src.utils import arax_client, name_resolver
+        name_resolver.name_resolver.cache.clear()
+        arax_client.arax_client.cache.clear()
+        main.result_cache.results.clear()
+        main.result_cache.stages.clear()
+
+    def _execute(batch):
+        if args.mode == "batch":
+            return main.run_pipeline_batch(batch, cfg)
+        return [main.run_pipeline(q, config=cfg) for q in batch]
+
+    for i in range(0, len(warmup), args.batch_size):
+        _execute(warmup[i:i + args.batch_size])
+
+    samples, failures = {}, 0
+    wall0 = time.perf_counter()
+    for i in range(0, len(measured), args.batch_size if args.mode == "batch" else 1):
+        if args.cold_caches:
+            _reset_caches()
+        chunk = measured[i:i + (args.batch_size if args.mode == "batch" else 1)]
+        states = _execute(chunk)
+        failures += sum(1 for s in states if s is None)
+        # Batch mode: mọi state của cùng một batch mang chung một profile -> chỉ lấy từ state đầu tiên
+        done = [s for s in states if s is not None]
+        for state in (done[:1] if args.mode == "batch" else done):
+            for profile in _profiles_of(state):
+                for stage, st in profile.items():
+                    samples.setdefault(stage, []).append(st["wall_ms"])
+    wall = time.perf_counter() - wall0
+    services.close()
+
+    return {
+        "config": {"edges": kg.num_edges, "nodes": kg.num_nodes, "queries": len(measured), "warmup": len(warmup),
+                   "mode": args.mode, "batch_size": args.batch_size, "seed": args.seed, "use_gcot": cfg["use_gcot"],
+                   "remote_latency_ms": args.remote_latency_ms, "cold_caches": args.cold_caches,
+                   "result_cache": args.result_cache},
+        "throughput_qps": round(len(measured) / max(wall, 1e-9), 3),
+        "wall_s": round(wall, 3),
+        "failures": failures,
+        "neo4j_queries": fake_db.query_count,
+        "caches": all_cache_stats(),
+        "stages": _summarize(samples),
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float, min_ms: float) -> list:
+    """Trả về danh sách stage có p95 chậm hơn baseline quá ngưỡng (bỏ qua stage quá nhanh để tránh nhiễu)."""
+    regressions = []
+    for stage, cur in report["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base or max(base["p95_ms"], cur["p95_ms"]) < min_ms:
+            continue
+        ratio = cur["p95_ms"] / max(base["p95_ms"], 1e-9) - 1.0
+        if ratio > max_regression:
+            regressions.append({"stage": stage, "baseline_p95_ms": base["p95_ms"], "p95_ms": cur["p95_ms"], "regression": round(ratio, 3)})
+    base_qps = baseline.get("throughput_qps")
+    if base_qps and report["throughput_qps"] < base_qps * (1.0 - max_regression):
+        regressions.append({"stage": "throughput_qps", "baseline": base_qps, "current": report["throughput_qps"]})
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\n{'=' * 78}")
+    c = report["config"]
+    print(f"📊 BENCHMARK: {c['nodes']:,} nodes / {c['edges']:,} edges | {c['queries']} queries | mode={c['mode']}")
+    print(f"{'=' * 78}")
+    print(f"{'stage':<36}{'n':>6}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for stage, st in report["stages"].items():
+        print(f"{stage:<36}{st['n']:>6}{st['p50_ms']:>12.2f}{st['p95_ms']:>12.2f}{st['p99_ms']:>12.2f}")
+    print(f"{'-' * 78}")
+    print(f"Throughput: {report['throughput_qps']:.2f} queries/s | failures: {report['failures']} | neo4j queries: {report['neo4j_queries']}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the MedCOT pipeline on a synthetic PrimeKG.")
+    parser.add_argument("--edges", type=int, default=10_000, help="Approximate number of KG edges (10k - 5M).")
+    parser.add_argument("--queries", type=int, default=20, help="Number of measured queries.")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured warm-up queries.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mode", choices=["single", "batch"], default="single")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--no-gcot", action="store_true", help="Skip step 5 (GNN reasoning).")
+    parser.add_argument("--remote-latency-ms", type=float, default=0.0, help="Simulated latency of the ARAX/SRI stand-ins.")
+    parser.add_argument("--cold-caches", action="store_true", help="Clear ARAX/SRI caches before every measured run.")
+    parser.add_argument("--result-cache", action="store_true", help="Enable the query/stage result cache (off by default so every query runs all steps).")
+    parser.add_argument("--workdir", type=str, default=None, help="Directory for caches/audit logs (default: a temp dir).")
+    parser.add_argument("--report-out", type=str, default=None, help="Write the JSON report to this path.")
+    parser.add_argument("--baseline", type=str, default=None, help="Baseline JSON report to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 slowdown vs baseline (0.2 = 20%%).")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="Ignore stages whose p95 is below this many ms.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's INFO logs.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    report = run(args)
+    print_report(report)
+
+    if args.report_out:
+        Path(args.report_out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"💾 Report saved to {args.report_out}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.max_regression, args.min_ms)
+        if regressions:
+            print("❌ Performance regressions detected:")
+            for r in regressions:
+                print(f"   - {r}")
+            sys.exit(1)
+        print("✅ No regression vs baseline.")
+
+
+if __name__ == "__main__":
+    main_cli()
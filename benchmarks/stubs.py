@@ -0,0 +1,366 @@
+# benchmarks/stubs.py
+"""
+Các "stand-in" offline cho benchmark:
+  - InMemoryNeo4j: interface đọc của backend đồ thị (link_bulk, expand_*, page_names) trên SyntheticKG.
+  - RemoteServicesStub: HTTP server cục bộ giả lập ARAX `/query` và SRI `/lookup`, `/bulk-lookup`.
+  - Các model nhỏ, deterministic (hash encoder, cross-encoder theo độ trùng từ, GLiNER theo từ điển, LLM giả).
+
+`install()` gắn tất cả stand-in vào các singleton của pipeline để `main.run_pipeline` chạy hoàn toàn offline.
+"""
+import bisect
+import functools
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from benchmarks.synthetic_kg import SyntheticKG
+
+EMBEDDING_DIM = 384
+
+KG_TYPE_TO_GLINER_LABEL = {
+    "Drug": "drug or medication",
+    "Disease": "medical condition or disease",
+    "Effect/Phenotype": "symptom or sign",
+    "Gene/Protein": "gene or protein",
+    "Anatomy": "anatomy or body part",
+}
+
+
+# ==============================================================================
+# 1. NEO4J STAND-IN
+# ==============================================================================
+class InMemoryNeo4j:
+    """Giả lập `db_connector` trên SyntheticKG với adjacency dạng CSR (numpy)."""
+
+    def __init__(self, kg: SyntheticKG):
+        self.kg = kg
+        self.query_count = 0
+        self._by_element_id = None
+        self._names_lower = {}
+        self._names_exact = {}
+        for idx, name in enumerate(kg.node_names):
+            self._names_lower.setdefault(name.lower(), idx)
+            self._names_exact.setdefault(name, []).append(idx)
+
+        # CSR vô hướng: mỗi cạnh xuất hiện ở cả 2 đầu
+        endpoints = np.concatenate([kg.src, kg.dst])
+        self._nbr = np.concatenate([kg.dst, kg.src])
+        self._edge_of = np.concatenate([np.arange(kg.num_edges), np.arange(kg.num_edges)])
+        order = np.argsort(endpoints, kind="stable")
+        self._nbr, self._edge_of = self._nbr[order], self._edge_of[order]
+        self._indptr = np.searchsorted(endpoints[order], np.arange(kg.num_nodes + 1))
+
+    def _node_dict(self, idx: int) -> dict:
+        eid = self.kg.element_id(idx)
+        return {"id": eid, "labels": [self.kg.node_types[idx]], "name": self.kg.node_names[idx],
+                "provenance": "PrimeKG", "element_id": eid}
+
+    def _parse_seed(self, seed):
+        if isinstance(seed, str) and seed.startswith("4:synthetic:"):
+            idx = int(seed.rsplit(":", 1)[1])
+            if 0 <= idx < self.kg.num_nodes:
+                return idx
+        return None
+
+    def _seed_indices(self, seeds) -> list:
+        return sorted({i for i in (self._parse_seed(s) for s in seeds) if i is not None})
+
+    def _rel_dict(self, e: int) -> dict:
+        kg = self.kg
+        return {"id": f"5:synthetic:{e}", "source": kg.element_id(int(kg.src[e])), "target": kg.element_id(int(kg.dst[e])),
+                "type": kg.rel_names[kg.rel_codes[e]], "provenance": "PrimeKG"}
+
+    def _ranked_node(self, idx: int) -> dict:
+        return {**self._node_dict(idx), "degree": int(self._indptr[idx + 1] - self._indptr[idx]), "pagerank": None}
+
+    # --- Cùng interface đọc với Neo4jConnection / EmbeddedGraphStore ---
+    def expand_neighbors(self, seeds) -> dict:
+        self.query_count += 1
+        seed_idx = self._seed_indices(seeds)
+        if not seed_idx:
+            return {"nodes": [], "edges": []}
+        nbrs, edges = [], []
+        for i in seed_idx:
+            lo, hi = self._indptr[i], self._indptr[i + 1]
+            nbrs.append(self._nbr[lo:hi])
+            edges.append(self._edge_of[lo:hi])
+        node_ids = list(dict.fromkeys(seed_idx + np.concatenate(nbrs).tolist()))
+        edge_ids = np.unique(np.concatenate(edges))
+        return {"nodes": [self._node_dict(i) for i in node_ids], "edges": [self._rel_dict(int(e)) for e in edge_ids]}
+
+    def expand_bounded(self, seeds, scan_limit: int, order: str = None) -> list:
+        # Giống EXPAND_BOUNDED_QUERY: mỗi seed tối đa `scan_limit` cạnh (bậc lớn nhất nếu order="degree"; không có pagerank)
+        self.query_count += 1
+        rows = []
+        for i in self._seed_indices(seeds):
+            lo, hi = self._indptr[i], self._indptr[i + 1]
+            nbr, edges = self._nbr[lo:hi], self._edge_of[lo:hi]
+            if order == "degree" and len(nbr) > scan_limit:
+                top = np.argsort(-(self._indptr[nbr + 1] - self._indptr[nbr]), kind="stable")
+                nbr, edges = nbr[top], edges[top]
+            candidates = [{"node": self._ranked_node(nb), "rel": self._rel_dict(e)}
+                          for nb, e in zip(nbr[:scan_limit].tolist(), edges[:scan_limit].tolist())]
+            rows.append({"seed": self._ranked_node(i), "candidates": candidates})
+        return rows
+
+    def link_bulk(self, queries) -> list:
+        # Giống BULK_LINK_QUERY: term có rank nhỏ nhất khớp được + node_id các node trùng tên
+        self.query_count += 1
+        rows = []
+        for q in queries:
+            for rank, term in enumerate(q["terms"]):
+                idx = self._names_lower.get(str(term).lower())
+                if idx is None: continue
+                name = self.kg.node_names[idx]
+                best = {"rank": rank, "term": term, "node_id": self.kg.element_id(idx), "node_label": self.kg.node_types[idx],
+                        "preferred_name": name}
+                rows.append({"mention": q["mention"], "best": best,
+                             "node_ids": [self.kg.element_id(i) for i in self._names_exact.get(name, [])]})
+                break
+        return rows
+
+    def page_names(self, after=None, limit: int = 20_000) -> list:
+        # Phân trang keyset theo elementId (so sánh chuỗi, giống Neo4j) cho việc dựng NameIndex
+        self.query_count += 1
+        if self._by_element_id is None:
+            self._by_element_id = sorted((self.kg.element_id(i), i) for i in range(self.kg.num_nodes))
+        start = bisect.bisect_right(self._by_element_id, (after or "", float("inf")))
+        return [{"cursor": eid, "node_id": eid, "node_label": self.kg.node_types[i], "name": self.kg.node_names[i]}
+                for eid, i in self._by_element_id[start:start + limit]]
+
+    def run_query(self, query, parameters=None):
+        raise NotImplementedError(f"Benchmark Neo4j stand-in does not run Cypher: {' '.join(query.split())[:160]}")
+
+    def close(self):
+        pass
+
+
+# ==============================================================================
+# 2. ARAX + SRI STAND-IN (HTTP THẬT TRÊN LOCALHOST)
+# ==============================================================================
+def synthetic_curie(name: str) -> str:
+    return "SYN:" + hashlib.md5(name.lower().encode()).hexdigest()[:8]
+
+
+class _RemoteHandler(BaseHTTPRequestHandler):
+    latency_s = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        time.sleep(self.latency_s)
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        if url.path.endswith("/query"):
+            qg = json.loads(raw)["message"]["query_graph"]
+            a, b = qg["nodes"]["n0"]["ids"][0], qg["nodes"]["n1"]["ids"][0]
+            self._send({"message": {"knowledge_graph": {
+                "nodes": {a: {"name": a}, b: {"name": b}},
+                "edges": {"e0": {"subject": a, "object": b, "predicate": "biolink:interacts_with",
+                                 "attributes": [{"attribute_type_id": "biolink:primary_knowledge_source",
+                                                 "value": "infores:synthetic"}]}},
+            }}})
+        elif url.path.endswith("/bulk-lookup"):
+            names = json.loads(raw).get("strings", [])
+            self._send({name: [{"curie": synthetic_curie(name), "label": name}] for name in names})
+        elif url.path.endswith("/lookup"):
+            name = parse_qs(url.query).get("string", [""])[0]
+            self._send([{"curie": synthetic_curie(name), "label": name}] if name else [])
+        else:
+            self._send({"error": f"unknown path {url.path}"}, status=404)
+
+
+class RemoteServicesStub:
+    """Chạy HTTP server cục bộ (port ngẫu nhiên) với độ trễ giả lập cho mỗi request."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        handler = type("RemoteHandler", (_RemoteHandler,), {"latency_s": latency_ms / 1000.0})
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="bench-remote-stub")
+        self._thread.start()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# ==============================================================================
+# 3. CÁC MODEL NHỎ, DETERMINISTIC
+# ==============================================================================
+def _tokens(text: str) -> list:
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+
+class HashEncoder:
+    """Thay SentenceTransformer: bag-of-token được hash vào vector 384 chiều, đã chuẩn hoá L2."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for tok in _tokens(text):
+            h = int(hashlib.md5(tok.encode()).hexdigest()[:8], 16)
+            v[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
+    def encode(self, sentences, convert_to_tensor=False, show_progress_bar=False, normalize_embeddings=False, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        mat = np.stack([self._vector(s) for s in ([sentences] if single else sentences)]) if (single or len(sentences)) else np.zeros((0, self.dim), dtype=np.float32)
+        out = mat[0] if single else mat
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(np.ascontiguousarray(out))
+        return out
+
+
+class OverlapCrossEncoder:
+    """Thay CrossEncoder: điểm = độ trùng token (Jaccard). `num_labels=3` giả lập model NLI."""
+
+    def __init__(self, num_labels: int = 1):
+        self.num_labels = num_labels
+
+    def predict(self, pairs, **kwargs):
+        scores = []
+        for a, b in pairs:
+            ta, tb = set(_tokens(a)), set(_tokens(b))
+            scores.append(len(ta & tb) / max(1, len(ta | tb)))
+        scores = np.asarray(scores, dtype=np.float32) * 4.0 - 2.0
+        if self.num_labels == 1:
+            return scores
+        return np.stack([-scores, np.zeros_like(scores), scores], axis=1)
+
+
+class DictionaryGliner:
+    """Thay GLiNER: nhận diện tên các node hub của SyntheticKG bằng regex."""
+
+    def __init__(self, kg: SyntheticKG):
+        self.label_of = {}
+        for ntype, names in kg.hub_names.items():
+            for name in names:
+                self.label_of[name.lower()] = KG_TYPE_TO_GLINER_LABEL.get(ntype, "medical condition or disease")
+        alternatives = sorted(self.label_of, key=len, reverse=True)
+        self.pattern = re.compile(r"\b(" + "|".join(re.escape(a) for a in alternatives) + r")\b", re.IGNORECASE)
+
+    def predict_entities(self, text, labels, threshold=0.5, **kwargs):
+        return [{"text": m.group(0), "label": self.label_of[m.group(0).lower()], "start": m.start(), "end": m.end(), "score": 0.99}
+                for m in self.pattern.finditer(text or "")]
+
+    def batch_predict_entities(self, texts, labels, threshold=0.5, **kwargs):
+        return [self.predict_entities(t, labels, threshold) for t in texts]
+
+
+class _NoPHIAnalyzer:
+    def analyze(self, text, language="en", **kwargs):
+        return []
+
+
+class _PassThroughAnonymizer:
+    class _Result:
+        def __init__(self, text):
+            self.text = text
+
+    def anonymize(self, text, analyzer_results=None, operators=None):
+        return self._Result(text)
+
+
+def fake_llm_answer(prompt: str) -> str:
+    return "Synthetic answer based on the provided evidence."
+
+
+# ==============================================================================
+# 4. GẮN STAND-IN VÀO PIPELINE
+# ==============================================================================
+def install(kg: SyntheticKG, services: RemoteServicesStub, workdir: Path) -> InMemoryNeo4j:
+    """Thay mọi dependency ngoài (Neo4j, ARAX, SRI, model, UMLS, audit log) bằng stand-in offline."""
+    import spacy
+    import torch
+    import main
+    from src.modules import step0_preprocess, step1_extraction, step5_reasoning, step7_verification, step10_logging
+    from src.models.verifier import MultiSignalVerifier
+    from src.modules import step2_linking
+    from src.utils import arax_client, name_resolver, neo4j_connect
+    from src.utils.name_index import NameIndex
+    from src.utils.disk_cache import DiskCache
+    from src.utils.result_cache import PipelineResultCache
+    from src.utils.local_llm import local_llm
+    from src.core import config
+    from src.utils.model_registry import model_registry
+    from src.utils.umls_normalizer import umls_service
+
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    torch.manual_seed(0)
+
+    fake_db = InMemoryNeo4j(kg)
+    neo4j_connect.db_connector = fake_db
+    for name, module in list(sys.modules.items()):
+        if name == "main" or name.startswith("src."):
+            for attr in ("db_connector", "graph_db"):   # graph_db: backend đọc (src/utils/graph_store.py)
+                if hasattr(module, attr):
+                    setattr(module, attr, fake_db)
+
+    arax_client.ARAX_BASE_URL = f"{services.base_url}/arax"
+    arax_client.arax_client.cache = DiskCache(workdir / "arax_cache.sqlite", namespace="arax_kg2_pairs")
+    name_resolver.SRI_LOOKUP_URL = f"{services.base_url}/sri/lookup"
+    name_resolver.SRI_BULK_LOOKUP_URL = f"{services.base_url}/sri/bulk-lookup"
+    name_resolver.name_resolver.cache = DiskCache(workdir / "name_resolver.sqlite", namespace="sri_lookup")
+    main.result_cache = PipelineResultCache(workdir / "pipeline_results.sqlite")
+
+    # NameIndex riêng cho benchmark (snapshot trong workdir) -> dựng từ fake_db ở lần linking đầu tiên
+    (workdir / "name_index.json.gz").unlink(missing_ok=True)   # snapshot cũ có thể thuộc KG khác
+    step2_linking.name_index = NameIndex(workdir / "name_index.json.gz")
+    step2_linking._retriever = False   # không dùng FAISS index thật (nếu có) trong data/kg_index
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    step0_preprocess._resources.update({
+        "abbreviations": {}, "analyzer": _NoPHIAnalyzer(), "anonymizer": _PassThroughAnonymizer(),
+        "phi_operators": {}, "nlp": nlp,
+    })
+
+    step1_extraction._models.update({"gliner": DictionaryGliner(kg), "medspacy": None, "matcher": None})
+    step1_extraction._models_loaded = True
+
+    # Đặt model giả lập vào registry dưới đúng tên model thật -> Step 5/6/7 dùng chung như production
+    model_registry.register("sentence_transformer", config.SENTENCE_ENCODER_MODEL, HashEncoder())
+    model_registry.register("cross_encoder", config.RERANKER_MODEL, OverlapCrossEncoder())
+    model_registry.register("cross_encoder", config.NLI_MODEL_NAME, OverlapCrossEncoder(num_labels=3))
+    step5_reasoning.GNN_MODEL_PATH = workdir / "no_gnn_weights.pth"
+    step7_verification._resources["verifier_model"] = MultiSignalVerifier(input_dim=8).eval()
+    step7_verification._resources["precision"] = "fp32"
+
+    local_llm.generate_cot = fake_llm_answer
+    local_llm.generate_cot_batch = lambda prompts, batch_size=8: [fake_llm_answer(p) for p in prompts]
+
+    umls_service.disconnect()
+    umls_service.db_path = workdir / "no_umls.db"
+
+    step10_logging.run = functools.partial(step10_logging.run, output_dir=str(workdir / "audit_logs"))
+    main.step10_logging = step10_logging
+    return fake_db
@@ -0,0 +1,135 @@
+# benchmarks/synthetic_kg.py
+"""
+Sinh một đồ thị giả lập có "hình dạng" giống PrimeKG (loại node, loại quan hệ, phân bố bậc lệch
+với các node hub) để benchmark pipeline mà không cần Neo4j/PrimeKG thật.
+
+Các hub lớn nhất của mỗi loại node được đặt tên thật (warfarin, aspirin, hypertension...) để
+câu hỏi benchmark link được vào đúng các node có bậc cao nhất - trường hợp khó nhất cho Step 4/6.
+"""
+import numpy as np
+
+# (relation, source_type, target_type, tỷ lệ số cạnh) - lấy theo phân bố tương đối của PrimeKG
+RELATION_SCHEMA = [
+    ("ANATOMY_PROTEIN_PRESENT", "Anatomy", "Gene/Protein", 0.38),
+    ("DRUG_DRUG", "Drug", "Drug", 0.33),
+    ("PROTEIN_PROTEIN", "Gene/Protein", "Gene/Protein", 0.08),
+    ("DISEASE_PHENOTYPE_POSITIVE", "Disease", "Effect/Phenotype", 0.05),
+    ("DRUG_EFFECT", "Drug", "Effect/Phenotype", 0.05),
+    ("DISEASE_PROTEIN", "Disease", "Gene/Protein", 0.04),
+    ("INDICATION", "Drug", "Disease", 0.03),
+    ("CONTRAINDICATION", "Drug", "Disease", 0.03),
+    ("OFF-LABEL_USE", "Drug", "Disease", 0.01),
+]
+
+NODE_TYPE_SHARE = {
+    "Gene/Protein": 0.22, "Biological_Process": 0.22, "Effect/Phenotype": 0.12, "Disease": 0.14,
+    "Drug": 0.06, "Anatomy": 0.11, "Molecular_Function": 0.06, "Cellular_Component": 0.03,
+    "Pathway": 0.02, "Exposure": 0.02,
+}
+
+HUB_NAMES = {
+    "Drug": ["warfarin", "aspirin", "metformin", "lisinopril", "ibuprofen", "atorvastatin", "amlodipine", "omeprazole"],
+    "Disease": ["hypertension", "diabetes", "kidney disease", "asthma", "pterygium", "migraine", "heart failure"],
+    "Effect/Phenotype": ["bleeding", "nausea", "headache", "hypotension", "fatigue"],
+    "Gene/Protein": ["CYP2C9", "VKORC1", "PTGS1", "ACE"],
+    "Anatomy": ["liver", "kidney", "heart"],
+}
+
+QUERY_TEMPLATES = [
+    "Is it safe to take {drug_a} and {drug_b} together?",
+    "What are the treatments for {disease}?",
+    "Can the patient take {drug_a}?",
+    "Does {drug_a} cause {effect}?",
+]
+
+
+class SyntheticKG:
+    """Đồ thị dạng mảng: node (type, name) + cạnh (src, dst, rel) dưới dạng numpy arrays."""
+
+    def __init__(self, node_types, node_names, src, dst, rel_codes, rel_names):
+        self.node_types = node_types          # list[str], theo index node
+        self.node_names = node_names          # list[str], theo index node
+        self.src = src                        # np.int64[E]
+        self.dst = dst                        # np.int64[E]
+        self.rel_codes = rel_codes            # np.int16[E]
+        self.rel_names = rel_names            # list[str]
+        self.hub_names = {t: [n for n in names if n in set(node_names)] for t, names in HUB_NAMES.items()}
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_names)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.src)
+
+    def element_id(self, idx: int) -> str:
+        return f"4:synthetic:{idx}"
+
+
+def _zipf_weights(n: int, alpha: float) -> np.ndarray:
+    w = 1.0 / np.power(np.arange(1, n + 1, dtype=np.float64), alpha)
+    return w / w.sum()
+
+
+def generate(num_edges: int = 10_000, seed: int = 42, alpha: float = 1.1, edges_per_node: int = 30) -> SyntheticKG:
+    """
+    Sinh đồ thị với khoảng `num_edges` cạnh. Bậc node theo phân phối Zipf(`alpha`):
+    vài node đầu mỗi loại là hub rất lớn giống các thuốc/bệnh phổ biến trong PrimeKG.
+    """
+    rng = np.random.default_rng(seed)
+    num_nodes = max(200, num_edges // edges_per_node)
+
+    node_types, node_names, nodes_by_type = [], [], {}
+    for ntype, share in NODE_TYPE_SHARE.items():
+        count = max(len(HUB_NAMES.get(ntype, [])) + 5, int(num_nodes * share))
+        start = len(node_types)
+        nodes_by_type[ntype] = np.arange(start, start + count, dtype=np.int64)
+        hubs = HUB_NAMES.get(ntype, [])
+        for i in range(count):
+            node_types.append(ntype)
+            node_names.append(hubs[i] if i < len(hubs) else f"{ntype.lower()} {i}")
+
+    src_parts, dst_parts, rel_parts = [], [], []
+    rel_names = [r[0] for r in RELATION_SCHEMA]
+    for code, (rel, s_type, t_type, share) in enumerate(RELATION_SCHEMA):
+        m = max(1, int(num_edges * share))
+        s_pool, t_pool = nodes_by_type[s_type], nodes_by_type[t_type]
+        s = s_pool[rng.choice(len(s_pool), size=m, p=_zipf_weights(len(s_pool), alpha))]
+        t = t_pool[rng.choice(len(t_pool), size=m, p=_zipf_weights(len(t_pool), alpha))]
+        keep = s != t
+        src_parts.append(s[keep])
+        dst_parts.append(t[keep])
+        rel_parts.append(np.full(int(keep.sum()), code, dtype=np.int16))
+
+    # Đảm bảo luôn có tương tác warfarin <-> aspirin để Step 9 có việc để làm
+    drugs = nodes_by_type["Drug"]
+    src_parts.append(np.array([drugs[0]], dtype=np.int64))
+    dst_parts.append(np.array([drugs[1]], dtype=np.int64))
+    rel_parts.append(np.array([rel_names.index("DRUG_DRUG")], dtype=np.int16))
+
+    return SyntheticKG(
+        node_types=node_types,
+        node_names=node_names,
+        src=np.concatenate(src_parts),
+        dst=np.concatenate(dst_parts),
+        rel_codes=np.concatenate(rel_parts),
+        rel_names=rel_names,
+    )
+
+
+def generate_queries(kg: SyntheticKG, n: int, seed: int = 0) -> list:
+    """Sinh `n` câu hỏi cố định (deterministic) nhắm vào các node hub của đồ thị."""
+    rng = np.random.default_rng(seed)
+    drugs, diseases = kg.hub_names["Drug"], kg.hub_names["Disease"]
+    effects = kg.hub_names["Effect/Phenotype"]
+    queries = []
+    for i in range(n):
+        template = QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)]
+        a, b = rng.choice(len(drugs), size=2, replace=False)
+        queries.append(template.format(
+            drug_a=drugs[a], drug_b=drugs[b],
+            disease=diseases[rng.integers(len(diseases))],
+            effect=effects[rng.integers(len(effects))],
+        ))
+    return queries
@@ -3,8 +3,8 @@ import logging
 import sys
 import time
 import argparse
+import json
 import os
-from concurrent.futures import ThreadPoolExecutor
 
 # --- 1. ĐỊNH NGHĨA BỘ LỌC RÁC (Custom Filter) ---
 class AntiNoiseFilter(logging.Filter):
@@ -46,66 +46,288 @@ for handler in root_logger.handlers:
 
 # --- 3. IMPORT CÁC MODULE CỦA PIPELINE ---
 from src.core.state import MedCOTState
+from src.core.executor import DAGExecutor
 from src.modules import (
     step0_preprocess, step1_extraction, step2_linking, 
     step4_retrieval, step5_reasoning, step6_path_generation, 
     step7_verification, step8_synthesis, step9_safety, step10_logging
 )
 from src.utils.neo4j_connect import db_connector
+from src.utils.graph_store import graph_db
+from src.utils.umls_normalizer import umls_service
+from src.utils.local_llm import local_llm
+from src.modules.step10_logging import clean_for_json
+from src.utils.profiler import PipelineProfiler, profiling, span
+from src.utils.model_registry import model_registry
+from src.utils.result_cache import result_cache
+from src.utils.cpu_inference import configure_threads
+from src.core.config import RESULT_CACHE_ENABLED
 
 logger = logging.getLogger("MED-COT_MAIN")
 
+# --- 3b. NẠP TRƯỚC TOÀN BỘ MODEL (WARM-UP) ---
+def warmup_models(load_llm: bool = True) -> dict:
+    """
+    Nạp trước tất cả singleton `_resources`/`_models` của các bước để các query
+    sau không phải chịu chi phí cold start. Trả về thời gian nạp (giây) của từng nhóm.
+    """
+    loaders = [
+        ("0_preprocess", step0_preprocess.load_resources),
+        ("1_extraction", step1_extraction.load_models_bulletproof),
+        ("5_reasoning", step5_reasoning.load_resources),
+        ("6_path_generation", step6_path_generation.load_models),
+        ("7_verification", step7_verification.load_resources),
+        ("umls", umls_service.connect),
+        ("name_index", lambda: step2_linking.name_index.ensure_loaded(graph_db)),
+    ]
+    if load_llm:
+        loaders.append(("local_llm", local_llm.load_model))
+
+    configure_threads()   # TORCH_NUM_THREADS (MEDCOT_TORCH_THREADS) cho worker này
+    timings = {}
+    for name, loader in loaders:
+        t0 = time.time()
+        loader()
+        timings[name] = round(time.time() - t0, 2)
+        logger.info(f"🔥 Warmed up {name} in {timings[name]:.2f}s")
+    for m in model_registry.footprint():
+        logger.info(f"📦 Shared model '{m['name']}' ({m['kind']}, {m['device']}): {m['size_mb']} MB")
+    return timings
+
 # --- 4. HÀM CHẠY PIPELINE CHÍNH ---
+def _run_stage(name: str, step_fn, state: MedCOTState) -> MedCOTState:
+    with span(name):
+        return step_fn(state)
+
+def _record_profile(profiler: PipelineProfiler, states: list, cfg: dict):
+    """Ghi số liệu profiling vào state.logs và (tuỳ chọn) xuất file Prometheus/Chrome trace."""
+    metadata = {"profile": profiler.summary(), "batch_size": len(states)}
+    if cfg.get("profile_dir"):
+        try:
+            metadata["exports"] = profiler.export(cfg["profile_dir"], profiler.label)
+        except OSError as e:
+            logger.error(f"Could not export profile: {e}")
+    for state in states:
+        state.log("PROFILE", "SUCCESS", metadata=metadata)
+
+def _prefetch_definitions(states: list) -> dict:
+    """Lấy trước định nghĩa UMLS cho Step 8 (chỉ cần kết quả Step 2). Lỗi -> Step 8 tự lấy lại."""
+    with span("8_DEFINITIONS"):
+        definitions = {}
+        for state in states:
+            try:
+                definitions[state.query_id] = step8_synthesis.collect_definitions(state)
+            except Exception as e:
+                logger.warning(f"Could not prefetch UMLS definitions for '{state.raw_query}': {e}")
+        return definitions
+
+def _build_pipeline_dag(state: MedCOTState, use_gcot: bool, retrieval_fn=step4_retrieval.run) -> DAGExecutor:
+    """
+    Step 4 -> 9 dưới dạng DAG: chuỗi retrieval/reasoning chạy tuần tự, còn việc tra định nghĩa UMLS
+    cho Step 8 (chỉ phụ thuộc Step 2) chạy song song với chuỗi đó.
+    """
+    dag = DAGExecutor(name="pipeline")
+    dag.add("8_DEFINITIONS", lambda r: _prefetch_definitions([state]))
+
+    chain = [("4_RETRIEVAL", retrieval_fn)]
+    if use_gcot:
+        chain.append(("5_REASONING", step5_reasoning.run))
+    chain += [
+        ("6_PATH_GEN", step6_path_generation.run),
+        ("7_VERIFICATION", step7_verification.run),
+        # Chạy safety check lần 1 để tạo `safety_flags` cho prompt của LLM
+        ("9_SAFETY_PRE", step9_safety.run),
+    ]
+    prev = None
+    for name, step_fn in chain:
+        dag.add(name, lambda r, name=name, step_fn=step_fn, prev=prev: _run_stage(name, step_fn, r[prev] if prev else state),
+                deps=[prev] if prev else [])
+        prev = name
+
+    # Tổng hợp câu trả lời dựa trên tất cả bằng chứng, bao gồm cả safety_flags
+    dag.add("8_SYNTHESIS",
+            lambda r: _run_stage("8_SYNTHESIS", lambda s: step8_synthesis.run(s, definitions=r["8_DEFINITIONS"]), r[prev]),
+            deps=[prev, "8_DEFINITIONS"])
+    # Chạy safety check lần 2 để đảm bảo khối cảnh báo được chèn vào đầu câu trả lời cuối cùng
+    dag.add("9_SAFETY_POST", lambda r: _run_stage("9_SAFETY_POST", step9_safety.run, r["8_SYNTHESIS"]), deps=["8_SYNTHESIS"])
+    return dag
+
 def run_pipeline(query: str, patient_context: str = None, config: dict = None):
-    if not db_connector:
+    if not graph_db:
         logger.critical("❌ Kết nối Neo4j thất bại. Dừng pipeline.")
         return None
         
     cfg = config or {}
     use_gcot = cfg.get("use_gcot", True)
+    use_cache = cfg.get("use_cache", RESULT_CACHE_ENABLED)
     
     logger.info(f"{'='*50}\n🚀 RUNNING PIPELINE (FINAL CLEAN)\n🚀 QUERY: '{query}'\n{'='*50}")
     state = MedCOTState(raw_query=query, patient_context=patient_context)
+    profiler = PipelineProfiler(label=state.query_id)
     start_time = time.time()
     
     try:
-        logger.info("\n--- 🏁 PHASE 1: DATA PREPARATION ---")
-        state = step0_preprocess.run(state)
-        state = step1_extraction.run(state)
-        state = step2_linking.run(state)
-        
-        logger.info("\n--- ⚡ PHASE 2: REASONING & RETRIEVAL ---")
-        state = step4_retrieval.run(state)
-        
-        if use_gcot:
-            state = step5_reasoning.run(state)
-            
-        state = step6_path_generation.run(state)
-        state = step7_verification.run(state)
-        
-        # --- SỬA ĐỔI THỨ TỰ THỰC THI ---
-        logger.info("\n--- 🔬 PHASE 3: SYNTHESIS & SAFETY ---")
-        # Chạy safety check lần 1 để tạo `safety_flags` cho prompt của LLM
-        state = step9_safety.run(state)
-        
-        # Tổng hợp câu trả lời dựa trên tất cả bằng chứng, bao gồm cả safety_flags
-        state = step8_synthesis.run(state)
-        
-        # Chạy safety check lần 2 để đảm bảo khối cảnh báo được chèn vào đầu câu trả lời cuối cùng
-        state = step9_safety.run(state)
-        # -------------------------------
+        with profiling(profiler):
+            logger.info("\n--- 🏁 PHASE 1: DATA PREPARATION ---")
+            state = _run_stage("0_PREPROCESS", step0_preprocess.run, state)
+            # Key cache dựa trên query đã che PHI (kết quả Step 0)
+            cached = result_cache.get_result(state, cfg) if use_cache else None
+            if cached is not None:
+                logger.info("♻️ Result cache hit: skipping steps 1 -> 9.")
+                state = cached
+                state.log("RESULT_CACHE", "CACHE_HIT")
+            else:
+                extract = lambda s: _run_stage("1_EXTRACTION", step1_extraction.run, s)
+                link = lambda s: _run_stage("2_LINKING", step2_linking.run, s)
+                state = result_cache.linking_stage(extract, link)(state) if use_cache else link(extract(state))
 
-        logger.info("\n--- 📝 PHASE 4: LOGGING ---")
-        step10_logging.run(state)
+                logger.info("\n--- ⚡ PHASE 2+3: RETRIEVAL, REASONING, SYNTHESIS & SAFETY ---")
+                retrieval_fn = result_cache.retrieval_stage(step4_retrieval.run) if use_cache else step4_retrieval.run
+                state = _build_pipeline_dag(state, use_gcot, retrieval_fn).run()["9_SAFETY_POST"]
+                if use_cache:
+                    result_cache.set_result(state, cfg)
+
+            logger.info("\n--- 📝 PHASE 4: LOGGING ---")
+            _run_stage("10_LOGGING", step10_logging.run, state)
 
     except Exception as e:
         logger.exception(f"Critical pipeline error: {e}")
     finally:
         total_time = time.time() - start_time
+        _record_profile(profiler, [state], cfg)
         logger.info(f"\n{'='*50}\n🏁 PIPELINE FINISHED IN {total_time:.2f} SECONDS\n{'='*50}")
     
     return state
 
+# --- 4b. CHẠY PIPELINE THEO BATCH ---
+def _run_each(name: str, step_fn, states):
+    """Chạy một bước cho từng state; state nào lỗi sẽ bị loại khỏi các bước sau."""
+    survivors = []
+    with span(name):
+        for state in states:
+            try:
+                survivors.append(step_fn(state))
+            except Exception as e:
+                logger.exception(f"Pipeline error for query '{state.raw_query}': {e}")
+    return survivors
+
+def _run_each_concurrently(name: str, step_fn, states):
+    """Như `_run_each` nhưng chạy các state song song (dành cho bước chủ yếu chờ I/O như Step 4)."""
+    if len(states) <= 1: return _run_each(name, step_fn, states)
+    dag = DAGExecutor(name=name)
+    for i, state in enumerate(states):
+        dag.add(str(i), lambda r, state=state: _run_each(f"{name}.query", step_fn, [state]))
+    with span(name):
+        results = dag.run()
+    return [s for i in range(len(states)) for s in results[str(i)]]
+
+def _run_batched(name: str, step_module, states, **kwargs):
+    """Chạy `run_batch` của một bước; nếu cả batch lỗi thì quay về chạy từng state."""
+    if not states: return states
+    try:
+        with span(name):
+            return step_module.run_batch(states, **kwargs)
+    except Exception as e:
+        logger.exception(f"Batch execution of {step_module.__name__} failed ({e}). Falling back to per-query runs.")
+        return _run_each(name, lambda s: step_module.run(s, **kwargs), states)
+
+def run_pipeline_batch(queries: list, config: dict = None) -> list:
+    """
+    Chạy pipeline cho N query cùng lúc. Mỗi bước có model (GLiNER, encoder, reranker,
+    NLI, verifier, LLM) gom input của tất cả state vào một lần forward rồi trả kết quả về từng state.
+
+    `queries`: list các chuỗi hoặc dict {"query": ..., "context": ...}.
+    Trả về list state theo đúng thứ tự đầu vào (None cho query bị lỗi).
+    """
+    if not graph_db:
+        logger.critical("❌ Kết nối Neo4j thất bại. Dừng pipeline.")
+        return [None] * len(queries)
+
+    cfg = config or {}
+    use_gcot = cfg.get("use_gcot", True)
+    use_cache = cfg.get("use_cache", RESULT_CACHE_ENABLED)
+    retrieval_fn = result_cache.retrieval_stage(step4_retrieval.run) if use_cache else step4_retrieval.run
+
+    states = []
+    for q in queries:
+        if isinstance(q, dict):
+            states.append(MedCOTState(raw_query=q["query"], patient_context=q.get("context")))
+        else:
+            states.append(MedCOTState(raw_query=q))
+
+    logger.info(f"{'='*50}\n🚀 RUNNING PIPELINE BATCH ({len(states)} queries)\n{'='*50}")
+    profiler = PipelineProfiler(label=f"batch_{states[0].query_id}" if states else "batch")
+    start_time = time.time()
+
+    with profiling(profiler):
+        active = _run_each("0_PREPROCESS", step0_preprocess.run, states)
+        # Query đã có kết quả trong cache không đi qua các bước 1 -> 9
+        cached = {}
+        if use_cache:
+            for state in active:
+                hit = result_cache.get_result(state, cfg)
+                if hit is not None:
+                    hit.log("RESULT_CACHE", "CACHE_HIT")
+                    cached[id(state)] = hit
+            active = [s for s in active if id(s) not in cached]
+        extract = lambda batch: _run_batched("1_EXTRACTION", step1_extraction, batch)
+        link = lambda batch: _run_each("2_LINKING", step2_linking.run, batch)
+        active = result_cache.linking_stage_batch(extract, link)(active) if use_cache else link(extract(active))
+
+        def _retrieval_to_safety(linked):
+            batch = _run_each_concurrently("4_RETRIEVAL", retrieval_fn, linked)
+            if use_gcot:
+                batch = _run_batched("5_REASONING", step5_reasoning, batch)
+            batch = _run_batched("6_PATH_GEN", step6_path_generation, batch)
+            batch = _run_batched("7_VERIFICATION", step7_verification, batch)
+            return _run_each("9_SAFETY_PRE", step9_safety.run, batch)
+
+        # Định nghĩa UMLS cho Step 8 được lấy song song với Step 4 -> 9
+        dag = DAGExecutor(name="pipeline_batch")
+        dag.add("8_DEFINITIONS", lambda r, linked=active: _prefetch_definitions(linked))
+        dag.add("4_TO_9", lambda r, linked=active: _retrieval_to_safety(linked))
+        results = dag.run()
+        active = _run_batched("8_SYNTHESIS", step8_synthesis, results["4_TO_9"], definitions=results["8_DEFINITIONS"])
+        active = _run_each("9_SAFETY_POST", step9_safety.run, active)
+        if use_cache:
+            for state in active:
+                result_cache.set_result(state, cfg)
+        active = _run_each("10_LOGGING", step10_logging.run, active + list(cached.values()))
+
+    total_time = time.time() - start_time
+    _record_profile(profiler, active, cfg)
+    logger.info(f"\n{'='*50}\n🏁 PIPELINE BATCH FINISHED IN {total_time:.2f} SECONDS "
+                f"({len(active)}/{len(states)} ok, {len(states) / max(total_time, 1e-9):.2f} queries/s)\n{'='*50}")
+
+    alive = {id(s) for s in active}
+    return [cached[id(s)] if id(s) in cached else (s if id(s) in alive else None) for s in states]
+
+def load_queries_file(path: str) -> list:
+    """Đọc file query: mỗi dòng là JSON {"query", "context"} hoặc một câu hỏi dạng text thuần."""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            if line.startswith("{"):
+                queries.append(json.loads(line))
+            else:
+                queries.append(line)
+    return queries
+
+def summarize_state(state: MedCOTState) -> dict:
+    """Chỉ giữ các trường kết quả (bỏ embeddings/subgraph nặng) để trả về hoặc ghi file."""
+    return clean_for_json({
+        "query_id": state.query_id,
+        "query": state.raw_query,
+        "final_answer": state.final_answer,
+        "reasoning_mode": state.reasoning_mode,
+        "global_confidence": state.global_confidence,
+        "verified_path": state.verified_path,
+        "safety_flags": state.safety_flags,
+        "logs": state.logs,
+    })
+
 # --- 5. HÀM HIỂN THỊ KẾT QUẢ ---
 def inspect_and_display(state: MedCOTState):
     """In kết quả cuối cùng ra màn hình console một cách đẹp mắt."""
@@ -123,15 +345,35 @@ def inspect_and_display(state: MedCOTState):
 # ==============================================================================
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the full MedCOT Neuro-Symbolic Pipeline.")
-    parser.add_argument("--query", type=str, required=True, help="The medical question to analyze.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--query", type=str, help="The medical question to analyze.")
+    source.add_argument("--input-file", type=str, help="File with one query per line (plain text or JSON {\"query\", \"context\"}).")
     parser.add_argument("--context", type=str, default=None, help="(Optional) Patient-specific context.")
     parser.add_argument("--no-gcot", action="store_true", help="(Optional) Disable the GNN reasoning step (Step 5).")
+    parser.add_argument("--batch-size", type=int, default=32, help="(Batch mode) Number of queries processed together.")
+    parser.add_argument("--output-file", type=str, default=None, help="(Batch mode) Write one JSON result per line instead of printing.")
+    parser.add_argument("--profile-dir", type=str, default=None, help="(Optional) Export per-stage profiles as Prometheus text and Chrome trace files.")
     args = parser.parse_args()
+    run_config = {"use_gcot": not args.no_gcot, "profile_dir": args.profile_dir}
     
-    final_state = run_pipeline(query=args.query, patient_context=args.context, config={"use_gcot": not args.no_gcot})
-    
-    if final_state:
-        inspect_and_display(final_state)
+    if args.input_file:
+        all_queries = load_queries_file(args.input_file)
+        out_f = open(args.output_file, "w", encoding="utf-8") if args.output_file else None
+        try:
+            for i in range(0, len(all_queries), args.batch_size):
+                for state in run_pipeline_batch(all_queries[i:i + args.batch_size], config=run_config):
+                    if state is None: continue
+                    if out_f:
+                        out_f.write(json.dumps(summarize_state(state), ensure_ascii=False) + "\n")
+                    else:
+                        inspect_and_display(state)
+        finally:
+            if out_f: out_f.close()
+    else:
+        final_state = run_pipeline(query=args.query, patient_context=args.context, config=run_config)
+        
+        if final_state:
+            inspect_and_display(final_state)
         
     if db_connector:
         db_connector.close()
\ No newline at end of file
@@ -29,14 +29,15 @@ if missing_cols:
 
 # --- 2. XỬ LÝ NODES (TẠO nodes.csv) ---
 print("🔨 Đang xử lý Nodes...")
+# `id:ID`: neo4j-admin lưu id gốc vào thuộc tính `id` -> coalesce(n.id, elementId(n)) trùng với node_id của graph store nhúng
 nodes_x = df[['x_id', 'x_type', 'x_name', 'x_source']].rename(columns={
-    'x_id': ':ID', 'x_type': ':LABEL', 'x_name': 'name', 'x_source': 'source'
+    'x_id': 'id:ID', 'x_type': ':LABEL', 'x_name': 'name', 'x_source': 'source'
 })
 nodes_y = df[['y_id', 'y_type', 'y_name', 'y_source']].rename(columns={
-    'y_id': ':ID', 'y_type': ':LABEL', 'y_name': 'name', 'y_source': 'source'
+    'y_id': 'id:ID', 'y_type': ':LABEL', 'y_name': 'name', 'y_source': 'source'
 })
 all_nodes = pd.concat([nodes_x, nodes_y], ignore_index=True)
-all_nodes.drop_duplicates(subset=[':ID'], inplace=True)
+all_nodes.drop_duplicates(subset=['id:ID'], inplace=True)
 all_nodes[':LABEL'] = all_nodes[':LABEL'].apply(lambda x: str(x).title())
 nodes_path = os.path.join(OUTPUT_DIR, "nodes.csv")
 all_nodes.to_csv(nodes_path, index=False)
@@ -86,4 +87,11 @@ edges_path = os.path.join(OUTPUT_DIR, "edges.csv")
 edges.to_csv(edges_path, index=False)
 print(f"✅ Đã lưu {len(edges)} edges (với đầy đủ thuộc tính) vào: {edges_path}")
 
+# --- 4. GRAPH STORE NHÚNG (đường đọc không cần Neo4j, bật bằng MEDCOT_GRAPH_BACKEND=embedded) ---
+print("🔨 Đang dựng graph store nhúng (CSR memory-mapped)...")
+from src.core import config
+from src.utils.graph_store import build_from_csv
+manifest = build_from_csv(nodes_path, edges_path, config.GRAPH_STORE_DIR)
+print(f"✅ Đã lưu graph store ({manifest['num_nodes']} nodes, {manifest['num_edges']} edges) vào: {config.GRAPH_STORE_DIR}")
+
 print("🎉 PREPROCESSING HOÀN TẤT!")
\ No newline at end of file
@@ -19,6 +19,24 @@ logging.basicConfig(level=logging.ERROR)
 INPUT_PARQUET = "data/medical_o1_vi_translated_EVALUATED_GEMINI.parquet"
 OUTPUT_JSONL = "data/medcot_rich_training_data.jsonl"
 
+BATCH_SIZE = 32  # Số câu hỏi chạy chung một lần cho các bước có model (GNN, path gen, verifier)
+
+def _trace_info(state: MedCOTState):
+    path_text = ""
+    # state.gcot['verified_path_text'] được gán trong step7
+    if state.gcot.get('verified_path_text'):
+        path_text = state.gcot['verified_path_text']
+    elif state.candidate_paths:
+        path_text = state.candidate_paths[0].get('text_repr', "")
+
+    return {
+        "query": state.raw_query,
+        "seed_nodes": [e.best_candidate.preferred_name for e in state.linked_entities if e.link_status == 'linked'],
+        "graph_context": state.gcot.get("graph_tokens", ""),
+        "verified_path_text": path_text, # Tên cột quan trọng
+        "confidence": state.global_confidence
+    }
+
 def generate_raw_trace(query: str):
     """
     Chạy pipeline MedCOT (Step 0 -> Step 7) để lấy dữ liệu thô từ Knowledge Graph.
@@ -33,25 +51,34 @@ def generate_raw_trace(query: str):
         state = step5_reasoning.run(state)
         state = step6_path_generation.run(state)
         state = step7_verification.run(state)
-        
-        path_text = ""
-        # state.gcot['verified_path_text'] được gán trong step7
-        if state.gcot.get('verified_path_text'):
-            path_text = state.gcot['verified_path_text']
-        elif state.candidate_paths:
-            path_text = state.candidate_paths[0].get('text_repr', "")
-
-        raw_info = {
-            "query": query,
-            "seed_nodes": [e.best_candidate.preferred_name for e in state.linked_entities if e.link_status == 'linked'],
-            "graph_context": state.gcot.get("graph_tokens", ""),
-            "verified_path_text": path_text, # Tên cột quan trọng
-            "confidence": state.global_confidence
-        }
-        return raw_info
+        return _trace_info(state)
     except Exception as e:
         return None
 
+def generate_raw_traces(queries: list) -> list:
+    """
+    Như `generate_raw_trace` cho nhiều câu hỏi: Step 0 -> 4 chạy từng câu, Step 5 -> 7 chạy theo batch
+    (GNN gộp các đồ thị thành một batch PyG). Batch lỗi -> chạy lại từng câu.
+    """
+    states = {}
+    for i, query in enumerate(queries):
+        try:
+            state = MedCOTState(raw_query=query)
+            state = step0_preprocess.run(state)
+            state = step1_extraction.run(state)
+            state = step2_linking.run(state)
+            states[i] = step4_retrieval.run(state)
+        except Exception:
+            pass
+    try:
+        batch = step5_reasoning.run_batch(list(states.values()))
+        batch = step6_path_generation.run_batch(batch)
+        batch = step7_verification.run_batch(batch)
+        infos = dict(zip(states, (_trace_info(s) for s in batch)))
+    except Exception:
+        return [generate_raw_trace(q) for q in queries]
+    return [infos.get(i) for i in range(len(queries))]
+
 def normalize_cot_with_llm(raw_info):
     """
     Sử dụng Local LLM để viết lại suy luận.
@@ -99,9 +126,11 @@ def main():
     results = []
     
     print("running...")
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Generating Rich Traces"):
-        raw_trace_info = generate_raw_trace(row['Question'])
-        
+    raw_traces = []
+    for start in tqdm(range(0, len(df), BATCH_SIZE), desc="Graph traces (batched)"):
+        raw_traces.extend(generate_raw_traces(df['Question'].iloc[start:start + BATCH_SIZE].tolist()))
+
+    for idx, (row, raw_trace_info) in enumerate(tqdm(zip(df.to_dict("records"), raw_traces), total=len(df), desc="Generating Rich Traces")):
         if raw_trace_info:
             normalized_medcot = normalize_cot_with_llm(raw_trace_info)
         else:
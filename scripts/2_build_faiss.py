@@ -1,38 +1,504 @@
 # run/build_faiss_index.py
+import argparse
 import json
 import logging
+import time
 import numpy as np
 import faiss
 import os
+import queue
+import shutil
+import threading
 from pathlib import Path
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 from src.utils.neo4j_connect import db_connector
+from src.utils.faiss_index import (
+    DEFAULT_PARAMS, INDEX_TYPES, base_index, create_index, params_path, read_index, read_manifest,
+    save_params, set_search_params, with_ids, write_manifest,
+)
+from src.utils.node_meta_store import NodeMetaStore, NodeMetaWriter
 
 # --- CONFIG ---
 MODEL_NAME = "BAAI/bge-small-en-v1.5" # Model nhỏ, nhanh, hiệu quả
 OUTPUT_DIR = Path("data/kg_index")
-INDEX_PATH = OUTPUT_DIR / "kg_faiss.index"
-META_PATH = OUTPUT_DIR / "kg_nodes_meta.json"
+# Mỗi lần build/cập nhật tạo một phiên bản mới: kg_faiss.v<N>.index + kg_nodes_meta.v<N>/ (store dạng cột,
+# memory-mapped, src/utils/node_meta_store.py); kg_index_manifest.json trỏ tới phiên bản hiện hành.
+CHANGELOG_PATH = OUTPUT_DIR / "changelog.jsonl"  # Tuỳ chọn: {"op": "delete"|"upsert", "node_id": "<node_id>"} mỗi dòng
+EVAL_PATH = OUTPUT_DIR / "kg_faiss.eval.json"
+EMBEDDINGS_TMP_PATH = OUTPUT_DIR / "embeddings.tmp.f32"
 BATCH_SIZE = 5000  # Xử lý 5000 node mỗi lần để tiết kiệm RAM
+FETCH_SIZE = 10_000        # Số record kéo về mỗi lần từ cursor Neo4j
+QUEUE_DEPTH = 4            # Số batch tối đa chờ giữa các stage
+CHECKPOINT_EVERY = 100_000 # Ghi checkpoint sau mỗi N node
+MAX_STREAM_RETRIES = 5
+ADD_CHUNK = 50_000 # Số vector add vào index mỗi lần
+EMBEDDING_DIM = 384
+COMPACT_DELETED_RATIO = 0.2  # Tự compact sau khi cập nhật nếu tỷ lệ dòng tombstone vượt ngưỡng này
+# Metadata lưu node_id = coalesce(n.id, elementId(n)) (giống seed của Step 2/4 trên mọi backend);
+# index của manifest không ghi id_space (lưu elementId) phải build lại toàn bộ
+ID_SPACE = "node_id"
+
+# Giá trị quét khi đánh giá recall@k vs latency
+NPROBE_SWEEP = [1, 4, 8, 16, 32, 64, 128, 256]
+EF_SEARCH_SWEEP = [16, 32, 64, 128, 256, 512]
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("FAISS_BUILDER")
 
-def main():
-    # 1. Kiểm tra nếu Index đã tồn tại thì Skip
-    if INDEX_PATH.exists() and META_PATH.exists():
-        print(f"\n⏩ [SKIP] FAISS Index đã tồn tại tại: {OUTPUT_DIR}")
-        print("👉 Nếu bạn vừa nạp dữ liệu mới và muốn build lại, hãy xóa thư mục 'data/kg_index' rồi chạy lại script này.")
+# Node được tạo/sửa sau watermark (ingest_custom_data.py gán updated_at = timestamp())
+CHANGED_QUERY = """
+MATCH (n)
+WHERE n.name IS NOT NULL AND n.updated_at > $since
+RETURN coalesce(n.id, elementId(n)) AS node_id, labels(n) AS labels, n.name AS name
+"""
+NODES_BY_ID_QUERY = """
+MATCH (n) WHERE (n.id IN $ids OR elementId(n) IN $ids) AND n.name IS NOT NULL
+RETURN coalesce(n.id, elementId(n)) AS node_id, labels(n) AS labels, n.name AS name
+"""
+
+# Một cursor duy nhất, keyset theo elementId: resume chỉ cần nhớ elementId cuối cùng
+# (thay cho SKIP/LIMIT, vốn phải sắp xếp lại và bỏ qua mọi dòng trước đó ở mỗi batch -> O(N^2))
+STREAM_QUERY = """
+MATCH (n)
+WHERE n.name IS NOT NULL AND elementId(n) > $after
+RETURN elementId(n) AS element_id, coalesce(n.id, elementId(n)) AS node_id, labels(n) AS labels, n.name AS name
+ORDER BY elementId(n)
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build FAISS index cho toàn bộ node có tên trong Neo4j.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="flat (brute-force), ivf_flat, ivf_pq, hnsw")
+    parser.add_argument("--nlist", type=int, default=None, help="Số cụm IVF (mặc định ~4*sqrt(N))")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_PARAMS["nprobe"], help="Số cụm IVF được quét khi search")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PARAMS["pq_m"], help="Số sub-quantizer PQ (= byte/vector, phải chia hết 384)")
+    parser.add_argument("--pq-bits", type=int, default=DEFAULT_PARAMS["pq_bits"])
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_PARAMS["hnsw_m"])
+    parser.add_argument("--ef-construction", type=int, default=DEFAULT_PARAMS["ef_construction"])
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_PARAMS["ef_search"])
+    parser.add_argument("--train-size", type=int, default=100_000, help="Số vector ngẫu nhiên dùng để train IVF/PQ")
+    parser.add_argument("--eval-queries", type=int, default=1000, help="Số query held-out để đo recall@k vs latency (0 = bỏ qua)")
+    parser.add_argument("--eval-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="Build lại toàn bộ thay vì cập nhật tăng dần khi index đã tồn tại")
+    parser.add_argument("--restart", action="store_true", help="Bỏ qua checkpoint của lần build dở trước, encode lại từ đầu")
+    parser.add_argument("--compact", action="store_true", help="Bỏ hẳn các dòng/vector tombstone của index hiện hành (không encode lại)")
+    return parser.parse_args()
+
+_DONE = object()
+
+def _put(q, item, stop):
+    """queue.put nhưng dừng được khi stage khác đã lỗi (tránh treo thread)."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop):
+    while True:
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            if stop.is_set():
+                raise RuntimeError("Pipeline stopped because another stage failed.")
+
+def _fetch_batches(after, out_q, stop):
+    """
+    Stage 1 (thread): stream node từ Neo4j trên MỘT cursor, sắp theo elementId (keyset) và gom thành batch.
+    Kết nối rớt giữa chừng -> mở lại cursor từ elementId cuối cùng đã đọc.
+    """
+    batch, attempts = [], 0
+    try:
+        while True:
+            try:
+                for r in db_connector.stream_query(STREAM_QUERY, {"after": after}, fetch_size=FETCH_SIZE):
+                    lbls = r.get("labels") or []
+                    batch.append({"node_id": str(r.get("node_id")), "element_id": r.get("element_id"), "labels": lbls, "name": r.get("name", "Unknown")})
+                    after = batch[-1]["element_id"]
+                    if len(batch) == BATCH_SIZE:
+                        if not _put(out_q, batch, stop): return
+                        batch, attempts = [], 0
+                break
+            except Exception as e:
+                attempts += 1
+                if attempts > MAX_STREAM_RETRIES: raise
+                logger.warning(f"⚠️ Neo4j stream interrupted ({e}). Resuming after {after!r} ({attempts}/{MAX_STREAM_RETRIES})...")
+                time.sleep(2 * attempts)
+        if batch and not _put(out_q, batch, stop): return
+        _put(out_q, _DONE, stop)
+    except BaseException as e:
+        _put(out_q, e, stop)
+
+def _write_batches(in_q, f_vec, meta_writer, after, stop, errors):
+    """Stage 3 (thread): ghi vector + metadata, checkpoint định kỳ (và khi xong) để có thể resume."""
+    try:
+        since_checkpoint = 0
+        while True:
+            item = _get(in_q, stop)
+            if item is _DONE:
+                # Checkpoint cuối: nếu bước build index sau đó bị lỗi, chạy lại không phải encode lại
+                _checkpoint(f_vec, meta_writer, after)
+                break
+            rows, embeddings = item
+            after = rows[-1]["element_id"]
+            f_vec.write(np.ascontiguousarray(embeddings, dtype="float32").tobytes())
+            for r in rows:
+                meta_writer.append(r["node_id"], r["labels"], r["name"])
+            since_checkpoint += len(rows)
+            if since_checkpoint >= CHECKPOINT_EVERY:
+                _checkpoint(f_vec, meta_writer, after)
+                since_checkpoint = 0
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+
+def _checkpoint(f_vec, meta_writer, after):
+    # Vector phải xuống đĩa TRƯỚC checkpoint của metadata (checkpoint là thứ quyết định vị trí resume)
+    f_vec.flush()
+    os.fsync(f_vec.fileno())
+    meta_writer.checkpoint(after=after, model=MODEL_NAME, dim=EMBEDDING_DIM, id_space=ID_SPACE)
+    logger.info(f"💾 Checkpoint: {meta_writer.count} nodes (after {after}).")
+
+def version_paths(version: int):
+    return OUTPUT_DIR / f"kg_faiss.v{version}.index", OUTPUT_DIR / f"kg_nodes_meta.v{version}"
+
+def next_version(manifest) -> int:
+    """Phiên bản kế tiếp chưa có trên đĩa (bản đã ghi nhưng chưa kịp công bố của lần chạy bị ngắt không bị ghi đè)."""
+    version = manifest["version"] + 1
+    while any(path.exists() for path in version_paths(version)):
+        version += 1
+    return version
+
+def db_timestamp() -> int:
+    """Thời điểm hiện tại theo đồng hồ của Neo4j (ms), dùng làm watermark."""
+    return db_connector.run_query("RETURN timestamp() AS now")[0]["now"]
+
+def encode_texts(encoder, rows):
+    # Text để embed: "Name (Label)"
+    texts = [f"{r['name']} ({r['labels'][0] if r['labels'] else 'Unknown'})" for r in rows]
+    return encoder.encode(
+        texts,
+        batch_size=256,
+        show_progress_bar=False,
+        normalize_embeddings=True # Quan trọng cho Inner Product/Cosine
+    )
+
+def publish(index, meta_writer, version: int, watermark: int, params: dict, stale_vectors: int = 0):
+    """
+    Công bố phiên bản mới: ghi index + metadata dưới tên mới, đổi manifest (nguyên tử) rồi mới xoá phiên bản cũ.
+    Reader (FaissSearch) luôn thấy một cặp index/metadata khớp nhau.
+    `stale_vectors`: số vector cũ còn nằm trong index (không remove được) mà reader phải lọc bằng tombstone.
+    """
+    old = read_manifest(OUTPUT_DIR)
+    index_path, meta_path = version_paths(version)
+    tmp_index_path = index_path.with_name(index_path.name + ".tmp")
+    faiss.write_index(index, str(tmp_index_path))
+    os.replace(tmp_index_path, index_path)
+    save_params(index_path, **params)
+    meta_writer.close()
+    write_manifest(OUTPUT_DIR, {
+        "version": version, "index": index_path.name, "meta": meta_path.name, "watermark": watermark,
+        "index_type": params["index_type"], "ntotal": int(index.ntotal), "stale_vectors": int(stale_vectors),
+        "id_space": ID_SPACE, "published_at": time.time(),
+    })
+    logger.info(f"💾 Published FAISS index v{version} ({index.ntotal} vectors) + metadata ({meta_writer.count} rows).")
+
+    # Dọn phiên bản cũ (server đang mmap file cũ vẫn đọc được trên Linux; trên Windows có thể phải để lại)
+    for name in {old["index"], params_path(OUTPUT_DIR / old["index"]).name, old["meta"], "kg_nodes_meta.json"}:
+        path = OUTPUT_DIR / name
+        if name in (index_path.name, meta_path.name) or not path.exists(): continue
+        try:
+            shutil.rmtree(path) if path.is_dir() else path.unlink()
+        except OSError as e:
+            logger.warning(f"Could not remove old index file {path}: {e}")
+
+def encode_all_nodes(encoder, total_nodes, meta_path, restart: bool = False):
+    """
+    Pipeline 3 stage chạy chồng lên nhau: fetch Neo4j (thread) -> encode (main thread, GPU/CPU) -> ghi đĩa (thread).
+    Vector ghi ra file tạm, metadata ghi thẳng vào store dạng cột (không giữ toàn bộ trong RAM).
+    Có checkpoint định kỳ: chạy lại script sau khi bị ngắt sẽ tiếp tục từ checkpoint cuối (trừ khi `restart`).
+    Trả về (meta_writer chưa close, số node, memmap vector).
+    """
+    meta_writer = NodeMetaWriter(meta_path, resume=not restart)
+    state = meta_writer.resume_state or {}
+    if state and (state.get("model") != MODEL_NAME or state.get("dim") != EMBEDDING_DIM or state.get("id_space") != ID_SPACE
+                  or not EMBEDDINGS_TMP_PATH.exists()):
+        logger.warning("Checkpoint does not match this build (model/dim/id space/vector file). Starting over.")
+        meta_writer.abort()
+        meta_writer, state = NodeMetaWriter(meta_path), {}
+    if state:
+        logger.info(f"⏯️ Resuming from checkpoint: {meta_writer.count} nodes already encoded.")
+        with open(EMBEDDINGS_TMP_PATH, "r+b") as f:
+            f.truncate(meta_writer.count * EMBEDDING_DIM * 4)  # Bỏ phần vector ghi sau checkpoint
+
+    stop, errors = threading.Event(), []
+    fetch_q, write_q = queue.Queue(maxsize=QUEUE_DEPTH), queue.Queue(maxsize=QUEUE_DEPTH)
+    pbar = tqdm(total=total_nodes, initial=meta_writer.count, desc="Encoding Nodes", unit="node")
+    after = state.get("after", "")
+    with open(EMBEDDINGS_TMP_PATH, "ab" if state else "wb") as f_vec:
+        fetcher = threading.Thread(target=_fetch_batches, args=(after, fetch_q, stop), name="faiss-fetch", daemon=True)
+        writer = threading.Thread(target=_write_batches, args=(write_q, f_vec, meta_writer, after, stop, errors), name="faiss-write", daemon=True)
+        fetcher.start(); writer.start()
+        try:
+            while True:
+                item = _get(fetch_q, stop)
+                if item is _DONE: break
+                if isinstance(item, BaseException): raise item
+                embeddings = encode_texts(encoder, item)
+                if not _put(write_q, (item, embeddings), stop): break
+                pbar.update(len(item))
+            _put(write_q, _DONE, stop)
+            writer.join()
+            if errors: raise errors[0]
+        except BaseException:
+            stop.set()
+            fetcher.join(timeout=5); writer.join(timeout=30)
+            pbar.close()
+            meta_writer.abort(keep_checkpoint=True)
+            logger.error("❌ Encoding interrupted. Re-run the script to resume from the last checkpoint (or pass --restart).")
+            raise
+    pbar.close()
+    count = meta_writer.count
+    if not count:
+        return meta_writer, count, None
+    vectors = np.memmap(EMBEDDINGS_TMP_PATH, dtype="float32", mode="r", shape=(count, EMBEDDING_DIM))
+    return meta_writer, count, vectors
+
+def build_index(args, vectors):
+    n = len(vectors)
+    nlist = args.nlist or max(16, min(65536, int(4 * np.sqrt(n))))
+    index = create_index(args.index_type, EMBEDDING_DIM, nlist=nlist, pq_m=args.pq_m, pq_bits=args.pq_bits,
+                         hnsw_m=args.hnsw_m, ef_construction=args.ef_construction)
+    if not index.is_trained:
+        # Train trên mẫu ngẫu nhiên (không phải N vector đầu tiên, vốn bị lệch theo loại node do thứ tự import)
+        rng = np.random.default_rng(args.seed)
+        sample = np.sort(rng.choice(n, size=min(n, args.train_size), replace=False))
+        if len(sample) < nlist:
+            raise ValueError(f"Need at least nlist={nlist} training vectors, got {len(sample)}.")
+        logger.info(f"🏋️ Training {args.index_type} (nlist={nlist}) on {len(sample)} vectors...")
+        t0 = time.time()
+        index.train(np.ascontiguousarray(vectors[sample]))
+        logger.info(f"   -> Trained in {time.time() - t0:.1f}s")
+
+    # id vector = số dòng trong node meta store -> cập nhật tăng dần có thể add/remove theo id
+    index = with_ids(index)
+    for i in tqdm(range(0, n, ADD_CHUNK), desc="Adding to index", unit="chunk"):
+        chunk = np.ascontiguousarray(vectors[i:i + ADD_CHUNK])
+        index.add_with_ids(chunk, np.arange(i, i + len(chunk), dtype="int64"))
+    set_search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    return index, {"nlist": nlist if args.index_type.startswith("ivf") else None}
+
+def exact_top_k(query_vecs, vectors, k):
+    """Ground truth chính xác (brute-force theo chunk trên memmap)."""
+    best_scores = np.full((len(query_vecs), k), -np.inf, dtype="float32")
+    best_ids = np.full((len(query_vecs), k), -1, dtype="int64")
+    for start in range(0, len(vectors), ADD_CHUNK):
+        scores = query_vecs @ np.asarray(vectors[start:start + ADD_CHUNK]).T
+        ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        all_scores = np.concatenate([best_scores, scores], axis=1)
+        all_ids = np.concatenate([best_ids, ids], axis=1)
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, top, axis=1)
+        best_ids = np.take_along_axis(all_ids, top, axis=1)
+    return best_ids
+
+def measure(index, query_vecs, truth, k):
+    """recall@k so với brute-force + latency trung bình/p95 khi search từng query (như lúc chạy pipeline)."""
+    latencies, hits = [], 0
+    for q, gt in zip(query_vecs, truth):
+        t0 = time.perf_counter()
+        _, ids = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        hits += len(set(ids[0].tolist()) & set(gt.tolist()))
+    return {"recall_at_k": round(hits / truth.size, 4),
+            "latency_ms_mean": round(float(np.mean(latencies)), 3),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3)}
+
+def evaluate(args, index, encoder, meta, vectors):
+    """Đo recall@k vs latency trên các query held-out: tên node KHÔNG kèm label (giống mention thật)."""
+    rng = np.random.default_rng(args.seed + 1)
+    picks = rng.choice(len(meta), size=min(len(meta), args.eval_queries), replace=False)
+    query_vecs = np.asarray(encoder.encode([meta[i]["name"] for i in picks], batch_size=256,
+                                           show_progress_bar=False, normalize_embeddings=True), dtype="float32")
+    k = min(args.eval_k, len(meta))
+    truth = exact_top_k(query_vecs, vectors, k)
+
+    if args.index_type.startswith("ivf"):
+        nlist = faiss.extract_index_ivf(index).nlist
+        sweep = [("nprobe", v) for v in sorted(set(NPROBE_SWEEP + [args.nprobe])) if v <= nlist]
+    elif args.index_type == "hnsw":
+        sweep = [("ef_search", v) for v in sorted(set(EF_SEARCH_SWEEP + [args.ef_search]))]
+    else:
+        sweep = [(None, None)]
+
+    report = []
+    print(f"\n📏 Recall@{k} vs latency ({len(picks)} held-out queries, {args.index_type}):")
+    print(f"   {'param':<16}{'recall@k':>10}{'mean ms':>10}{'p95 ms':>10}")
+    for name, value in sweep:
+        if name:
+            set_search_params(index, **{name: value})
+        row = {"param": name, "value": value, **measure(index, query_vecs, truth, k)}
+        report.append(row)
+        label = f"{name}={value}" if name else "exact"
+        print(f"   {label:<16}{row['recall_at_k']:>10.4f}{row['latency_ms_mean']:>10.3f}{row['latency_ms_p95']:>10.3f}")
+    # Trả lại tham số đã chọn
+    set_search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    return {"index_type": args.index_type, "k": k, "num_queries": len(picks), "results": report}
+
+def claim_changelog():
+    """
+    Chuyển changelog sang file `.processing` trước khi đọc: ingest chạy song song sẽ ghi vào file mới,
+    không bị mất khi changelog đã xử lý được dọn. File `.processing` của lần chạy lỗi trước được đọc lại.
+    """
+    processing = CHANGELOG_PATH.with_suffix(".processing")
+    if CHANGELOG_PATH.exists() and not processing.exists():
+        os.replace(CHANGELOG_PATH, processing)
+    deleted, upserts = set(), set()
+    if processing.exists():
+        with open(processing, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                entry = json.loads(line)
+                (deleted if entry.get("op") == "delete" else upserts).add(str(entry["node_id"]))
+    return processing, deleted, upserts
+
+def incremental_update(encoder, manifest, watermark, deleted_ids, upsert_ids):
+    """
+    Cập nhật tăng dần: node đổi sau watermark (hoặc có trong changelog) được encode lại và add với id mới;
+    dòng cũ của chúng + node bị xoá bị remove khỏi index (nếu loại index hỗ trợ) và đánh tombstone trong metadata.
+    """
+    index_path, meta_path = OUTPUT_DIR / manifest["index"], OUTPUT_DIR / manifest["meta"]
+    changed = {}
+    for r in db_connector.stream_query(CHANGED_QUERY, {"since": manifest["watermark"]}, fetch_size=FETCH_SIZE):
+        changed[str(r.get("node_id"))] = {"node_id": str(r.get("node_id")), "labels": r.get("labels") or [], "name": r.get("name", "Unknown")}
+    missing = list(upsert_ids - changed.keys())
+    if missing:
+        for r in db_connector.run_query(NODES_BY_ID_QUERY, {"ids": missing}):
+            changed[str(r.get("node_id"))] = {"node_id": str(r.get("node_id")), "labels": r.get("labels") or [], "name": r.get("name", "Unknown")}
+        # Node upsert trong changelog nhưng không còn (hoặc không còn tên) -> coi như bị xoá
+        deleted_ids = deleted_ids | (set(missing) - changed.keys())
+    logger.info(f"🔁 Incremental update since watermark {manifest['watermark']}: {len(changed)} changed, {len(deleted_ids)} deleted.")
+    if not changed and not deleted_ids:
+        write_manifest(OUTPUT_DIR, {**manifest, "watermark": watermark})
+        logger.info("✅ FAISS index is up to date.")
         return
 
-    # 2. Kiểm tra kết nối DB
+    # Dòng cũ của các node bị đổi/xoá: tra theo ids.S đã sắp xếp (searchsorted), không quét cả store
+    store = NodeMetaStore(meta_path)
+    stale_rows = sorted(row for rows in store.rows_of(deleted_ids | changed.keys()).values() for row in rows)
+    stale_vectors = manifest.get("stale_vectors", store.num_deleted)   # Manifest cũ chưa ghi: giả định mọi tombstone
+    store = None
+
+    index, params = read_index(index_path, mmap=False)
+    index = with_ids(index)   # Index build trước khi có id map: id = số dòng
+    version = next_version(manifest)
+    meta_writer = NodeMetaWriter.from_store(meta_path, version_paths(version)[1])
+    try:
+        for row in stale_rows:
+            meta_writer.delete(row)
+        if stale_rows:
+            try:
+                index.remove_ids(np.array(stale_rows, dtype="int64"))
+            except RuntimeError as e:
+                # HNSW không hỗ trợ remove_ids -> vector cũ ở lại, FaissSearch bỏ qua nhờ tombstone
+                logger.info(f"Index does not support remove_ids ({e}); relying on tombstones.")
+                stale_vectors += len(stale_rows)
+        rows = list(changed.values())
+        for start in tqdm(range(0, len(rows), BATCH_SIZE), desc="Encoding changed nodes", unit="batch"):
+            batch = rows[start:start + BATCH_SIZE]
+            embeddings = np.ascontiguousarray(encode_texts(encoder, batch), dtype="float32")
+            index.add_with_ids(embeddings, np.arange(meta_writer.count, meta_writer.count + len(batch), dtype="int64"))
+            for r in batch:
+                meta_writer.append(r["node_id"], r["labels"], r["name"])
+    except BaseException:
+        meta_writer.abort()
+        raise
+    publish(index, meta_writer, version, watermark, params, stale_vectors)
+
+def _rebuild_live(index, new_row):
+    """Index mới cùng loại/tham số chỉ chứa vector của các dòng còn sống (id = dòng mới), cho index không remove_ids được."""
+    base = base_index(index)
+    if not hasattr(base, "hnsw"):
+        raise ValueError("Only HNSW indexes keep stale vectors; other index types are compacted by remapping ids.")
+    rebuilt = with_ids(create_index("hnsw", index.d, hnsw_m=base.hnsw.nb_neighbors(1), ef_construction=base.hnsw.efConstruction))
+    ids = faiss.vector_to_array(index.id_map)
+    for start in tqdm(range(0, index.ntotal, ADD_CHUNK), desc="Rebuilding index", unit="chunk"):
+        stop = min(start + ADD_CHUNK, index.ntotal)
+        keep = new_row[ids[start:stop]] >= 0
+        if keep.any():
+            # Vị trí trong index gốc (không phải id), nên đọc thẳng từ index bên trong IndexIDMap2
+            vectors = base.reconstruct_n(start, stop - start)
+            rebuilt.add_with_ids(np.ascontiguousarray(vectors[keep]), new_row[ids[start:stop]][keep])
+    return rebuilt
+
+def compact(manifest, watermark):
+    """
+    Bỏ hẳn các dòng tombstone: metadata chỉ giữ dòng còn sống (đánh số lại từ 0) và id trong index đổi theo;
+    vector cũ còn nằm trong index (HNSW) được loại bằng cách dựng lại index từ vector của các dòng còn sống.
+    Không encode lại; công bố như một phiên bản mới. Build đầy đủ (`--force`) luôn cho ra index đã compact.
+    """
+    index_path, meta_path = OUTPUT_DIR / manifest["index"], OUTPUT_DIR / manifest["meta"]
+    store = NodeMetaStore(meta_path)
+    live = store.live_rows()
+    logger.info(f"🧹 Compacting FAISS index v{manifest['version']}: dropping {len(store) - len(live)} of {len(store)} rows.")
+    new_row = np.full(len(store), -1, dtype="int64")
+    new_row[live] = np.arange(len(live), dtype="int64")
+
+    index, params = read_index(index_path, mmap=False)
+    index = with_ids(index)
+    version = next_version(manifest)
+    meta_writer = NodeMetaWriter(version_paths(version)[1])
+    try:
+        for row in tqdm(live, desc="Compacting metadata", unit="row", mininterval=5):
+            meta = store[int(row)]
+            meta_writer.append(meta["node_id"], meta["labels"], meta["name"])
+        ids = faiss.vector_to_array(index.id_map)
+        if (new_row[ids] >= 0).all():
+            # Index đã remove vector cũ (flat/IVF): chỉ cần đổi id
+            faiss.copy_array_to_vector(new_row[ids], index.id_map)
+            index.construct_rev_map()
+        else:
+            index = _rebuild_live(index, new_row)
+            set_search_params(index, ef_search=params.get("ef_search"))
+    except BaseException:
+        meta_writer.abort()
+        raise
+    publish(index, meta_writer, version, watermark, params, stale_vectors=0)
+
+def needs_compaction(manifest) -> bool:
+    store = NodeMetaStore(OUTPUT_DIR / manifest["meta"])
+    return len(store) > 0 and store.num_deleted / len(store) > COMPACT_DELETED_RATIO
+
+def main():
+    args = parse_args()
+    # 1. Kiểm tra kết nối DB
     if db_connector is None:
         logger.error("❌ Không có kết nối Neo4j. Vui lòng kiểm tra Docker.")
         return
 
     # Tạo thư mục output
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(OUTPUT_DIR)
+    # Watermark lấy TRƯỚC khi đọc dữ liệu: node đổi trong lúc build sẽ được lần cập nhật sau bắt lại
+    watermark = db_timestamp()
+    changelog, deleted_ids, upsert_ids = claim_changelog()
+
+    # 2. Index đã tồn tại -> chỉ cập nhật phần thay đổi (trừ khi --force hoặc index cũ còn lưu elementId)
+    exists = (OUTPUT_DIR / manifest["index"]).exists() and NodeMetaStore.exists(OUTPUT_DIR / manifest["meta"])
+    if exists and manifest.get("id_space") != ID_SPACE:
+        logger.warning("⚠️ Existing index stores elementIds instead of node ids; rebuilding it from scratch.")
+    elif exists and not args.force:
+        logger.info(f"🧠 Loading SentenceTransformer: {MODEL_NAME}")
+        incremental_update(SentenceTransformer(MODEL_NAME), manifest, watermark, deleted_ids, upsert_ids)
+        changelog.unlink(missing_ok=True)
+        manifest = read_manifest(OUTPUT_DIR)
+        if args.compact or needs_compaction(manifest):
+            compact(manifest, manifest["watermark"])
+        db_connector.close()
+        return
 
     # 3. Đếm tổng số node để hiển thị thanh tiến trình
     logger.info("📊 Đang đếm tổng số node cần index...")
@@ -45,90 +511,39 @@ def main():
         logger.error(f"❌ Lỗi khi đếm node: {e}")
         return
 
-    # 4. Khởi tạo Model & Index
+    # 4. Encode toàn bộ node (vector ghi ra file tạm, có checkpoint), rồi build index theo loại đã chọn
     logger.info(f"🧠 Loading SentenceTransformer: {MODEL_NAME}")
     encoder = SentenceTransformer(MODEL_NAME)
-    
-    # Sử dụng IndexFlatIP (Inner Product) cho cosine similarity (khi vectors đã normalize)
-    # Loại này tiết kiệm RAM hơn HNSW và vẫn đủ nhanh cho vài triệu node.
-    embedding_dim = 384
-    index = faiss.IndexFlatIP(embedding_dim) 
-
-    all_meta = []
-    
-    # 5. Vòng lặp Batch Processing (Tiết kiệm RAM)
-    logger.info("🚀 Bắt đầu quá trình Indexing theo batch...")
-    
-    query = """
-    MATCH (n)
-    WHERE n.name IS NOT NULL
-    RETURN elementId(n) AS node_id, labels(n) AS labels, n.name AS name
-    ORDER BY elementId(n)
-    SKIP $skip LIMIT $limit
-    """
-    
-    skip = 0
-    pbar = tqdm(total=total_nodes, desc="Indexing Nodes", unit="node")
-
-    while skip < total_nodes:
-        # A. Fetch Batch từ Neo4j
-        rows = db_connector.run_query(query, {"skip": skip, "limit": BATCH_SIZE})
-        if not rows:
-            break
-            
-        batch_meta = []
-        batch_texts = []
-        
-        # B. Prepare Data
-        for r in rows:
-            # Xử lý an toàn dữ liệu
-            lbls = r.get("labels", [])
-            lbl = lbls[0] if lbls else "Unknown"
-            name = r.get("name", "Unknown")
-            nid = str(r.get("node_id"))
-            
-            # Lưu metadata gọn nhẹ
-            meta_item = {
-                "node_id": nid,
-                "labels": lbls,
-                "name": name
-            }
-            batch_meta.append(meta_item)
-            
-            # Text để embed: "Name (Label)"
-            batch_texts.append(f"{name} ({lbl})")
-        
-        # C. Encode Batch (GPU/CPU)
-        if batch_texts:
-            embeddings = encoder.encode(
-                batch_texts,
-                batch_size=256,
-                show_progress_bar=False,
-                normalize_embeddings=True # Quan trọng cho FlatIP/Cosine
-            )
-            
-            # D. Add to FAISS Index
-            index.add(np.asarray(embeddings, dtype="float32"))
-            
-            # E. Append Meta
-            all_meta.extend(batch_meta)
-        
-        skip += BATCH_SIZE
-        pbar.update(len(rows))
-
-    pbar.close()
+    logger.info("🚀 Bắt đầu quá trình Indexing (streaming)...")
+    version = next_version(manifest)
+    index_path, meta_path = version_paths(version)
+    meta_writer, num_nodes, vectors = encode_all_nodes(encoder, total_nodes, meta_path, restart=args.restart)
+    if not num_nodes:
+        meta_writer.abort()
+        logger.error("❌ Không có node nào để index.")
+        return
+    index, built = build_index(args, vectors)
 
-    # 6. Lưu xuống đĩa
-    logger.info(f"💾 Đang lưu FAISS index vào {INDEX_PATH}...")
-    faiss.write_index(index, str(INDEX_PATH))
+    # 5. Lưu xuống đĩa: index + metadata phiên bản mới, công bố qua manifest
+    logger.info(f"💾 Đang lưu FAISS index ({args.index_type}) vào {index_path}...")
+    publish(index, meta_writer, version, watermark, {
+        "index_type": args.index_type, "nlist": built["nlist"], "nprobe": args.nprobe, "ef_search": args.ef_search,
+        "pq_m": args.pq_m if args.index_type == "ivf_pq" else None,
+    })
+    changelog.unlink(missing_ok=True)  # Build đầy đủ đã bao gồm mọi thay đổi
 
-    logger.info(f"💾 Đang lưu Metadata vào {META_PATH}...")
-    with open(META_PATH, "w", encoding="utf-8") as f:
-        json.dump(all_meta, f, ensure_ascii=False, indent=None) # indent=None cho file nhỏ gọn
+    # 6. Đánh giá recall@k vs latency để chọn tham số
+    if args.eval_queries > 0:
+        evaluation = evaluate(args, index, encoder, NodeMetaStore(meta_path), vectors)
+        with open(EVAL_PATH, "w", encoding="utf-8") as f:
+            json.dump(evaluation, f, indent=2)
+        logger.info(f"📄 Evaluation report: {EVAL_PATH}")
+    vectors = None
+    os.remove(EMBEDDINGS_TMP_PATH)
 
     logger.info("🎉 Hoàn tất build FAISS index!")
     if db_connector:
         db_connector.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
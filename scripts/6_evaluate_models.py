@@ -81,12 +81,16 @@ def run_rag_inference(model_cfg, test_data):
         
     client = OpenAI(api_key=OPENAI_KEY)
     outputs = []
+
+    # 1. Retrieve Knowledge from Graph: encode + search toàn bộ câu hỏi một lần (thay vì từng item trong vòng lặp)
+    try:
+        all_docs = faiss_retriever.search_batch([item['Question'] for item in test_data],
+                                                k=model_cfg.get('retriever_top_k', 3), use_cache=True)
+    except Exception as e:
+        return [f"RAG Error: {e}"] * len(test_data)
     
-    for item in tqdm(test_data, desc=f"Evaluating {model_cfg['id']}"):
+    for item, docs in tqdm(zip(test_data, all_docs), total=len(test_data), desc=f"Evaluating {model_cfg['id']}"):
         try:
-            # 1. Retrieve Knowledge from Graph
-            docs = faiss_retriever.search(item['Question'], k=model_cfg.get('retriever_top_k', 3))
-            
             # Format retrieved knowledge
             kg_context = "\n".join([f"- {d['name']} ({d['labels'][0]})" for d in docs])
             
@@ -0,0 +1,67 @@
+# scripts/build_node_embeddings.py
+"""
+Encode tên của MỌI node trong KG một lần bằng encoder của Step 5 (SENTENCE_ENCODER_MODEL) và lưu thành
+ma trận memory-mapped (`src/utils/node_embedding_store.py`). Chạy lại sau khi nạp thêm nhiều node mới
+hoặc đổi SENTENCE_ENCODER_MODEL; node chưa có trong store vẫn được Step 5 encode khi cần.
+"""
+import argparse
+import logging
+from sentence_transformers import SentenceTransformer
+from src.core import config
+from src.utils.graph_store import EmbeddedGraphStore
+from src.utils.node_embedding_store import VECTOR_FILES, build_node_embeddings
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("NODE_EMBEDDINGS")
+
+# Cùng id với node mà Step 4 trả về
+STREAM_QUERY = """
+MATCH (n) WHERE n.name IS NOT NULL
+RETURN coalesce(n.id, elementId(n)) AS node_id, n.name AS name
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Precompute node-name embeddings for Step 5.")
+    parser.add_argument("--source", choices=["auto", "graph_store", "neo4j"], default="auto",
+                        help="Nguồn node: graph store nhúng (data/graph_store) hoặc Neo4j; auto = graph store nếu đã build")
+    parser.add_argument("--dtype", choices=list(VECTOR_FILES), default=config.NODE_EMBEDDING_DTYPE)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--out", type=str, default=config.NODE_EMBEDDING_DIR)
+    return parser.parse_args()
+
+def iter_graph_store():
+    store = EmbeddedGraphStore(config.GRAPH_STORE_DIR)
+    for i in range(store.num_nodes):
+        name = store.nodes.name(i)
+        if name:
+            yield store.nodes.node_id(i), name
+
+def iter_neo4j():
+    from src.utils.neo4j_connect import db_connector
+    if db_connector is None:
+        raise RuntimeError("Không có kết nối Neo4j. Vui lòng kiểm tra Docker.")
+    try:
+        for r in db_connector.stream_query(STREAM_QUERY, fetch_size=10_000):
+            yield str(r["node_id"]), r["name"]
+    finally:
+        db_connector.close()
+
+def main():
+    args = parse_args()
+    source = args.source
+    if source == "auto":
+        source = "graph_store" if EmbeddedGraphStore.exists(config.GRAPH_STORE_DIR) else "neo4j"
+    logger.info(f"📥 Reading nodes from {source}.")
+
+    logger.info(f"🧠 Loading SentenceTransformer: {config.SENTENCE_ENCODER_MODEL}")
+    encoder = SentenceTransformer(config.SENTENCE_ENCODER_MODEL)
+    # Không normalize: phải khớp với `encoder.encode(...)` của Step 5
+    encode = lambda texts: encoder.encode(texts, batch_size=256, show_progress_bar=False)
+
+    rows = iter_graph_store() if source == "graph_store" else iter_neo4j()
+    build_node_embeddings(rows, encode, args.out, model_name=config.SENTENCE_ENCODER_MODEL,
+                          dtype=args.dtype, batch_size=args.batch_size)
+    logger.info("🎉 Hoàn tất build node embeddings!")
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ import re
 from pathlib import Path
 from src.utils.neo4j_connect import db_connector
 from src.utils.local_llm import local_llm
+from src.utils.name_index import name_index
+from src.utils.result_cache import result_cache
 
 # --- CẤU HÌNH ---
 DATA_DIR = Path("data/custom_knowledge")
@@ -136,7 +138,9 @@ class KnowledgeExtractor:
         node_query = """
         UNWIND $nodes AS n MERGE (node {name: n.id}) 
         ON CREATE SET node.id = n.id, node.source='User_Upload' 
-        WITH node, n CALL apoc.create.addLabels(node, [n.label]) YIELD node as l RETURN count(l)
+        SET node.updated_at = timestamp()
+        WITH node, n CALL apoc.create.addLabels(node, [n.label]) YIELD node as l
+        RETURN elementId(l) AS element_id, coalesce(l.id, elementId(l)) AS node_id, labels(l)[0] AS node_label, l.name AS name
         """
         edge_query = """
         UNWIND $edges AS e MATCH (s {name: e.source}), (t {name: e.target}) 
@@ -145,7 +149,9 @@ class KnowledgeExtractor:
 
         try:
             if graph_data.get("nodes"):
-                db_connector.run_query(node_query, {"nodes": graph_data["nodes"]})
+                rows = db_connector.run_query(node_query, {"nodes": graph_data["nodes"]})
+                # Cập nhật chỉ mục tên cho Step 2 (snapshot được ghi lại ở cuối main)
+                name_index.add_nodes(rows or [])
             if graph_data.get("edges"):
                 db_connector.run_query(edge_query, {"edges": graph_data["edges"]})
             logger.info(f"   + DB: Saved {len(graph_data.get('nodes', []))} nodes, {len(graph_data.get('edges', []))} edges.")
@@ -171,6 +177,8 @@ def main():
             f.write("Cây chó đẻ (Diệp hạ châu) hỗ trợ trị viêm gan B nhưng gây hạ huyết áp.")
         files = [str(sample_file)]
 
+    # Nạp (hoặc dựng) chỉ mục tên trước khi thêm node mới, để snapshot ghi lại không bị thiếu node cũ
+    name_index.ensure_loaded(db_connector)
     extractor = KnowledgeExtractor()
     
     for file_path in files:
@@ -186,6 +194,11 @@ def main():
             graph_data = extractor.extract_graph_from_text(chunk)
             if graph_data: extractor.ingest_to_neo4j(graph_data)
 
+    name_index.save()
+    logger.info(f"🗂️ Name index saved ({len(name_index)} names).")
+    # KG đã đổi -> kết quả pipeline đã cache không còn đúng
+    result_cache.invalidate()
+    logger.info("👉 Chạy 'python scripts/2_build_faiss.py' để cập nhật FAISS index (chỉ encode các node mới/đã sửa).")
     local_llm.unload()
     if db_connector: db_connector.close()
     print("\n🎉 Hoàn tất!")
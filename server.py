@@ -0,0 +1,153 @@
+# Tệp: server.py
+"""
+Chế độ server cho MedCOT: nạp model MỘT lần rồi phục vụ nhiều query qua HTTP (localhost).
+
+Endpoints:
+  GET  /health  -> luôn trả 200 khi process còn sống (liveness).
+  GET  /ready   -> 200 khi tất cả model đã nạp xong, 503 trong lúc warm-up (readiness).
+  GET  /metrics -> số liệu profiling cộng dồn theo stage + hit/miss của các cache (Prometheus text format).
+  GET  /models  -> các model dùng chung đang nạp và dung lượng bộ nhớ của chúng.
+  POST /query   -> body JSON {"query": "...", "context": "...", "use_gcot": true, "use_cache": true}.
+  POST /cache/invalidate -> xoá cache kết quả pipeline (sau khi nạp dữ liệu mới / đổi model).
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from main import run_pipeline, summarize_state, warmup_models
+from src.core import config
+from src.utils.disk_cache import cache_prometheus_text
+from src.utils.model_registry import model_registry
+from src.utils.neo4j_connect import db_connector
+from src.utils.profiler import global_prometheus_text
+from src.utils.result_cache import result_cache
+
+logger = logging.getLogger("MED-COT_SERVER")
+
+_ready = threading.Event()
+_warmup_info = {"status": "loading", "timings": {}, "error": None}
+
+
+def _warmup(load_llm: bool):
+    """Chạy warm-up ở thread nền để /health phản hồi ngay cả khi model đang nạp."""
+    t0 = time.time()
+    try:
+        _warmup_info["timings"] = warmup_models(load_llm=load_llm)
+        _warmup_info["status"] = "ready"
+        _ready.set()
+        logger.info(f"✅ All models warm after {time.time() - t0:.2f}s. Server is ready.")
+    except Exception as e:
+        _warmup_info["status"] = "failed"
+        _warmup_info["error"] = str(e)
+        logger.critical(f"❌ Warm-up failed, server will stay NOT READY: {e}", exc_info=True)
+
+
+class PipelineRequestHandler(BaseHTTPRequestHandler):
+    # Semaphore giới hạn số pipeline chạy đồng thời (gán trong main()).
+    pipeline_slots: threading.BoundedSemaphore = None
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s" % (self.address_string(), format % args))
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(HTTPStatus.OK, {"status": "alive"})
+        elif self.path == "/ready":
+            status = HTTPStatus.OK if _ready.is_set() else HTTPStatus.SERVICE_UNAVAILABLE
+            self._send_json(status, _warmup_info)
+        elif self.path == "/metrics":
+            body = (global_prometheus_text() + cache_prometheus_text()).encode("utf-8")
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/models":
+            models = model_registry.footprint()
+            self._send_json(HTTPStatus.OK, {"models": models, "total_mb": round(model_registry.total_bytes() / 2**20, 2)})
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path == "/cache/invalidate":
+            result_cache.invalidate()
+            self._send_json(HTTPStatus.OK, {"status": "invalidated"})
+            return
+        if self.path != "/query":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path: {self.path}"})
+            return
+        if not _ready.is_set():
+            self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Models are still loading.", **_warmup_info})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": f"Invalid JSON body: {e}"})
+            return
+
+        query = payload.get("query")
+        if not query or not isinstance(query, str):
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "Field 'query' (string) is required."})
+            return
+
+        run_config = {"use_gcot": payload.get("use_gcot", True)}
+        if "use_cache" in payload:
+            run_config["use_cache"] = bool(payload["use_cache"])
+        with self.pipeline_slots:
+            state = run_pipeline(
+                query=query,
+                patient_context=payload.get("context"),
+                config=run_config,
+            )
+
+        if state is None:
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Pipeline execution failed."})
+            return
+        self._send_json(HTTPStatus.OK, summarize_state(state))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the MedCOT pipeline over HTTP with warm models.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address (default: localhost only).")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Max pipelines running at the same time.")
+    parser.add_argument("--no-llm", action="store_true", help="Skip warming up the local LLM (it loads lazily instead).")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Intra-op threads for torch in this worker (default: MEDCOT_TORCH_THREADS).")
+    args = parser.parse_args()
+
+    if args.torch_threads is not None:
+        config.TORCH_NUM_THREADS = args.torch_threads
+
+    PipelineRequestHandler.pipeline_slots = threading.BoundedSemaphore(max(1, args.max_concurrency))
+
+    threading.Thread(target=_warmup, args=(not args.no_llm,), name="medcot-warmup", daemon=True).start()
+
+    httpd = ThreadingHTTPServer((args.host, args.port), PipelineRequestHandler)
+    httpd.daemon_threads = True
+    logger.info(f"🌐 MedCOT server listening on http://{args.host}:{args.port} (warming up models...)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("🛑 Shutting down server...")
+    finally:
+        httpd.server_close()
+        if db_connector:
+            db_connector.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 # Tệp: src/core/config.py
+import os
 LINKING_THRESHOLD = 0.7 
 # (Các hằng số khác giữ nguyên như trước)
 SPACY_MODEL_NAME = "xx_sent_ud_sm"
@@ -9,6 +10,7 @@ INTERNAL_LABEL_TO_KG_TYPE_MAP = {"disease": "Disease", "drug": "Drug", "symptom"
 KG_TYPE_TO_INTERNAL_MAP = {v: k for k, v in INTERNAL_LABEL_TO_KG_TYPE_MAP.items()}
 DEFAULT_EXTRACTION_THRESHOLD = 0.35
 KNOWN_ENTITIES = {"diabetes": ("disease", "Disease"), "metformin": ("drug", "Drug"), "hypertension": ("disease", "Disease"), "warfarin": ("drug", "Drug"), "aspirin": ("drug", "Drug"), "kidney disease": ("disease", "Disease")}
+SENTENCE_ENCODER_MODEL = "all-MiniLM-L6-v2"
 DENSE_RETRIEVAL_MODEL = "BAAI/bge-small-en-v1.5"
 RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 KG_TYPE_TO_UMLS_STY_MAP = {"disease": ["Disease or Syndrome", "Neoplastic Process", "Pathologic Function", "Congenital Abnormality", "Mental or Behavioral Dysfunction", "Injury or Poisoning"], "symptom": ["Sign or Symptom", "Finding", "Laboratory or Test Result"], "drug": ["Pharmacologic Substance", "Clinical Drug", "Antibiotic", "Biologically Active Substance"], "procedure": ["Therapeutic or Preventive Procedure", "Diagnostic Procedure", "Health Care Activity"], "anatomy": ["Body Part, Organ, or Organ Component", "Anatomical Structure", "Body Location or Region", "Tissue"], "gene": ["Gene or Genome", "Amino Acid, Peptide, or Protein", "Enzyme"], "lab_test": ["Laboratory Procedure", "Diagnostic Procedure"]}
@@ -16,4 +18,34 @@ NODE_EMBEDDING_DIM = 384
 HGT_HIDDEN_CHANNELS = 128
 HGT_NUM_HEADS = 4
 NLI_MODEL_NAME = "cross-encoder/nli-distilroberta-base"
-WEIGHTS = {"in_kg": 0.35, "link_pred": 0.05, "nli": 0.15, "causality": 0.15, "gcot": 0.10, "trust": 0.20}
\ No newline at end of file
+COT_LLM_MODEL = "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B"   # LLM cục bộ viết final_answer (src/utils/local_llm.py)
+WEIGHTS = {"in_kg": 0.35, "link_pred": 0.05, "nli": 0.15, "causality": 0.15, "gcot": 0.10, "trust": 0.20}
+# Số thread tối đa cho các bước/sub-task chạy song song (DAG executor)
+PIPELINE_MAX_WORKERS = 4
+# --- Step 4: mở rộng lân cận có giới hạn (node hub như warfarin/hypertension có hàng chục nghìn cạnh) ---
+EXPANSION_MODE = "bounded"          # "bounded" | "full" (mọi lân cận 1-hop của mọi seed, hành vi cũ)
+EXPANSION_SCAN_LIMIT = 5000         # Số cạnh tối đa đọc cho mỗi seed (degree/pagerank: lân cận có khoá lớn nhất; ranker khác: mẫu bất kỳ)
+EXPANSION_MAX_PER_SEED = 100        # Fan-out tối đa mỗi seed
+EXPANSION_MAX_PER_RELATION = 25     # Quota mỗi loại quan hệ (mỗi seed) -> không để một loại cạnh chiếm hết
+EXPANSION_HOPS = 1                  # 2 = mở rộng thêm một bước từ các lân cận hop-1 tốt nhất
+EXPANSION_HOP2_FRONTIER = 10        # Số lân cận hop-1 được mở rộng tiếp
+EXPANSION_HOP2_MAX_PER_NODE = 20    # Fan-out tối đa mỗi node ở hop 2
+EXPANSION_HOP2_MAX_DEGREE = 1000    # Không mở rộng tiếp qua node hub
+EXPANSION_RANKER = "degree"         # "degree" | "pagerank" (thuộc tính n.pagerank tính sẵn) | "similarity" | "none"
+# --- Backend đồ thị cho đường đọc (linking, retrieval): "neo4j" hoặc "embedded" (src/utils/graph_store.py) ---
+GRAPH_BACKEND = os.getenv("MEDCOT_GRAPH_BACKEND", "neo4j")
+GRAPH_STORE_DIR = "data/graph_store"
+# --- Cache kết quả pipeline (src/utils/result_cache.py) ---
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_TTL_SECONDS = 86400          # Kết quả cuối (gồm câu trả lời của LLM)
+STAGE_CACHE_TTL_SECONDS = 86400 * 7       # Kết quả trung gian (entity đã link, subgraph)
+RESULT_CACHE_MAX_BYTES = 512 * 2**20
+# --- Embedding tên node tính sẵn cho Step 5 (scripts/build_node_embeddings.py) ---
+NODE_EMBEDDING_DIR = "data/node_embeddings"
+NODE_EMBEDDING_DTYPE = "float16"          # "float16" (nửa dung lượng) hoặc "float32"
+# --- GNN Step 5: model dựng sẵn theo metadata của đồ thị (tái dùng giữa các query) ---
+GNN_MODEL_CACHE_SIZE = 32                 # Số model (metadata khác nhau) giữ trong registry
+GNN_COMPILE = False                       # torch.compile model sau lần forward đầu (fallback eager nếu lỗi)
+# --- Suy luận trên CPU cho GNN (Step 5) và verifier (Step 7) (src/utils/cpu_inference.py) ---
+INFERENCE_PRECISION = os.getenv("MEDCOT_INFERENCE_PRECISION", "fp32")  # "fp32" | "int8" (quantize động các Linear) | "bf16" (autocast)
+TORCH_NUM_THREADS = int(os.getenv("MEDCOT_TORCH_THREADS", "0"))        # Số thread intra-op của mỗi worker; 0 = mặc định của torch
@@ -0,0 +1,84 @@
+# src/core/executor.py
+"""
+Bộ thực thi DAG nhỏ cho pipeline: các task không phụ thuộc nhau chạy song song trên thread pool.
+
+Cách dùng:
+    dag = DAGExecutor(name="pipeline")
+    dag.add("local", lambda r: expand(seeds))
+    dag.add("remote", lambda r: fetch_arax(names))
+    dag.add("merge", lambda r: merge(r["local"], r["remote"]), deps=["local", "remote"])
+    results = dag.run()
+
+Mỗi task nhận dict kết quả của các task đã xong. Context (vd. profiler đang hoạt động)
+được copy sang thread worker nên `span()`/`@profiled` vẫn ghi đúng vào profiler của query.
+"""
+import contextvars
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.core import config
+
+logger = logging.getLogger("DAG_EXECUTOR")
+
+
+class DAGExecutor:
+    def __init__(self, name: str = "dag", max_workers: int = None):
+        self.name = name
+        self.max_workers = max_workers or config.PIPELINE_MAX_WORKERS
+        self._tasks = {}
+
+    def add(self, name: str, fn, deps=()):
+        """Đăng ký task `fn(results) -> value`, chỉ chạy sau khi mọi task trong `deps` đã xong."""
+        if name in self._tasks:
+            raise ValueError(f"Task '{name}' is already registered in DAG '{self.name}'.")
+        self._tasks[name] = (fn, tuple(deps))
+        return self
+
+    def _check(self):
+        for name, (_, deps) in self._tasks.items():
+            missing = [d for d in deps if d not in self._tasks]
+            if missing:
+                raise ValueError(f"Task '{name}' depends on unknown task(s) {missing} in DAG '{self.name}'.")
+
+    def run(self) -> dict:
+        """
+        Chạy toàn bộ DAG và trả về {task_name: kết quả}.
+        Nếu một task lỗi, các task phụ thuộc vào nó không được chạy và exception đầu tiên được raise lại
+        (sau khi các task đang chạy dở đã kết thúc).
+        """
+        self._check()
+        results, pending = {}, dict(self._tasks)
+        running, error = {}, None
+
+        # Pool riêng cho mỗi lần chạy: DAG lồng nhau (vd. Step 4 bên trong pipeline) không thể deadlock
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"medcot-{self.name}") as pool:
+            while pending or running:
+                if error is None:
+                    ready = [n for n, (_, deps) in pending.items() if all(d in results for d in deps)]
+                    for n in ready:
+                        fn, _ = pending.pop(n)
+                        ctx = contextvars.copy_context()
+                        running[pool.submit(ctx.run, fn, dict(results))] = n
+                if not running:
+                    if pending and error is None:
+                        raise ValueError(f"DAG '{self.name}' has a dependency cycle among {sorted(pending)}.")
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    n = running.pop(fut)
+                    try:
+                        results[n] = fut.result()
+                    except Exception as e:
+                        logger.error(f"Task '{n}' in DAG '{self.name}' failed: {e}")
+                        error = error or e
+        if error is not None:
+            raise error
+        return results
+
+
+def run_parallel(tasks: dict, name: str = "parallel", max_workers: int = None) -> dict:
+    """Chạy song song các hàm không tham số độc lập nhau: {"a": fn_a, "b": fn_b} -> {"a": ..., "b": ...}."""
+    dag = DAGExecutor(name=name, max_workers=max_workers)
+    for task_name, fn in tasks.items():
+        dag.add(task_name, lambda _results, fn=fn: fn())
+    return dag.run()
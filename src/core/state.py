@@ -1,6 +1,6 @@
 # src/core/state.py
 from typing import List, Optional, Any, Dict, Tuple
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from datetime import datetime
 import uuid
 
@@ -48,6 +48,8 @@ class MedCOTState(BaseModel):
     final_answer: Optional[str] = None
     safety_flags: List[Dict[str, Any]] = Field(default_factory=list)
     logs: List[Dict[str, Any]] = Field(default_factory=list)
+    # Id map của ckg_subgraph dùng chung giữa các bước (src/utils/hetero_graph.py); không serialize
+    _subgraph_index: Any = PrivateAttr(default=None)
 
     def log(self, step: str, status: str, message: Any = "", metadata: dict = None):
         if metadata is None: metadata = {}
@@ -1,7 +1,7 @@
 # src/models/dual_tower_gnn.py
 import torch
 import torch.nn.functional as F
-from torch_geometric.nn import HGTConv, Linear
+from torch_geometric.nn import HGTConv, Linear, global_mean_pool
 
 class CoGCoT_DualTower_GNN(torch.nn.Module):
     """
@@ -79,6 +79,48 @@ class CoGCoT_DualTower_GNN(torch.nn.Module):
             ckg_x_dict = self.ckg_convs[i](ckg_x_dict, ckg_data.edge_index_dict)
             
             current_thought = torch.mean(torch.cat([x for x in ckg_x_dict.values()]), dim=0)
-            thought_vectors.append(current_thought.cpu().numpy())
+            thought_vectors.append(current_thought.float().cpu().numpy())
 
-        return ckg_x_dict, thought_vectors
\ No newline at end of file
+        return ckg_x_dict, thought_vectors
+
+    def forward_batch(self, ckg_batch, psg_batch, query_embs):
+        """
+        Nhiều đồ thị gộp thành một đồ thị rời (`Batch.from_data_list`, cùng metadata) -> một lần forward.
+        `query_embs`: [B, query_dim]. Query và ngữ cảnh PSG được cộng vào đúng đồ thị của từng node
+        qua vector `batch`; thought vector là mean-pool theo từng đồ thị.
+        Trả về (x_dict đã gộp, list [num_think_steps] các mảng [B, hidden]).
+        """
+        num_graphs = query_embs.size(0)
+        ckg_x_dict = {
+            node_type: self.ckg_lin_dict[node_type](ckg_batch[node_type].x).relu()
+            for node_type in ckg_batch.node_types
+        }
+        ckg_index = {node_type: ckg_batch[node_type].batch for node_type in ckg_batch.node_types}
+
+        psg_context = None
+        if self.use_psg and self.psg_conv is not None and psg_batch is not None and psg_batch.edge_types:
+            psg_x_dict = {
+                node_type: self.psg_lin_dict[node_type](psg_batch[node_type].x).relu()
+                for node_type in psg_batch.node_types
+            }
+            psg_x_dict = self.psg_conv(psg_x_dict, psg_batch.edge_index_dict)
+            psg_context = self._mean_per_graph(psg_x_dict, {nt: psg_batch[nt].batch for nt in psg_batch.node_types}, num_graphs)
+
+        query_vector = self.query_proj(query_embs).relu()
+
+        thought_vectors = []
+        for i in range(self.num_think_steps):
+            fused_query_vector = query_vector if psg_context is None else query_vector + psg_context
+            for node_type in ckg_x_dict:
+                ckg_x_dict[node_type] = ckg_x_dict[node_type] + fused_query_vector[ckg_index[node_type]]
+
+            ckg_x_dict = self.ckg_convs[i](ckg_x_dict, ckg_batch.edge_index_dict)
+            thought_vectors.append(self._mean_per_graph(ckg_x_dict, ckg_index, num_graphs).float().cpu().numpy())
+
+        return ckg_x_dict, thought_vectors
+
+    @staticmethod
+    def _mean_per_graph(x_dict, batch_dict, num_graphs):
+        x = torch.cat([x_dict[node_type] for node_type in x_dict])
+        batch = torch.cat([batch_dict[node_type] for node_type in x_dict])
+        return global_mean_pool(x, batch, size=num_graphs)
@@ -66,38 +66,51 @@ def load_models_bulletproof():
     logger.info("--- Resource Loading for Step 1 Finished ---")
     return _models
 
-def _run_ner_on_text(text: str, models: dict) -> List[Dict[str, Any]]:
-    if not text: return []
-    
-    gliner_ents = []
-    if models.get("gliner"):
+def _gliner_to_entities(raw_preds) -> List[Dict[str, Any]]:
+    return [{
+        "text": e["text"],
+        "label": config.GLINER_TO_INTERNAL_LABEL_MAP.get(e["label"], "unknown"),
+        "span": (e["start"], e["end"]),
+        "score": e["score"],
+        "source": "gliner"
+    } for e in raw_preds]
+
+def _run_gliner_batch(texts: List[str], models: dict) -> List[List[Dict[str, Any]]]:
+    """Chạy GLiNER cho nhiều văn bản trong MỘT lần gọi batch (fallback về từng câu nếu lỗi)."""
+    results = [[] for _ in texts]
+    if not models.get("gliner") or not texts:
+        return results
+    gliner = models["gliner"]
+    try:
+        batch_preds = gliner.batch_predict_entities(texts, config.ENTITY_LABELS, threshold=config.DEFAULT_EXTRACTION_THRESHOLD)
+        return [_gliner_to_entities(preds) for preds in batch_preds]
+    except Exception as e:
+        logger.warning(f"GLiNER batch prediction failed ({e}). Falling back to per-text prediction.")
+    for i, text in enumerate(texts):
         try:
-            raw_preds = models["gliner"].predict_entities(text, config.ENTITY_LABELS, threshold=config.DEFAULT_EXTRACTION_THRESHOLD)
-            for e in raw_preds:
-                gliner_ents.append({
-                    "text": e["text"], 
-                    "label": config.GLINER_TO_INTERNAL_LABEL_MAP.get(e["label"], "unknown"), 
-                    "span": (e["start"], e["end"]), 
-                    "score": e["score"], 
-                    "source": "gliner"
-                })
+            raw_preds = gliner.predict_entities(text, config.ENTITY_LABELS, threshold=config.DEFAULT_EXTRACTION_THRESHOLD)
+            results[i] = _gliner_to_entities(raw_preds)
         except Exception as e:
             logger.error(f"GLiNER prediction failed: {e}")
-
-    dict_ents = []
-    if models.get("matcher") and models.get("medspacy"):
-        nlp = models["medspacy"]
-        doc = nlp(text)
-        matches = models["matcher"](doc)
-        for match_id, start, end in matches:
+    return results
+
+def _run_dictionary_batch(texts: List[str], models: dict) -> List[List[Dict[str, Any]]]:
+    results = [[] for _ in texts]
+    if not (models.get("matcher") and models.get("medspacy")) or not texts:
+        return results
+    nlp = models["medspacy"]
+    for i, doc in enumerate(nlp.pipe(texts)):
+        for match_id, start, end in models["matcher"](doc):
             string_id = nlp.vocab.strings[match_id]
             label, kg_type = string_id.split("||")
             span_doc = doc[start:end]
-            dict_ents.append({
+            results[i].append({
                 "text": span_doc.text, "label": label, "kg_type": kg_type,
                 "span": (span_doc.start_char, span_doc.end_char), "score": 1.0, "source": "expert_dictionary"
             })
-            
+    return results
+
+def _merge_entities(gliner_ents: List[Dict[str, Any]], dict_ents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     # Merge logic (ưu tiên dictionary)
     if not dict_ents: return sorted(gliner_ents, key=lambda x: x['span'][0])
     final_entities = list(dict_ents)
@@ -106,9 +119,59 @@ def _run_ner_on_text(text: str, models: dict) -> List[Dict[str, Any]]:
         is_overlapped = any(i in dict_ranges for i in range(g_ent['span'][0], g_ent['span'][1]))
         if not is_overlapped:
             final_entities.append(g_ent)
-            
     return sorted(final_entities, key=lambda x: x['span'][0])
 
+def _run_ner_on_texts(texts: List[str], models: dict) -> List[List[Dict[str, Any]]]:
+    """NER cho nhiều văn bản: gom tất cả vào một batch GLiNER + một lần nlp.pipe."""
+    results = [[] for _ in texts]
+    active = [i for i, t in enumerate(texts) if t]
+    if not active: return results
+    active_texts = [texts[i] for i in active]
+    gliner_batch = _run_gliner_batch(active_texts, models)
+    dict_batch = _run_dictionary_batch(active_texts, models)
+    for j, i in enumerate(active):
+        results[i] = _merge_entities(gliner_batch[j], dict_batch[j])
+    return results
+
+def _run_ner_on_text(text: str, models: dict) -> List[Dict[str, Any]]:
+    return _run_ner_on_texts([text], models)[0]
+
+def _context_text(state: MedCOTState) -> str:
+    return (state.normalized_query or "") + "\n" + (state.normalized_patient_context or "")
+
+def _build_final_mentions(state: MedCOTState, all_raw_mentions: List[Dict[str, Any]], models: dict, doc=None) -> List[Mention]:
+    """Gắn kg_type và phân tích ngữ cảnh (phủ định, tiền sử...) cho các mention thô."""
+    for m in all_raw_mentions:
+        if "kg_type" not in m:
+            m["kg_type"] = config.INTERNAL_LABEL_TO_KG_TYPE_MAP.get(m["label"], "Phenotype")
+
+    final_mentions = []
+    if models.get("medspacy"):
+        if doc is None:
+            doc = models["medspacy"](_context_text(state))
+
+        valid_spans = []
+        offset = len(state.normalized_query or "") + 1
+        for m in all_raw_mentions:
+            start, end = m["span"]
+            if m["source_doc"] == 'patient_context':
+                start, end = start + offset, end + offset
+            
+            span = doc.char_span(start, end, label=m["label"])
+            if span:
+                span._.set("source_mention", m)
+                valid_spans.append(span)
+
+        doc.ents = filter_spans(valid_spans)
+        for ent in doc.ents:
+            src = ent._.get("source_mention")
+            attrs = {'negated': ent._.is_negated, 'historical': ent._.is_historical, 'hypothetical': ent._.is_hypothetical}
+            final_mentions.append(Mention(text=src["text"], label=src["label"], span=src["span"], score=src["score"], source=src["source_doc"], kg_type=src["kg_type"], attributes=attrs))
+    else:
+        for m in all_raw_mentions:
+             final_mentions.append(Mention(text=m["text"], label=m["label"], span=m["span"], score=m["score"], source=m["source_doc"], kg_type=m["kg_type"]))
+    return final_mentions
+
 def run(state: MedCOTState) -> MedCOTState:
     logger.info("--- Running Step 1: Entity Extraction (Bulletproof Version) ---")
     models = load_models_bulletproof()
@@ -136,41 +199,57 @@ def run(state: MedCOTState) -> MedCOTState:
         logger.warning("No entities found in any text.")
         return state
 
-    for m in all_raw_mentions:
-        if "kg_type" not in m:
-            m["kg_type"] = config.INTERNAL_LABEL_TO_KG_TYPE_MAP.get(m["label"], "Phenotype")
-
     # Xử lý context (phủ định, etc.) nếu medspacy đã tải
-    final_mentions = []
     if models.get("medspacy"):
         logger.info("  -> Running context analysis (negation, etc.)...")
-        full_text = (state.normalized_query or "") + "\n" + (state.normalized_patient_context or "")
-        nlp = models["medspacy"]
-        doc = nlp(full_text)
-        
-        valid_spans = []
-        offset = len(state.normalized_query or "") + 1
-        for m in all_raw_mentions:
-            start, end = m["span"]
-            if m["source_doc"] == 'patient_context':
-                start, end = start + offset, end + offset
-            
-            span = doc.char_span(start, end, label=m["label"])
-            if span:
-                span._.set("source_mention", m)
-                valid_spans.append(span)
-
-        doc.ents = filter_spans(valid_spans)
-        for ent in doc.ents:
-            src = ent._.get("source_mention")
-            attrs = {'negated': ent._.is_negated, 'historical': ent._.is_historical, 'hypothetical': ent._.is_hypothetical}
-            final_mentions.append(Mention(text=src["text"], label=src["label"], span=src["span"], score=src["score"], source=src["source_doc"], kg_type=src["kg_type"], attributes=attrs))
     else:
         logger.warning("MedSpaCy not loaded, skipping context analysis.")
-        for m in all_raw_mentions:
-             final_mentions.append(Mention(text=m["text"], label=m["label"], span=m["span"], score=m["score"], source=m["source_doc"], kg_type=m["kg_type"]))
+    final_mentions = _build_final_mentions(state, all_raw_mentions, models)
             
     state.mentions = final_mentions
     state.log("1_EXTRACTION", "SUCCESS", metadata={"count": len(final_mentions)})
     logger.info(f"--- Step 1 Finished. Extracted {len(final_mentions)} mentions. ---")
-    return state
\ No newline at end of file
+    return state
+
+def run_batch(states: List[MedCOTState]) -> List[MedCOTState]:
+    """
+    Phiên bản batch của Step 1: gom query + patient context của TẤT CẢ state
+    vào một lần gọi GLiNER và một lần nlp.pipe, rồi phân phối kết quả về từng state.
+    """
+    logger.info(f"--- Running Step 1: Entity Extraction (Batch of {len(states)}) ---")
+    models = load_models_bulletproof()
+    if not models.get("gliner") and not models.get("matcher"):
+        for state in states:
+            state.log("1_EXTRACTION", "CRITICAL_FAILURE", "No extraction models could be loaded.")
+        logger.critical("CRITICAL: Both GLiNER and PhraseMatcher failed to load. Cannot proceed with extraction.")
+        return states
+
+    texts, owners = [], []
+    for i, state in enumerate(states):
+        texts.append(state.normalized_query)
+        owners.append((i, "query"))
+        if state.normalized_patient_context:
+            texts.append(state.normalized_patient_context)
+            owners.append((i, "patient_context"))
+
+    raw_by_state = [[] for _ in states]
+    for (i, source_doc), ents in zip(owners, _run_ner_on_texts(texts, models)):
+        for m in ents: m['source_doc'] = source_doc
+        raw_by_state[i].extend(ents)
+
+    # Phân tích ngữ cảnh cho tất cả state có mention trong một lần nlp.pipe
+    with_mentions = [i for i, raw in enumerate(raw_by_state) if raw]
+    docs = {}
+    if models.get("medspacy") and with_mentions:
+        nlp = models["medspacy"]
+        docs = dict(zip(with_mentions, nlp.pipe([_context_text(states[i]) for i in with_mentions])))
+
+    for i, state in enumerate(states):
+        if not raw_by_state[i]:
+            state.log("1_EXTRACTION", "SKIPPED", "No entities found.")
+            continue
+        state.mentions = _build_final_mentions(state, raw_by_state[i], models, doc=docs.get(i))
+        state.log("1_EXTRACTION", "SUCCESS", metadata={"count": len(state.mentions)})
+
+    logger.info(f"--- Step 1 Batch Finished. Extracted {sum(len(s.mentions) for s in states)} mentions. ---")
+    return states
@@ -1,36 +1,113 @@
 # Tệp: src/modules/step2_linking.py (PHIÊN BẢN FIX LỖI ID=NONE)
 import logging
+import time
+from src.core import config
 from src.core.state import MedCOTState, LinkedEntity, LinkedCandidate
-from src.utils.neo4j_connect import db_connector
+from src.utils.graph_store import graph_db as db_connector   # Neo4j hoặc graph store nhúng (MEDCOT_GRAPH_BACKEND)
 from src.utils.umls_normalizer import umls_service
+from src.utils.name_index import name_index
+from src.utils.profiler import profiled
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("step2_linking")
 
-def _search_neo4j(text: str, kg_type: str = None):
-    """Hàm tìm kiếm cốt lõi trong Neo4j (Case Insensitive)"""
-    if not db_connector: return None
-    
-    # --- SỬA ĐỔI QUAN TRỌNG ---
-    # Sử dụng hàm coalesce(n.id, elementId(n))
-    # Ý nghĩa: Nếu n.id bị Null thì lấy elementId(n) (ID nội bộ của Neo4j, luôn tồn tại)
-    query = """
-    MATCH (n) 
-    WHERE toLower(n.name) = toLower($text)
-    RETURN 
-        coalesce(n.id, elementId(n)) as node_id, 
-        labels(n)[0] as node_label, 
-        n.name as preferred_name
-    LIMIT 1
-    """
+DENSE_BUDGET_MS_PER_MENTION = 10   # Ngân sách cho fallback FAISS; vượt thì chỉ cảnh báo
+KG_TYPES = set(config.INTERNAL_LABEL_TO_KG_TYPE_MAP.values())
+_retriever = None
+
+def _expand_terms(texts) -> dict:
+    """{text: [text, synonym1, synonym2, ...]} (synonym lấy từ UMLS, bỏ trùng, giữ thứ tự)."""
+    expanded = {}
+    for text in texts:
+        synonyms = []
+        try:
+            synonyms = umls_service.get_synonyms(text)
+        except Exception as e:
+            logger.error(f"UMLS error: {e}")
+        expanded[text] = list(dict.fromkeys([text, *synonyms]))
+    return expanded
+
+@profiled("step2._link_neo4j_bulk")
+def _link_neo4j_bulk(terms_by_mention: dict) -> dict:
+    """Link mọi mention trong MỘT lần gọi backend (`link_bulk`). Trả về {mention: {"match": ..., "node_ids": [...]}}."""
+    if not db_connector or not terms_by_mention: return {}
+    queries = [{"mention": m, "terms": terms} for m, terms in terms_by_mention.items()]
     try:
-        res = db_connector.run_query(query, {"text": text})
-        if res: return res[0]
+        rows = db_connector.link_bulk(queries)
     except Exception as e:
-        logger.error(f"Error querying Neo4j: {e}")
-        return None
-    
-    return None
+        logger.error(f"Error querying graph backend: {e}")
+        return {}
+    return {r["mention"]: {"match": r["best"], "node_ids": r["node_ids"]} for r in rows}
+
+def _link_via_index(texts) -> dict:
+    """Như `_link_neo4j_bulk` nhưng tra trong NameIndex (RAM); chỉ hỏi UMLS cho các mention không khớp trực tiếp."""
+    linked = {}
+    direct = name_index.lookup_many(texts)
+    for text in texts:
+        if text in direct:
+            linked[text] = {"match": {**direct[text], "rank": 0, "term": text}}
+            continue
+        logger.info(f"🔍 Direct match failed for '{text}'. Asking UMLS...")
+        synonyms = _expand_terms([text])[text][1:]
+        syn_hits = name_index.lookup_many(synonyms)
+        for rank, syn in enumerate(synonyms, start=1):
+            if syn in syn_hits:
+                linked[text] = {"match": {**syn_hits[syn], "rank": rank, "term": syn}}
+                break
+    for entry in linked.values():
+        entry["node_ids"] = name_index.node_ids([entry["match"]["preferred_name"]])
+    return linked
+
+def _get_retriever():
+    """FaissSearch dùng chung, nạp lười ở lần fallback đầu tiên (None nếu chưa build index)."""
+    global _retriever
+    if _retriever is None:
+        try:
+            from src.utils.faiss_search import faiss_retriever
+        except ImportError as e:
+            logger.warning(f"FAISS not available, dense linking disabled: {e}")
+            faiss_retriever = None
+        _retriever = faiss_retriever or False
+    return _retriever or None
+
+@profiled("step2._link_dense")
+def _link_dense(mentions) -> dict:
+    """
+    Fallback khi không khớp chính xác: encode MỌI mention chưa link trong một batch, một lần search FAISS,
+    lọc theo loại node (kg_type) và chỉ nhận match có cosine >= LINKING_THRESHOLD.
+    Trả về {(text, kg_type): {"match": ..., "node_ids": [...]}}.
+    """
+    retriever = _get_retriever()
+    keys = list(dict.fromkeys((m.text, m.kg_type) for m in mentions))
+    if retriever is None or not keys: return {}
+
+    t0 = time.perf_counter()
+    # Cùng định dạng text với lúc build index: "Name (Label)"
+    hits = retriever.search_batch(
+        [f"{text} ({kg_type})" if kg_type in KG_TYPES else text for text, kg_type in keys], k=1,
+        filters=[kg_type if kg_type in KG_TYPES else None for _, kg_type in keys], use_cache=True,
+    )
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if elapsed_ms > DENSE_BUDGET_MS_PER_MENTION * len(keys):
+        logger.warning(f"⏱️ Dense linking took {elapsed_ms:.1f}ms for {len(keys)} mentions (budget {DENSE_BUDGET_MS_PER_MENTION}ms/mention).")
+
+    linked = {}
+    for key, top in zip(keys, hits):
+        if not top or top[0]["score"] < config.LINKING_THRESHOLD: continue
+        hit = top[0]
+        node_id = hit["node_id"]   # index FAISS lưu node_id = coalesce(n.id, elementId(n))
+        entry = next((e for e in name_index.lookup_all(hit["name"]) if e["node_id"] == node_id), None)
+        labels_of_hit = hit.get("labels") or ["Unknown"]
+        linked[key] = {
+            "match": {
+                "node_id": node_id,
+                "node_label": entry["node_label"] if entry else labels_of_hit[0],
+                "preferred_name": hit["name"],
+                "score": hit["score"],
+            },
+            "node_ids": [node_id],
+        }
+    return linked
 
 def run(state: MedCOTState) -> MedCOTState:
     # Đảm bảo UMLS đã kết nối
@@ -38,79 +115,57 @@ def run(state: MedCOTState) -> MedCOTState:
         umls_service.connect()
     except Exception:
         logger.warning("UMLS service not available, skipping synonyms.")
-    
-    final_linked = []
-    
+
+    mention_texts = list(dict.fromkeys(m.text for m in state.mentions))
+    # Chỉ mục tên -> node trong RAM; nếu không dựng/nạp được thì link tất cả bằng một query UNWIND trên Neo4j
+    if name_index.ensure_loaded(db_connector):
+        linked = _link_via_index(mention_texts)
+    else:
+        logger.warning("Name index not available, linking all mentions with one bulk graph backend call.")
+        linked = _link_neo4j_bulk(_expand_terms(mention_texts)) if mention_texts else {}
+
+    # Fallback dense retrieval (FAISS) cho các mention vẫn chưa link được
+    unlinked = [m for m in state.mentions if m.text not in linked]
+    dense = _link_dense(unlinked) if unlinked else {}
+
+    final_linked, seed_nodes = [], []
     for mention in state.mentions:
         le = LinkedEntity(source_mention=mention)
-        found_candidate = None
-        method = "failed"
-
-        # 1. Thử tìm trực tiếp (Direct Match)
-        res = _search_neo4j(mention.text)
-        if res:
-            found_candidate = res
-            method = "direct_exact"
-        
-        # 2. Nếu thất bại -> Dùng UMLS để mở rộng từ đồng nghĩa (Synonym Expansion)
-        if not found_candidate:
-            logger.info(f"🔍 Direct match failed for '{mention.text}'. Asking UMLS...")
-            synonyms = []
-            try:
-                synonyms = umls_service.get_synonyms(mention.text)
-            except Exception as e:
-                logger.error(f"UMLS error: {e}")
-
-            if synonyms:
-                logger.info(f"   -> UMLS found synonyms: {synonyms[:3]} ...")
-                # Thử từng synonym trong Neo4j
-                for syn in synonyms:
-                    res = _search_neo4j(syn)
-                    if res:
-                        found_candidate = res
-                        method = f"umls_synonym ({syn})"
-                        logger.info(f"   ✅ MATCHED via synonym: '{syn}' -> {res['preferred_name']}")
-                        break
-            else:
-                logger.info("   -> UMLS found no synonyms.")
+        found = linked.get(mention.text) or dense.get((mention.text, mention.kg_type))
 
-        # 3. Gán kết quả
-        if found_candidate:
+        if found:
+            match = found["match"]
+            if "score" in match:
+                method = "dense_faiss"
+                logger.info(f"   ✅ MATCHED via FAISS: '{mention.text}' -> {match['preferred_name']} (cos={match['score']:.3f})")
+            elif match["rank"] == 0:
+                method = "direct_exact"
+            else:
+                method = f"umls_synonym ({match['term']})"
+                logger.info(f"   ✅ MATCHED via synonym: '{match['term']}' -> {match['preferred_name']}")
             # Đảm bảo node_id luôn là string (phòng hờ)
-            safe_node_id = str(found_candidate["node_id"]) if found_candidate["node_id"] is not None else "UNKNOWN_ID"
-            
+            safe_node_id = str(match["node_id"]) if match["node_id"] is not None else "UNKNOWN_ID"
+
             candidate = LinkedCandidate(
-                node_id=safe_node_id, 
-                node_label=found_candidate["node_label"],
-                preferred_name=found_candidate["preferred_name"],
-                score=1.0,
+                node_id=safe_node_id,
+                node_label=match["node_label"],
+                preferred_name=match["preferred_name"],
+                score=match.get("score", 1.0),
                 source=method
             )
             le.link_status = "linked"
             le.best_candidate = candidate
             le.candidates = [candidate]
+            # node_id của các node trùng tên -> seed cho truy vấn đồ thị (Bước 4), dùng được với mọi backend
+            seed_nodes.extend(found["node_ids"])
             logger.info(f"✅ Linked '{mention.text}' -> '{candidate.preferred_name}' (ID: {candidate.node_id})")
         else:
-            logger.warning(f"❌ Could not link '{mention.text}' even with UMLS synonyms.")
+            logger.warning(f"❌ Could not link '{mention.text}' even with UMLS synonyms or dense retrieval.")
 
         final_linked.append(le)
 
     state.linked_entities = final_linked
-    
-    # Cập nhật seed nodes cho các bước sau
-    linked_ids = [le.best_candidate.node_id for le in final_linked if le.link_status == "linked"]
-    
-    if linked_ids:
-        # Lấy elementId thực tế để query đồ thị (Bước 4)
-        # Vì node_id bây giờ có thể là elementId hoặc id gốc, ta query lại để chắc chắn lấy elementId
-        # Lưu ý: Nếu node_id đã là elementId thì query này vẫn chạy tốt nếu ta dùng WHERE elementId(n) = ... 
-        # Nhưng để đơn giản và an toàn, ta dùng name để map lại elementId một lần nữa cho danh sách seed
-        linked_names = [le.best_candidate.preferred_name for le in final_linked if le.link_status == "linked"]
-        q = "MATCH (n) WHERE n.name IN $names RETURN elementId(n) as eid"
-        r = db_connector.run_query(q, {"names": linked_names})
-        state.seed_nodes = [x['eid'] for x in r]
-    else:
-        state.seed_nodes = []
+    state.seed_nodes = list(dict.fromkeys(seed_nodes))
 
     state.log("2_LINKING", "SUCCESS", {"count": len(state.seed_nodes)})
-    return state
\ No newline at end of file
+    return state
@@ -1,37 +1,157 @@
 # Tệp: src/modules/step4_retrieval.py (PHIÊN BẢN FIX KẾT NỐI ID)
 import logging
+import math
 import uuid
-from typing import Dict, Any, List
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Any, List
+import numpy as np
+from src.core import config
 from src.core.state import MedCOTState
-from src.utils.neo4j_connect import db_connector
+from src.core.executor import run_parallel
+from src.utils.model_registry import model_registry
+from src.utils.node_embedding_store import node_embeddings
+from src.utils.graph_store import graph_db as db_connector   # Neo4j hoặc graph store nhúng (MEDCOT_GRAPH_BACKEND)
 from src.utils.arax_client import arax_client
 from src.utils.name_resolver import name_resolver
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
 logger = logging.getLogger("step4_retrieval")
 
+def _warn_unresolved(seed_ids: List[str], found_ids) -> None:
+    """Seed không có trong đồ thị của backend đọc (vd. id thuộc không gian khác) -> cảnh báo thay vì bỏ qua im lặng."""
+    missing = [s for s in seed_ids if s not in found_ids]
+    if missing:
+        logger.warning(f"⚠️ {len(missing)}/{len(seed_ids)} seed nodes not found in the graph backend: {missing[:5]}")
+
 def _run_simple_expansion(seed_ids: List[str]) -> Dict[str, Any]:
     if not seed_ids or db_connector is None: return {"nodes": [], "edges": []}
     logger.info(f"   🕸 [Simple Expansion] Getting seed nodes and direct neighbors...")
-    
-    # Dùng coalesce để đảm bảo luôn lấy được ID hợp lệ (ưu tiên id gốc, fallback sang elementId)
-    query = """
-    MATCH (seed) WHERE elementId(seed) IN $seeds OR seed.id IN $seeds
-    OPTIONAL MATCH (seed)-[r]-(neighbor)
-    WITH collect(DISTINCT seed) + collect(DISTINCT neighbor) as all_nodes_list, collect(DISTINCT r) as all_rels_list
-    RETURN [node in all_nodes_list WHERE node IS NOT NULL | 
-            {id: coalesce(node.id, elementId(node)), labels: labels(node), name: node.name, provenance: 'PrimeKG', element_id: elementId(node)}] as nodes,
-           [rel in all_rels_list WHERE rel IS NOT NULL | 
-            {id: elementId(rel), source: coalesce(startNode(rel).id, elementId(startNode(rel))), target: coalesce(endNode(rel).id, elementId(endNode(rel))), type: type(rel), provenance: 'PrimeKG'}] as relationships
-    """
     try:
-        results = db_connector.run_query(query, {"seeds": seed_ids})
-        if not results: return {"nodes": [], "edges": []}
-        record = results[0]
-        return {"nodes": record.get("nodes", []), "edges": record.get("relationships", [])}
+        graph = db_connector.expand_neighbors(seed_ids)
     except Exception as e:
         logger.error(f"Simple Expansion Query on PrimeKG failed: {e}")
         return {"nodes": [], "edges": []}
+    _warn_unresolved(seed_ids, {n["id"] for n in graph["nodes"]})
+    return graph
+
+# Ranker: (candidates, state) -> điểm cho từng candidate ({"node": ..., "rel": ...}), điểm cao được giữ trước
+def _rank_by_degree(candidates, state) -> List[float]:
+    return [math.log1p(c["node"].get("degree") or 0) for c in candidates]
+
+def _rank_by_pagerank(candidates, state) -> List[float]:
+    # PageRank tính sẵn và ghi vào node, vd. `CALL gds.pageRank.write(..., {writeProperty: 'pagerank'})`
+    return [float(c["node"].get("pagerank") or 0.0) for c in candidates]
+
+def _rank_by_similarity(candidates, state) -> List[float]:
+    """
+    Cosine giữa câu hỏi và tên node lân cận. Vector tên lấy từ store tính sẵn theo node id
+    (`src/utils/node_embedding_store.py`, cùng encoder); chỉ encode câu hỏi + tên của node chưa có trong store.
+    """
+    if not state.normalized_query or not candidates: return [0.0] * len(candidates)
+    ids = list(dict.fromkeys(c["node"]["id"] for c in candidates))
+    name_of = {c["node"]["id"]: c["node"].get("name") or "" for c in candidates}
+    if node_embeddings is not None:
+        vecs, hit = node_embeddings.gather(ids)
+        missing = np.flatnonzero(~hit)
+    else:
+        vecs, missing = None, np.arange(len(ids))
+    missing_names = list(dict.fromkeys(name_of[ids[i]] for i in missing))
+    encoder = model_registry.sentence_transformer(config.SENTENCE_ENCODER_MODEL)
+    encoded = np.asarray(encoder.encode([state.normalized_query] + missing_names, show_progress_bar=False), dtype="float32")
+    by_name = dict(zip(missing_names, encoded[1:]))
+    if vecs is None:
+        vecs = np.zeros((len(ids), encoded.shape[1]), dtype="float32")
+    for i in missing:
+        vecs[i] = by_name[name_of[ids[i]]]
+    query = encoded[0] / max(np.linalg.norm(encoded[0]), 1e-12)
+    vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+    sims = dict(zip(ids, (vecs @ query).tolist()))
+    return [sims[c["node"]["id"]] for c in candidates]
+
+RANKERS: Dict[str, Callable] = {
+    "degree": _rank_by_degree,
+    "pagerank": _rank_by_pagerank,
+    "similarity": _rank_by_similarity,
+    "none": lambda candidates, state: [0.0] * len(candidates),
+}
+
+# Ranker có khoá xếp hạng được backend áp TRƯỚC giới hạn EXPANSION_SCAN_LIMIT (ORDER BY ... LIMIT trên Neo4j).
+# Các ranker khác ("similarity", "none", ranker tự đăng ký) chỉ xếp hạng trong mẫu EXPANSION_SCAN_LIMIT cạnh
+# đầu tiên mà backend đọc được của mỗi seed, không phải toàn bộ lân cận của node hub.
+SCAN_ORDERED_RANKERS = ("degree", "pagerank")
+
+def register_ranker(name: str, ranker: Callable):
+    """Đăng ký ranker tuỳ chỉnh, chọn bằng `config.EXPANSION_RANKER = name` (chỉ xếp hạng trong mẫu đã quét)."""
+    RANKERS[name] = ranker
+
+def _apply_quotas(scored, max_per_seed: int, max_per_relation: int) -> list:
+    """Giữ các candidate điểm cao nhất của MỘT seed, tối đa `max_per_relation` cạnh mỗi loại quan hệ."""
+    per_relation, picked = Counter(), []
+    for score, cand in sorted(scored, key=lambda x: -x[0]):
+        rel_type = cand["rel"]["type"]
+        if per_relation[rel_type] >= max_per_relation: continue
+        per_relation[rel_type] += 1
+        picked.append((score, cand))
+        if len(picked) >= max_per_seed: break
+    return picked
+
+def _expand_hop(seed_ids: List[str], state: MedCOTState, ranker: Callable, max_per_seed: int, scan_order: str = None):
+    """Một bước mở rộng: trả về (node seed, [(score, candidate)] đã qua quota)."""
+    rows = db_connector.expand_bounded(seed_ids, config.EXPANSION_SCAN_LIMIT, scan_order)
+    flat = [(row["seed"]["id"], cand) for row in rows for cand in row["candidates"]]
+    scores = ranker([cand for _, cand in flat], state) if flat else []
+    by_seed = defaultdict(list)
+    for (seed_id, cand), score in zip(flat, scores):
+        by_seed[seed_id].append((score, cand))
+    picked = []
+    for scored in by_seed.values():
+        picked.extend(_apply_quotas(scored, max_per_seed, config.EXPANSION_MAX_PER_RELATION))
+    return [row["seed"] for row in rows], picked
+
+def _run_bounded_expansion(seed_ids: List[str], state: MedCOTState, top_k_nodes: int = None) -> Dict[str, Any]:
+    """
+    Mở rộng lân cận có giới hạn: fan-out tối đa mỗi seed, quota theo loại quan hệ, xếp hạng bằng
+    `RANKERS[config.EXPANSION_RANKER]`, tuỳ chọn thêm hop 2 từ các lân cận tốt nhất (bỏ qua node hub).
+    `top_k_nodes` giới hạn tổng số node (seed luôn được giữ).
+    """
+    if not seed_ids or db_connector is None: return {"nodes": [], "edges": []}
+    ranker_name = config.EXPANSION_RANKER
+    if ranker_name not in RANKERS:
+        logger.warning(f"Unknown expansion ranker '{ranker_name}', falling back to 'degree'.")
+        ranker_name = "degree"
+    ranker = RANKERS[ranker_name]
+    scan_order = ranker_name if ranker_name in SCAN_ORDERED_RANKERS else None
+    logger.info(f"   🕸 [Bounded Expansion] {len(seed_ids)} seeds, ranker={ranker_name}, hops={config.EXPANSION_HOPS}")
+
+    try:
+        seeds, picked = _expand_hop(seed_ids, state, ranker, config.EXPANSION_MAX_PER_SEED, scan_order)
+        _warn_unresolved(seed_ids, {s["id"] for s in seeds})
+        ranked = [(1, score, cand) for score, cand in picked]
+        if config.EXPANSION_HOPS >= 2 and picked:
+            seen = {s["id"] for s in seeds}
+            frontier = list(dict.fromkeys(
+                cand["node"]["id"] for score, cand in sorted(picked, key=lambda x: -x[0])
+                if cand["node"]["id"] not in seen and (cand["node"].get("degree") or 0) <= config.EXPANSION_HOP2_MAX_DEGREE
+            ))[:config.EXPANSION_HOP2_FRONTIER]
+            if frontier:
+                _, hop2 = _expand_hop(frontier, state, ranker, config.EXPANSION_HOP2_MAX_PER_NODE, scan_order)
+                ranked += [(2, score, cand) for score, cand in hop2]
+    except Exception as e:
+        logger.error(f"Bounded Expansion Query on PrimeKG failed: {e}")
+        return {"nodes": [], "edges": []}
+
+    # Seed trước, rồi lân cận hop 1, hop 2 theo điểm giảm dần
+    node_map = {s["id"]: s for s in seeds}
+    edges = []
+    for hop, score, cand in sorted(ranked, key=lambda x: (x[0], -x[1])):
+        node = cand["node"]
+        if node["id"] not in node_map:
+            if top_k_nodes and len(node_map) >= top_k_nodes: continue
+            node_map[node["id"]] = node
+        edges.append(cand["rel"])
+    nodes = [{k: v for k, v in n.items() if k not in ("degree", "pagerank")} for n in node_map.values()]
+    edges = list({e["id"]: e for e in edges if e["source"] in node_map and e["target"] in node_map}.values())
+    return {"nodes": nodes, "edges": edges}
 
 def _build_patient_state_graph(state: MedCOTState) -> Dict[str, Any]:
     psg_nodes, psg_edges, pid = [], [], f"PATIENT_{state.query_id[:8]}"
@@ -48,42 +168,54 @@ def _build_patient_state_graph(state: MedCOTState) -> Dict[str, Any]:
             ])
     return {"nodes": psg_nodes, "edges": psg_edges}
 
-def run(state: MedCOTState, use_arax_fallback: bool = True) -> MedCOTState:
-    logger.info("🚀 Step 4: Hybrid Retrieval (Local + SRI Name Resolution)")
-    
-    local_graph = _run_simple_expansion(state.seed_nodes)
+def _fetch_external_graph(entity_names: List[str]):
+    """SRI name resolution + ARAX KG2. Trả về (resolved_curies, arax_graph). Không đụng tới state."""
     arax_graph = {"nodes": [], "edges": []}
+    logger.info(f"Resolving names externally: {entity_names}")
+    
+    resolved_curies = name_resolver.resolve_names_to_curies(entity_names)
+    logger.info(f"Got resolved CURIEs: {resolved_curies}")
     
-    # --- LOGIC QUAN TRỌNG: Lấy dữ liệu từ ARAX và cập nhật Seed Nodes ---
+    if len(resolved_curies) >= 2:
+        arax_edges = arax_client.query_kg2(resolved_curies, max_results=10) # Tăng max results
+        if arax_edges:
+            arax_nodes_map = {}
+            for edge in arax_edges:
+                s_id, s_name = edge.get('source_id', edge.get('source')), edge.get('source')
+                t_id, t_name = edge.get('target_id', edge.get('target')), edge.get('target')
+                
+                # Đảm bảo ID node trùng với ID trong seed_nodes (là CURIE)
+                arax_nodes_map[s_id] = {"id": s_id, "label": "ExternalEntity", "name": s_name, "provenance": "ARAX/KG2"}
+                arax_nodes_map[t_id] = {"id": t_id, "label": "ExternalEntity", "name": t_name, "provenance": "ARAX/KG2"}
+                
+                edge['source'], edge['target'] = s_id, t_id
+                
+            arax_graph["nodes"], arax_graph["edges"] = list(arax_nodes_map.values()), arax_edges
+            logger.info(f"✅ ARAX returned {len(arax_graph['nodes'])} nodes and {len(arax_graph['edges'])} edges.")
+    return resolved_curies, arax_graph
+
+def run(state: MedCOTState, use_arax_fallback: bool = True, top_k_nodes: int = None) -> MedCOTState:
+    logger.info("🚀 Step 4: Hybrid Retrieval (Local + SRI Name Resolution)")
+    
+    # Expansion trên Neo4j local và tra cứu SRI/ARAX không phụ thuộc nhau -> chạy song song
+    seed_ids = list(state.seed_nodes)
+    if config.EXPANSION_MODE == "full":
+        tasks = {"local": lambda: _run_simple_expansion(seed_ids)}
+    else:
+        tasks = {"local": lambda: _run_bounded_expansion(seed_ids, state, top_k_nodes)}
     if use_arax_fallback and state.mentions:
         entity_names = list(set([m.text for m in state.mentions]))
-        logger.info(f"Resolving names externally: {entity_names}")
-        
-        resolved_curies = name_resolver.resolve_names_to_curies(entity_names)
-        logger.info(f"Got resolved CURIEs: {resolved_curies}")
-        
-        # [FIX] Thêm CURIEs từ ARAX vào seed_nodes để Step 6 có thể tìm đường đi
-        if resolved_curies:
-            state.seed_nodes.extend(resolved_curies)
-            state.seed_nodes = list(set(state.seed_nodes)) # Remove duplicates
-            logger.info(f"✅ Updated Seed Nodes with External IDs: {resolved_curies}")
-        
-        if len(resolved_curies) >= 2:
-            arax_edges = arax_client.query_kg2(resolved_curies, max_results=10) # Tăng max results
-            if arax_edges:
-                arax_nodes_map = {}
-                for edge in arax_edges:
-                    s_id, s_name = edge.get('source_id', edge.get('source')), edge.get('source')
-                    t_id, t_name = edge.get('target_id', edge.get('target')), edge.get('target')
-                    
-                    # Đảm bảo ID node trùng với ID trong seed_nodes (là CURIE)
-                    arax_nodes_map[s_id] = {"id": s_id, "label": "ExternalEntity", "name": s_name, "provenance": "ARAX/KG2"}
-                    arax_nodes_map[t_id] = {"id": t_id, "label": "ExternalEntity", "name": t_name, "provenance": "ARAX/KG2"}
-                    
-                    edge['source'], edge['target'] = s_id, t_id
-                    
-                arax_graph["nodes"], arax_graph["edges"] = list(arax_nodes_map.values()), arax_edges
-                logger.info(f"✅ ARAX returned {len(arax_graph['nodes'])} nodes and {len(arax_graph['edges'])} edges.")
+        tasks["external"] = lambda: _fetch_external_graph(entity_names)
+    results = run_parallel(tasks, name="step4") if len(tasks) > 1 else {"local": tasks["local"]()}
+    
+    local_graph = results["local"]
+    resolved_curies, arax_graph = results.get("external", ([], {"nodes": [], "edges": []}))
+    
+    # [FIX] Thêm CURIEs từ ARAX vào seed_nodes để Step 6 có thể tìm đường đi
+    if resolved_curies:
+        state.seed_nodes.extend(resolved_curies)
+        state.seed_nodes = list(set(state.seed_nodes)) # Remove duplicates
+        logger.info(f"✅ Updated Seed Nodes with External IDs: {resolved_curies}")
 
     psg = _build_patient_state_graph(state)
     logger.info("   - Merging graphs from all sources...")
@@ -105,6 +237,6 @@ def run(state: MedCOTState, use_arax_fallback: bool = True) -> MedCOTState:
     state.graph_refs["ckg_subgraph"] = {"nodes": list(final_node_map.values()), "edges": final_edges}
     
     arax_was_used = use_arax_fallback and bool(arax_graph.get("edges"))
-    state.log("4_RETRIEVAL", "SUCCESS", metadata={"nodes": len(final_node_map), "edges": len(final_edges), "arax_used": arax_was_used})
+    state.log("4_RETRIEVAL", "SUCCESS", metadata={"nodes": len(final_node_map), "edges": len(final_edges), "arax_used": arax_was_used, "expansion": config.EXPANSION_MODE})
     
     return state
\ No newline at end of file
@@ -1,99 +1,214 @@
+import hashlib
+import json
 import logging
+import threading
+from collections import OrderedDict
 import torch
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from torch_geometric.data import HeteroData
+from torch_geometric.data import Batch, HeteroData
+from torch_geometric.nn import HGTConv
 from pathlib import Path
 from src.core.state import MedCOTState
 from src.models.dual_tower_gnn import CoGCoT_DualTower_GNN
+from src.core import config
+from src.utils.model_registry import model_registry
+from src.utils.node_embedding_store import node_embeddings
+from src.utils.hetero_graph import SubgraphIndex, subgraph_index
+from src.utils.cpu_inference import autocast, prepare_model, resolve_precision
 
 # --- CẤU HÌNH LOGGING ĐỂ TẮT RÁC ---
 # Tắt log DEBUG của PyRuSH và các thư viện khác để log gọn gàng
 logger = logging.getLogger("step5_dual_tower")
 # ------------------------------------
 
-_encoder = None
 GNN_MODEL_PATH = Path("models/gnn_dual_tower_weights.pth")
+GNN_HIDDEN_CHANNELS = 128
+GNN_QUERY_DIM = 384
 
 def load_encoder():
-    global _encoder
-    if _encoder is None: 
-        logger.info("loading sentence transformer...")
-        _encoder = SentenceTransformer("all-MiniLM-L6-v2") 
-    return _encoder
+    # Dùng chung instance với Step 6 qua model registry
+    return model_registry.sentence_transformer(config.SENTENCE_ENCODER_MODEL)
 
-def _prepare_hetero_data_robust(nodes, edges, encoder):
+def load_resources():
+    """Warm-up: encoder + trọng số GNN (đọc file một lần cho cả process)."""
+    _load_gnn_weights()
+    return load_encoder()
+
+# --- Cache model GNN theo metadata (node_types, edge_types) của đồ thị ---
+# Model dùng Linear(-1, ...) (lazy) và HGTConv phụ thuộc metadata, nên mỗi metadata cần một instance riêng;
+# instance được dựng + nạp trọng số một lần rồi giữ trong model registry (kind "gnn").
+_gnn_weights = None
+_gnn_signatures = {}           # tên model -> (ckg_metadata, psg_metadata, num_think_steps, precision)
+_gnn_recent = OrderedDict()    # tên model theo thứ tự dùng gần nhất (LRU)
+_gnn_lock = threading.Lock()
+
+def _load_gnn_weights():
+    """State dict của GNN trên CPU; {} nếu chưa train hoặc không đọc được."""
+    global _gnn_weights
+    if _gnn_weights is None:
+        with _gnn_lock:
+            if _gnn_weights is None:
+                weights = {}
+                if GNN_MODEL_PATH.exists():
+                    try:
+                        weights = torch.load(GNN_MODEL_PATH, map_location="cpu")
+                    except Exception as load_err:
+                        logger.warning(f"Could not load GNN weights: {load_err}")
+                _gnn_weights = weights
+    return _gnn_weights
+
+class _CachedGNN:
     """
-    Hàm này tạo data trên CPU, ta sẽ chuyển lên GPU sau.
+    GNN đã nạp trọng số cho một metadata. Lần forward đầu chạy dưới lock (khởi tạo các Linear lazy
+    chưa có trong trọng số), sau đó mới quantize int8 (INFERENCE_PRECISION) và `torch.compile` nếu bật GNN_COMPILE.
     """
-    data = HeteroData()
-    if not nodes: return data, {}
+    def __init__(self, model, precision: str = "fp32"):
+        self.model = model
+        self.precision = precision
+        self._forward = model
+        self._ready = False
+        self._lock = threading.Lock()
 
-    # Group nodes and create embeddings (trên CPU)
-    grouped_nodes = {}
-    node_id_to_idx = {} 
-    
-    for n in nodes:
-        lbl = n.get("label", "Unknown").replace("/", "_").replace(" ", "_")
-        if lbl not in grouped_nodes: grouped_nodes[lbl] = []
-        current_idx = len(grouped_nodes[lbl])
-        node_id_to_idx[n['id']] = (lbl, current_idx)
-        grouped_nodes[lbl].append(n)
-
-    for lbl, nlist in grouped_nodes.items():
-        texts = [n.get("name", "Unknown") for n in nlist]
-        embs = encoder.encode(texts, show_progress_bar=False)
-        data[lbl].x = torch.tensor(embs, dtype=torch.float32)
-
-    # Process Edges
-    edge_index_map = {}
-    for e in edges:
-        s_id, t_id = e["source"], e["target"]
-        if s_id not in node_id_to_idx or t_id not in node_id_to_idx:
-            continue
-        s_lbl, s_idx = node_id_to_idx[s_id]
-        t_lbl, t_idx = node_id_to_idx[t_id]
-        e_type = e.get("type", "RELATED").upper()
-        triplet = (s_lbl, e_type, t_lbl)
-        if triplet not in edge_index_map:
-            edge_index_map[triplet] = [[], []]
-        edge_index_map[triplet][0].append(s_idx)
-        edge_index_map[triplet][1].append(t_idx)
-
-    for triplet, indices in edge_index_map.items():
-        if len(indices[0]) > 0:
-            data[triplet].edge_index = torch.tensor(indices, dtype=torch.long)
-    
-    legacy_node_map = {}
-    for lbl, nlist in grouped_nodes.items():
-        legacy_node_map[lbl] = {n['id']: i for i, n in enumerate(nlist)}
+    def _compile(self):
+        # HGTConv dùng HeteroDictLinear (grouped matmul) -> giữ fp32, chỉ quantize các Linear chiếu đầu vào/query
+        self.model = self._forward = prepare_model(self.model, self.precision, skip=(HGTConv,))
+        if config.GNN_COMPILE and hasattr(torch, "compile"):
+            try:
+                self._forward = torch.compile(self.model, dynamic=True)
+            except Exception as e:
+                logger.warning(f"torch.compile unavailable for GNN, running eager: {e}")
 
-    return data, legacy_node_map
+    def _first_call(self, fn, *args):
+        with self._lock:
+            if self._ready: return None
+            out = fn(*args)
+            self._compile()
+            self._ready = True
+            return out
 
-def run(state: MedCOTState, num_think_steps: int = 2) -> MedCOTState:
-    ug = state.graph_refs.get("ckg_subgraph")
-    if not ug or not ug.get("nodes"):
-        state.log("5_REASONING", "SKIPPED", "No subgraph")
-        return state
+    def __call__(self, ckg_data, psg_data, query_emb):
+        with autocast(self.precision):
+            if not self._ready:
+                out = self._first_call(self.model, ckg_data, psg_data, query_emb)
+                if out is not None: return out
+            try:
+                return self._forward(ckg_data, psg_data, query_emb)
+            except Exception as e:
+                if self._forward is self.model: raise
+                logger.warning(f"Compiled GNN failed, falling back to eager: {e}")
+                self._forward = self.model
+                return self.model(ckg_data, psg_data, query_emb)
 
-    encoder = load_encoder()
-    
-    # --- SỬA LỖI DEVICE ---
-    # 1. Xác định thiết bị đích (GPU nếu có, không thì CPU)
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    logger.info(f"GNN running on device: {device}")
-    
-    # 2. Tạo Tensors (mặc định trên CPU hoặc GPU)
-    q_emb = encoder.encode(state.normalized_query, convert_to_tensor=True) if state.normalized_query else torch.zeros(384)
+    def forward_batch(self, ckg_batch, psg_batch, query_embs):
+        """Nhiều đồ thị cùng metadata trong một lần forward (eager)."""
+        with autocast(self.precision):
+            if not self._ready:
+                out = self._first_call(self.model.forward_batch, ckg_batch, psg_batch, query_embs)
+                if out is not None: return out
+            return self.model.forward_batch(ckg_batch, psg_batch, query_embs)
+
+def _load_gnn(name: str, device: str):
+    ckg_metadata, psg_metadata, num_think_steps, precision = _gnn_signatures[name]
+    model = CoGCoT_DualTower_GNN(ckg_metadata, psg_metadata, GNN_HIDDEN_CHANNELS, GNN_QUERY_DIM, num_think_steps)
+    model.to(device)
+    weights = _load_gnn_weights()
+    if weights:
+        try:
+            model.load_state_dict(weights, strict=False)
+        except Exception as load_err:
+            logger.warning(f"Could not load GNN weights: {load_err}")
+    model.eval()
+    return _CachedGNN(model, precision)
+
+model_registry.register_loader("gnn", _load_gnn)
+
+def get_gnn_model(ckg_metadata, psg_metadata, num_think_steps: int, device) -> _CachedGNN:
+    """Model dùng chung cho metadata này (chỉ dựng + nạp trọng số ở lần đầu)."""
+    precision = resolve_precision(device=device)
+    signature = json.dumps([ckg_metadata, psg_metadata, num_think_steps, precision])
+    name = f"gnn-{hashlib.sha1(signature.encode('utf-8')).hexdigest()[:12]}"
+    with _gnn_lock:
+        _gnn_signatures.setdefault(name, (ckg_metadata, psg_metadata, num_think_steps, precision))
+        _gnn_recent[name] = None
+        _gnn_recent.move_to_end(name)
+        stale = []
+        while len(_gnn_recent) > config.GNN_MODEL_CACHE_SIZE:
+            stale.append(_gnn_recent.popitem(last=False)[0])
+    for old in stale:
+        model_registry.evict(name=old, kind="gnn")
+    return model_registry.get("gnn", name, str(device))
+
+def reset_gnn_cache():
+    """Bỏ mọi model GNN đã dựng + trọng số đã đọc (vd. sau khi train lại)."""
+    global _gnn_weights
+    with _gnn_lock:
+        _gnn_weights = None
+        _gnn_recent.clear()
+    model_registry.evict(kind="gnn")
+
+def _encode_unique(encoder, texts) -> dict:
+    """Encode các text KHÁC NHAU trong một lần gọi, trả về map text -> embedding."""
+    unique_texts = list(dict.fromkeys(texts))
+    if not unique_texts: return {}
+    embs = encoder.encode(unique_texts, show_progress_bar=False)
+    return dict(zip(unique_texts, embs))
+
+def _missing_names(nodes) -> list:
+    """Tên của các node KHÔNG có trong store embedding tính sẵn (cần encode)."""
+    if node_embeddings is None: return [n.get("name", "Unknown") for n in nodes]
+    rows = node_embeddings.lookup([n.get("id") for n in nodes])
+    return [nodes[i].get("name", "Unknown") for i in np.flatnonzero(rows < 0)]
+
+def _embed_nodes(nodes, encoder, text_embeddings: dict = None) -> np.ndarray:
+    """
+    Embedding tên node [N, dim]: gom từ store tính sẵn theo node id (một lần index vector hoá),
+    chỉ encode các node không có trong store.
+    """
+    if node_embeddings is not None:
+        embs, hit = node_embeddings.gather([n.get("id") for n in nodes])
+        missing = np.flatnonzero(~hit)
+    else:
+        embs, missing = None, np.arange(len(nodes))
+    if len(missing):
+        texts = [nodes[i].get("name", "Unknown") for i in missing]
+        if text_embeddings is not None:
+            encoded = np.stack([text_embeddings[t] for t in texts])
+        else:
+            encoded = encoder.encode(texts, show_progress_bar=False)
+        if embs is None: return np.asarray(encoded, dtype=np.float32)
+        embs[missing] = encoded
+    return embs
+
+def _prepare_hetero_data_robust(nodes, edges, encoder, text_embeddings: dict = None, index: SubgraphIndex = None):
+    """
+    Hàm này tạo data trên CPU, ta sẽ chuyển lên GPU sau.
+    Embedding tên node lấy từ store tính sẵn (`src/utils/node_embedding_store.py`) nếu có; node còn thiếu
+    được encode, hoặc lấy từ `text_embeddings` (text -> vector đã encode sẵn theo batch) nếu truyền vào.
+    Node/cạnh được chuyển sang tensor theo cột (`src/utils/hetero_graph.py`); `index` là id map sẵn có của `nodes`.
+    """
+    if not nodes: return HeteroData(), {}
+    index = SubgraphIndex(nodes) if index is None else index
+    data = index.to_hetero_data(edges, _embed_nodes(nodes, encoder, text_embeddings))
+    return data, index.type_node_map()
 
-    ckg_nodes = [n for n in ug["nodes"] if n.get("provenance") != "PSG"]
-    psg_nodes = [n for n in ug["nodes"] if n.get("provenance") == "PSG"]
-    ckg_edges = [e for e in ug["edges"] if e.get("provenance") != "PSG"]
-    psg_edges = [e for e in ug["edges"] if e.get("provenance") == "PSG"]
+def _split_towers(state: MedCOTState):
+    """
+    (index CKG, cạnh CKG, index PSG, cạnh PSG). Index của mỗi tower là view của id map dùng chung
+    `subgraph_index(state)` (Step 6, 7 dùng lại), không dựng SubgraphIndex riêng cho Step 5.
+    """
+    index, edges = subgraph_index(state), state.graph_refs["ckg_subgraph"]["edges"]
+    psg = np.fromiter((n.get("provenance") == "PSG" for n in index.nodes), dtype=bool, count=len(index))
+    ckg_edges = [e for e in edges if e.get("provenance") != "PSG"]
+    psg_edges = [e for e in edges if e.get("provenance") == "PSG"]
+    return index.subset(~psg), ckg_edges, index.subset(psg), psg_edges
 
-    ckg_d, ckg_m = _prepare_hetero_data_robust(ckg_nodes, ckg_edges, encoder)
-    psg_d, psg_m = _prepare_hetero_data_robust(psg_nodes, psg_edges, encoder)
+def _prepare_towers(state: MedCOTState, encoder, text_embeddings: dict = None):
+    ckg_index, ckg_edges, psg_index, psg_edges = _split_towers(state)
+    ckg_d, ckg_m = _prepare_hetero_data_robust(ckg_index.nodes, ckg_edges, encoder, text_embeddings, ckg_index)
+    psg_d, _ = _prepare_hetero_data_robust(psg_index.nodes, psg_edges, encoder, text_embeddings, psg_index)
+    return ckg_d, ckg_m, psg_d
 
+def _run_gnn(state: MedCOTState, q_emb, ckg_d, ckg_m, psg_d, num_think_steps: int, device) -> MedCOTState:
     # 3. Chuyển tất cả mọi thứ lên cùng một device
     q_emb = q_emb.to(device)
     ckg_d = ckg_d.to(device)
@@ -107,18 +222,8 @@ def run(state: MedCOTState, num_think_steps: int = 2) -> MedCOTState:
         return state
 
     try:
-        # Load model và chuyển nó lên device
-        model = CoGCoT_DualTower_GNN(ckg_d.metadata(), psg_d.metadata(), 128, 384, num_think_steps)
-        model.to(device) # <--- QUAN TRỌNG
-        
-        if GNN_MODEL_PATH.exists(): 
-            try:
-                # Load weights vào model đã ở trên GPU
-                model.load_state_dict(torch.load(GNN_MODEL_PATH, map_location=device), strict=False)
-            except Exception as load_err:
-                logger.warning(f"Could not load GNN weights: {load_err}")
-        
-        model.eval()
+        # Model đã dựng + nạp trọng số sẵn trên device (cache theo metadata)
+        model = get_gnn_model(ckg_d.metadata(), psg_d.metadata(), num_think_steps, device)
         with torch.no_grad():
             # Bây giờ tất cả input và model đều ở trên GPU
             final_x, thoughts = model(ckg_d, psg_d, q_emb)
@@ -126,7 +231,7 @@ def run(state: MedCOTState, num_think_steps: int = 2) -> MedCOTState:
         # Chuyển kết quả về lại CPU để lưu trữ (numpy/json không đọc được tensor GPU)
         final_node_embeddings = {}
         for nt, feat in final_x.items():
-            final_node_embeddings[nt] = feat.cpu().numpy()
+            final_node_embeddings[nt] = feat.float().cpu().numpy()
         state.graph_refs["final_node_embeddings"] = final_node_embeddings
             
         state.gcot["thought_vectors"] = thoughts
@@ -136,4 +241,88 @@ def run(state: MedCOTState, num_think_steps: int = 2) -> MedCOTState:
         logger.error(f"GNN Error handled gracefully: {e}", exc_info=True) # exc_info=True để in traceback
         state.log("5_REASONING", "FAILED_BUT_CONTINUED", str(e))
 
-    return state
\ No newline at end of file
+    return state
+
+def run(state: MedCOTState, num_think_steps: int = 2) -> MedCOTState:
+    ug = state.graph_refs.get("ckg_subgraph")
+    if not ug or not ug.get("nodes"):
+        state.log("5_REASONING", "SKIPPED", "No subgraph")
+        return state
+
+    encoder = load_encoder()
+    
+    # --- SỬA LỖI DEVICE ---
+    # 1. Xác định thiết bị đích (GPU nếu có, không thì CPU)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    logger.info(f"GNN running on device: {device}")
+    
+    # 2. Tạo Tensors (mặc định trên CPU hoặc GPU)
+    q_emb = encoder.encode(state.normalized_query, convert_to_tensor=True) if state.normalized_query else torch.zeros(384)
+
+    ckg_d, ckg_m, psg_d = _prepare_towers(state, encoder)
+
+    return _run_gnn(state, q_emb, ckg_d, ckg_m, psg_d, num_think_steps, device)
+
+def run_batch(states, num_think_steps: int = 2):
+    """
+    Phiên bản batch của Step 5: encode query và tên node (chưa có trong store tính sẵn) của TẤT CẢ
+    state trong một lần gọi encoder (đã khử trùng lặp), sau đó chạy GNN một lần cho mỗi nhóm state
+    có cùng metadata đồ thị (PyG mini-batching).
+    """
+    active = []
+    for state in states:
+        ug = state.graph_refs.get("ckg_subgraph")
+        if not ug or not ug.get("nodes"):
+            state.log("5_REASONING", "SKIPPED", "No subgraph")
+        else:
+            active.append(state)
+    if not active: return states
+
+    encoder = load_encoder()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    logger.info(f"GNN running on device: {device} (batch of {len(active)})")
+
+    all_texts = [s.normalized_query for s in active if s.normalized_query]
+    for state in active:
+        all_texts.extend(_missing_names(state.graph_refs["ckg_subgraph"]["nodes"]))
+    text_embeddings = _encode_unique(encoder, all_texts)
+
+    # Đồ thị cùng metadata dùng chung model -> gộp thành một batch (đồ thị rời) và forward một lần
+    groups = {}
+    for state in active:
+        q = state.normalized_query
+        q_emb = torch.as_tensor(np.asarray(text_embeddings[q]), dtype=torch.float32) if q else torch.zeros(384)
+        ckg_d, ckg_m, psg_d = _prepare_towers(state, encoder, text_embeddings)
+        state.graph_refs["node_map"] = ckg_m
+        if not ckg_d.node_types:
+            state.log("5_REASONING", "SKIPPED", "Empty CKG Data")
+            continue
+        key = json.dumps([ckg_d.metadata(), psg_d.metadata()])
+        groups.setdefault(key, []).append((state, q_emb, ckg_d, psg_d))
+
+    for items in groups.values():
+        _run_gnn_group(items, num_think_steps, device)
+    return states
+
+def _run_gnn_group(items, num_think_steps: int, device):
+    """Chạy GNN một lần cho nhiều state có cùng metadata đồ thị; kết quả được tách lại theo từng state."""
+    states = [state for state, _, _, _ in items]
+    try:
+        ckg_b = Batch.from_data_list([ckg_d for _, _, ckg_d, _ in items]).to(device)
+        psg_b = Batch.from_data_list([psg_d for _, _, _, psg_d in items]).to(device) if items[0][3].node_types else None
+        q_embs = torch.stack([q_emb for _, q_emb, _, _ in items]).to(device)
+        model = get_gnn_model(items[0][2].metadata(), items[0][3].metadata(), num_think_steps, device)
+        with torch.no_grad():
+            final_x, thoughts = model.forward_batch(ckg_b, psg_b, q_embs)
+
+        final_x = {nt: feat.float().cpu().numpy() for nt, feat in final_x.items()}
+        for g, state in enumerate(states):
+            state.graph_refs["final_node_embeddings"] = {
+                nt: feat[int(ckg_b[nt].ptr[g]):int(ckg_b[nt].ptr[g + 1])] for nt, feat in final_x.items()
+            }
+            state.gcot["thought_vectors"] = [step[g] for step in thoughts]
+            state.log("5_REASONING", "SUCCESS", {"thoughts": len(thoughts), "batched_graphs": len(states)})
+    except Exception as e:
+        logger.error(f"Batched GNN Error handled gracefully: {e}", exc_info=True)
+        for state in states:
+            state.log("5_REASONING", "FAILED_BUT_CONTINUED", str(e))
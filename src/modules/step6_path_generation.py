@@ -1,12 +1,14 @@
 # src/modules/step6_path_generation.py
 import logging
 import numpy as np
-from sentence_transformers import SentenceTransformer, util, CrossEncoder
+from sentence_transformers import util
 from src.core.state import MedCOTState
+from src.core import config
+from src.utils.model_registry import model_registry
+from src.utils.hetero_graph import subgraph_index
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
 logger = logging.getLogger("step6_constrained_path_gen")
-_models = {}
 
 # --- NÂNG CẤP THEO CHỐT 6: RÀNG BUỘC TÌM KIẾM THEO NGỮ NGHĨA ---
 SEMANTIC_CONSTRAINTS = {
@@ -17,10 +19,8 @@ SEMANTIC_CONSTRAINTS = {
 }
 
 def load_models():
-    if not _models:
-        _models["embedder"] = SentenceTransformer("all-MiniLM-L6-v2")
-        _models["reranker"] = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
-    return _models["embedder"], _models["reranker"]
+    return (model_registry.sentence_transformer(config.SENTENCE_ENCODER_MODEL),
+            model_registry.cross_encoder(config.RERANKER_MODEL))
 
 def detect_query_intent(query: str) -> str:
     q = query.lower()
@@ -30,12 +30,14 @@ def detect_query_intent(query: str) -> str:
     return "GENERIC"
 
 class ConstrainedPathGenerator:
-    def __init__(self, state: MedCOTState, embedder):
+    def __init__(self, state: MedCOTState, embedder, query_emb=None):
         self.state = state
         self.embedder = embedder
-        self.query_emb = embedder.encode(state.normalized_query, convert_to_tensor=True) if state.normalized_query else None
-        self.intent = detect_query_intent(state.normalized_query)
-        self.meta = {n['id']: n for n in state.graph_refs.get("ckg_subgraph", {}).get("nodes", [])}
+        if query_emb is None and state.normalized_query:
+            query_emb = embedder.encode(state.normalized_query, convert_to_tensor=True)
+        self.query_emb = query_emb
+        self.intent = detect_query_intent(state.normalized_query or "")
+        self.meta = subgraph_index(state).node_map
         self.adj = self._build_adj(strict_mode=True)
         self.used_fallback = False
 
@@ -60,38 +62,43 @@ class ConstrainedPathGenerator:
         self.adj = self._build_adj(strict_mode=False)
         self.used_fallback = True
 
-    def search(self, width=50, depth=3):
-        if self.query_emb is None or not self.state.seed_nodes: return []
+    def start_search(self, width=50):
+        self.width = width
+        self._final, self._beam, self._pending = [], [], []
+        if self.query_emb is None or not self.state.seed_nodes: return
         seeds = [s for s in self.state.seed_nodes if s in self.adj]
-        if not seeds: return []
-        
-        beam = [(0.0, [{"node_id": s}]) for s in seeds]
-        final = []
-        
-        for _ in range(depth): # Max path length = depth
-            candidates = []
-            for score, path in beam:
-                curr_node_id = path[-1]['node_id']
-                if len(path) > 1: final.append((score, path))
-                
-                neighbors = self.adj.get(curr_node_id, [])
-                current_path_nodes = {step['node_id'] for step in path}
-                valid_neighbors = [n for n in neighbors if n['node'] not in current_path_nodes] # Cycle Control
-                if not valid_neighbors: continue
-                
-                texts = [f"{n['edge_text']} {self.meta.get(n['node'], {}).get('name', '')}" for n in valid_neighbors]
-                sem_sims = util.cos_sim(self.query_emb, self.embedder.encode(texts, convert_to_tensor=True))[0].cpu().numpy()
-                
-                for i, nb in enumerate(valid_neighbors):
-                    new_step = {"node_id": nb['node'], "edge_raw": nb["edge_raw"], "edge_text": nb["edge_text"], "provenance": nb["provenance"]}
-                    candidates.append((score + float(sem_sims[i]), path + [new_step]))
+        self._beam = [(0.0, [{"node_id": s}]) for s in seeds]
+
+    def next_level_texts(self) -> list:
+        """Chuẩn bị các bước mở rộng của một level beam, trả về các text cần encode."""
+        self._pending, texts = [], []
+        for score, path in self._beam:
+            curr_node_id = path[-1]['node_id']
+            if len(path) > 1: self._final.append((score, path))
             
-            if not candidates: break
-            candidates.sort(key=lambda x: x[0], reverse=True)
-            beam = candidates[:width]
-        
+            neighbors = self.adj.get(curr_node_id, [])
+            current_path_nodes = {step['node_id'] for step in path}
+            valid_neighbors = [n for n in neighbors if n['node'] not in current_path_nodes] # Cycle Control
+            for nb in valid_neighbors:
+                self._pending.append((score, path, nb))
+                texts.append(f"{nb['edge_text']} {self.meta.get(nb['node'], {}).get('name', '')}")
+        return texts
+
+    def advance(self, text_embs):
+        """Chấm điểm các bước mở rộng bằng embedding đã encode (theo batch) và cắt beam."""
+        sem_sims = util.cos_sim(self.query_emb, text_embs)[0].cpu().numpy()
+        candidates = []
+        for i, (score, path, nb) in enumerate(self._pending):
+            new_step = {"node_id": nb['node'], "edge_raw": nb["edge_raw"], "edge_text": nb["edge_text"], "provenance": nb["provenance"]}
+            candidates.append((score + float(sem_sims[i]), path + [new_step]))
+        candidates.sort(key=lambda x: x[0], reverse=True)
+        self._beam = candidates[:self.width]
+        self._pending = []
+
+    def collect_results(self):
+        if self.query_emb is None: return []
         results, seen_paths = [], set()
-        for score, path in sorted(final + beam, key=lambda x: x[0], reverse=True):
+        for score, path in sorted(self._final + self._beam, key=lambda x: x[0], reverse=True):
             if len(path) < 2: continue
             clean_path, parts = [], []
             for i in range(len(path) - 1):
@@ -105,7 +112,37 @@ class ConstrainedPathGenerator:
             if text_repr not in seen_paths:
                 seen_paths.add(text_repr)
                 results.append({"path": clean_path, "text_repr": text_repr, "score": float(score)})
-        return results[:width]
+        return results[:self.width]
+
+    def search(self, width=50, depth=3):
+        return run_beam_search([self], self.embedder, width=width, depth=depth)[0]
+
+def run_beam_search(generators, embedder, width=50, depth=3):
+    """
+    Beam search đồng thời cho nhiều generator: mỗi level gom text mở rộng của TẤT CẢ
+    generator (đã khử trùng lặp) vào một lần encode, rồi chia embedding về từng beam.
+    """
+    for gen in generators: gen.start_search(width)
+    active = list(generators)
+    for _ in range(depth): # Max path length = depth
+        requests = [(gen, gen.next_level_texts()) for gen in active]
+        requests = [(gen, texts) for gen, texts in requests if texts]
+        if not requests: break
+
+        unique_texts = list(dict.fromkeys(t for _, texts in requests for t in texts))
+        text_pos = {t: i for i, t in enumerate(unique_texts)}
+        embs = embedder.encode(unique_texts, convert_to_tensor=True)
+        for gen, texts in requests:
+            gen.advance(embs[[text_pos[t] for t in texts]])
+        active = [gen for gen, _ in requests]
+    return [gen.collect_results() for gen in generators]
+
+def _apply_rerank(state: MedCOTState, gen: ConstrainedPathGenerator, paths, scores):
+    for i, p in enumerate(paths): 
+        p['final_score'] = 0.3 * p['score'] + 0.7 * (1 / (1 + np.exp(-scores[i])))
+    
+    state.candidate_paths = sorted(paths, key=lambda x: x['final_score'], reverse=True)[:10]
+    state.log("6_PATH_GEN", "SUCCESS", {"count": len(state.candidate_paths), "intent": gen.intent, "fallback_used": gen.used_fallback})
 
 def run(state: MedCOTState, beam_width: int = 50, max_path_length: int = 3) -> MedCOTState: # Max hops = 3-1 = 2
     try:
@@ -123,13 +160,54 @@ def run(state: MedCOTState, beam_width: int = 50, max_path_length: int = 3) -> M
         
         path_texts = [[state.normalized_query, p["text_repr"]] for p in paths]
         scores = reranker.predict(path_texts)
-        for i, p in enumerate(paths): 
-            p['final_score'] = 0.3 * p['score'] + 0.7 * (1 / (1 + np.exp(-scores[i])))
-        
-        state.candidate_paths = sorted(paths, key=lambda x: x['final_score'], reverse=True)[:10]
-        state.log("6_PATH_GEN", "SUCCESS", {"count": len(state.candidate_paths), "intent": gen.intent, "fallback_used": gen.used_fallback})
+        _apply_rerank(state, gen, paths, scores)
         
     except Exception as e:
         logger.exception("Path Gen Error")
         state.log("6_PATH_GEN", "FAILED", str(e))
-    return state
\ No newline at end of file
+    return state
+
+def run_batch(states, beam_width: int = 50, max_path_length: int = 3):
+    """
+    Phiên bản batch của Step 6: encode tất cả query một lần, chạy beam search song song
+    (một lần encode mỗi level) và rerank TẤT CẢ path của mọi state bằng một lần predict.
+    """
+    try:
+        embedder, reranker = load_models()
+        queries = [s.normalized_query for s in states if s.normalized_query]
+        q_embs = embedder.encode(queries, convert_to_tensor=True) if queries else []
+
+        gens, q_idx = [], 0
+        for state in states:
+            q_emb = None
+            if state.normalized_query:
+                q_emb, q_idx = q_embs[q_idx], q_idx + 1
+            gens.append(ConstrainedPathGenerator(state, embedder, query_emb=q_emb))
+
+        results = run_beam_search(gens, embedder, width=beam_width, depth=max_path_length)
+        retry = [i for i, paths in enumerate(results) if not paths]
+        for i in retry: gens[i].enable_fallback()
+        if retry:
+            retried = run_beam_search([gens[i] for i in retry], embedder, width=beam_width, depth=max_path_length)
+            for i, paths in zip(retry, retried): results[i] = paths
+
+        pairs, owners = [], []
+        for i, paths in enumerate(results):
+            if not paths:
+                states[i].log("6_PATH_GEN", "SKIPPED", {"msg": "No paths found even with fallback"})
+                continue
+            pairs.extend([states[i].normalized_query, p["text_repr"]] for p in paths)
+            owners.append(i)
+
+        scores = reranker.predict(pairs) if pairs else []
+        offset = 0
+        for i in owners:
+            n = len(results[i])
+            _apply_rerank(states[i], gens[i], results[i], scores[offset:offset + n])
+            offset += n
+
+    except Exception as e:
+        logger.exception("Path Gen Error (batch)")
+        for state in states:
+            state.log("6_PATH_GEN", "FAILED", str(e))
+    return states
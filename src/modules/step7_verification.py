@@ -1,17 +1,21 @@
 # src/modules/step7_verification.py
 import logging
+import threading
 import numpy as np
 import torch
-from sentence_transformers import CrossEncoder
 from pathlib import Path
 
 from src.core.state import MedCOTState
 from src.core import config
 from src.models.verifier import MultiSignalVerifier
+from src.utils.model_registry import model_registry
+from src.utils.hetero_graph import subgraph_index
+from src.utils.cpu_inference import autocast, prepare_model, resolve_precision
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
 logger = logging.getLogger("step7_verification_provenance")
 _resources = {}
+_resources_lock = threading.Lock()
 VERIFIER_MODEL_PATH = Path("models/verifier_weights.pth")
 
 # --- NÂNG CẤP THEO CHỐT 7: THỨ TỰ ƯU TIÊN NGUỒN GỐC ---
@@ -24,46 +28,85 @@ PROVENANCE_SCORES = {
 }
 
 def load_resources():
-    global _resources
-    if _resources: return _resources
-    _resources['nli_model'] = CrossEncoder(config.NLI_MODEL_NAME)
-    # --- NÂNG CẤP: INPUT_DIM TĂNG TỪ 7 LÊN 8 ĐỂ THÊM PROVENANCE ---
-    _resources['verifier_model'] = MultiSignalVerifier(input_dim=8)
-    if VERIFIER_MODEL_PATH.exists():
-        _resources['verifier_model'].load_state_dict(torch.load(VERIFIER_MODEL_PATH))
-    _resources['verifier_model'].eval()
-    return _resources
+    if 'verifier_model' not in _resources:
+        with _resources_lock:
+            if 'verifier_model' not in _resources:
+                # --- NÂNG CẤP: INPUT_DIM TĂNG TỪ 7 LÊN 8 ĐỂ THÊM PROVENANCE ---
+                model = MultiSignalVerifier(input_dim=8)
+                if VERIFIER_MODEL_PATH.exists():
+                    model.load_state_dict(torch.load(VERIFIER_MODEL_PATH))
+                model.eval()
+                # int8 / bf16 trên CPU (INFERENCE_PRECISION); dựng xong mới công bố một lần (thread khác
+                # không bao giờ thấy model chưa quantize hay thiếu 'precision')
+                precision = resolve_precision()
+                _resources.update({'verifier_model': prepare_model(model, precision), 'precision': precision})
+    # NLI model lấy từ registry mỗi lần (không giữ tham chiếu) để evict() giải phóng được bộ nhớ
+    return {**_resources, 'nli_model': model_registry.cross_encoder(config.NLI_MODEL_NAME)}
 
 def _get_node_meta(node_id, state):
-    for node in state.graph_refs.get("ckg_subgraph", {}).get("nodes", []):
-        if node["id"] == node_id: return node
-    return None
+    return subgraph_index(state).node_map.get(node_id)
 
-def _extract_path_features(path, state, nli_model):
-    path_features = []
-    node_map = {n['id']: n for n in state.graph_refs.get("ckg_subgraph", {}).get("nodes", [])}
-    
+def _path_steps(path, node_map):
+    """Trả về danh sách (step_text, provenance_score) cho các bước hợp lệ của một path."""
+    steps = []
     for step in path:
         src_meta = node_map.get(step['source'])
         tgt_meta = node_map.get(step['target'])
         if not src_meta or not tgt_meta: continue
 
         step_text = f"{src_meta['name']} {step.get('edge_text', step['edge'])} {tgt_meta['name']}"
-        try:
-            scores = nli_model.predict([(state.normalized_query, step_text)])
-            probs = torch.softmax(torch.tensor(scores), dim=-1)
-            nli_score = float(probs[0][-1]) # Lấy điểm của "entailment"
-        except Exception: nli_score = 0.5
-
         # --- NÂNG CẤP: THÊM TÍN HIỆU PROVENANCE VÀO VECTOR ---
         provenance_score = PROVENANCE_SCORES.get(step.get("provenance", "DEFAULT"), 0.3)
-        
-        # [nli, gcot, in_kg, causality, len, src_deg, tgt_deg, provenance]
-        features = [ nli_score, 0.5, 1.0, 0.5, len(path), 1, 1, provenance_score ]
-        path_features.append(features)
-        
+        steps.append((step_text, provenance_score))
+    return steps
+
+def _entailment_scores(nli_model, pairs):
+    """Một lần predict NLI cho tất cả cặp (query, step_text); lỗi -> 0.5 như trước."""
+    if not pairs: return []
+    try:
+        scores = nli_model.predict(pairs)
+        probs = torch.softmax(torch.tensor(np.asarray(scores)), dim=-1)
+        return [float(p) for p in probs[:, -1]] # Lấy điểm của "entailment"
+    except Exception:
+        return [0.5] * len(pairs)
+
+def _features_from_steps(path, steps, nli_scores):
+    # [nli, gcot, in_kg, causality, len, src_deg, tgt_deg, provenance]
+    path_features = [[nli_score, 0.5, 1.0, 0.5, len(path), 1, 1, provenance_score]
+                     for (_, provenance_score), nli_score in zip(steps, nli_scores)]
     return np.mean(path_features, axis=0) if path_features else None
 
+def _extract_path_features(path, state, nli_model):
+    node_map = subgraph_index(state).node_map
+    steps = _path_steps(path, node_map)
+    nli_scores = _entailment_scores(nli_model, [(state.normalized_query, text) for text, _ in steps])
+    return _features_from_steps(path, steps, nli_scores)
+
+def _verify_vectors(verifier_model, path_vectors, precision: str = "fp32"):
+    with torch.no_grad(), autocast(precision):
+        logits = verifier_model(torch.tensor(np.array(path_vectors), dtype=torch.float32))
+        confidences = torch.sigmoid(logits.float()).squeeze().cpu().numpy()
+        if np.ndim(confidences) == 0: confidences = [float(confidences)]
+    return confidences
+
+def _finalize_verification(state: MedCOTState, valid_candidates, confidences) -> MedCOTState:
+    for i, cand in enumerate(valid_candidates):
+        cand['verification_confidence'] = float(confidences[i])
+
+    verified_results = sorted(valid_candidates, key=lambda x: x['verification_confidence'], reverse=True)
+    
+    if verified_results and verified_results[0]['verification_confidence'] > 0.5:
+        best = verified_results[0]
+        state.verified_path = best['path']
+        state.global_confidence = best['verification_confidence']
+        state.reasoning_mode = "Graph-Strict" if state.global_confidence > 0.8 else "Cautious"
+        state.gcot['verified_path_text'] = best.get('text_repr', '')
+    else:
+        state.reasoning_mode = "Abstain"
+        
+    state.log("7_VERIFICATION", "SUCCESS", {"mode": state.reasoning_mode, "conf": state.global_confidence})
+    return state
+
 def run(state: MedCOTState) -> MedCOTState:
     if not state.candidate_paths:
         state.reasoning_mode = "Abstain"
@@ -81,24 +124,42 @@ def run(state: MedCOTState) -> MedCOTState:
         state.reasoning_mode = "Abstain"
         return state
 
-    with torch.no_grad():
-        logits = resources['verifier_model'](torch.tensor(np.array(path_vectors), dtype=torch.float32))
-        confidences = torch.sigmoid(logits).squeeze().cpu().numpy()
-        if np.ndim(confidences) == 0: confidences = [float(confidences)]
+    confidences = _verify_vectors(resources['verifier_model'], path_vectors, resources['precision'])
+    return _finalize_verification(state, valid_candidates, confidences)
 
-    for i, cand in enumerate(valid_candidates):
-        cand['verification_confidence'] = float(confidences[i])
+def run_batch(states):
+    """
+    Phiên bản batch của Step 7: gom mọi bước của mọi candidate path (của tất cả state)
+    vào MỘT lần predict NLI và MỘT lần forward của verifier.
+    """
+    work = []  # (state, cand, steps)
+    for state in states:
+        if not state.candidate_paths:
+            state.reasoning_mode = "Abstain"
+            continue
+        node_map = subgraph_index(state).node_map
+        for cand in state.candidate_paths:
+            work.append((state, cand, _path_steps(cand['path'], node_map)))
+    if not work: return states
 
-    verified_results = sorted(valid_candidates, key=lambda x: x['verification_confidence'], reverse=True)
-    
-    if verified_results and verified_results[0]['verification_confidence'] > 0.5:
-        best = verified_results[0]
-        state.verified_path = best['path']
-        state.global_confidence = best['verification_confidence']
-        state.reasoning_mode = "Graph-Strict" if state.global_confidence > 0.8 else "Cautious"
-        state.gcot['verified_path_text'] = best.get('text_repr', '')
-    else:
-        state.reasoning_mode = "Abstain"
-        
-    state.log("7_VERIFICATION", "SUCCESS", {"mode": state.reasoning_mode, "conf": state.global_confidence})
-    return state
\ No newline at end of file
+    resources = load_resources()
+    pairs = [(state.normalized_query, text) for state, _, steps in work for text, _ in steps]
+    nli_scores = _entailment_scores(resources['nli_model'], pairs)
+
+    per_state, path_vectors, offset = {}, [], 0
+    for state, cand, steps in work:
+        feats = _features_from_steps(cand['path'], steps, nli_scores[offset:offset + len(steps)])
+        offset += len(steps)
+        entry = per_state.setdefault(id(state), (state, [], []))
+        if feats is not None:
+            entry[1].append(cand)
+            entry[2].append(len(path_vectors))
+            path_vectors.append(feats)
+
+    confidences = _verify_vectors(resources['verifier_model'], path_vectors, resources['precision']) if path_vectors else []
+    for state, valid_candidates, rows in per_state.values():
+        if not valid_candidates:
+            state.reasoning_mode = "Abstain"
+            continue
+        _finalize_verification(state, valid_candidates, [confidences[r] for r in rows])
+    return states
@@ -16,7 +16,37 @@ def clean_llm_output(text: str) -> str:
     text = re.sub(r'<[^>]+>', '', text, flags=re.DOTALL)
     return text.strip()
 
-def run(state: MedCOTState) -> MedCOTState:
+def collect_definitions(state: MedCOTState) -> list:
+    """
+    Lấy định nghĩa UMLS cho các thực thể đã link. Chỉ phụ thuộc `linked_entities` (Step 2),
+    nên pipeline có thể gọi trước, song song với Step 4 -> 9.
+    """
+    context_definitions = []
+    processed_names = set()
+    
+    # Đảm bảo umls_service đã kết nối
+    umls_service.connect()
+    
+    for le in state.linked_entities:
+        if le.link_status == "linked" and le.best_candidate.preferred_name not in processed_names:
+            name = le.best_candidate.preferred_name
+            processed_names.add(name)
+            
+            # Dùng tên đã link để tìm lại CUI chuẩn nhất
+            norm_results = umls_service.normalize(name, top_k=1)
+            if norm_results:
+                cui = norm_results[0].get('cui')
+                definition = umls_service.get_definition(cui)
+                if definition:
+                    context_definitions.append(f"- **{name}:** {definition}")
+    return context_definitions
+
+def _prepare_prompt(state: MedCOTState, definitions: list = None):
+    """
+    Tổng hợp bằng chứng (graph + UMLS) và dựng prompt.
+    `definitions`: kết quả `collect_definitions(state)` đã lấy trước (None = lấy ngay bây giờ).
+    Trả về (prompt, context_enriched) hoặc (None, False) nếu không có bằng chứng (state đã được gán câu trả lời mặc định).
+    """
     # --- 1. Tổng hợp bằng chứng từ GRAPH (Giữ nguyên) ---
     evidence_lines = []
     node_map = {n['id']: n.get('name', n['id']) for n in state.graph_refs.get("ckg_subgraph", {}).get("nodes", [])}
@@ -38,24 +68,7 @@ def run(state: MedCOTState) -> MedCOTState:
     # ==============================================================================
     # NÂNG CẤP: Lấy định nghĩa từ UMLS để làm giàu ngữ cảnh cho LLM
     # ==============================================================================
-    context_definitions = []
-    processed_names = set()
-    
-    # Đảm bảo umls_service đã kết nối
-    umls_service.connect()
-    
-    for le in state.linked_entities:
-        if le.link_status == "linked" and le.best_candidate.preferred_name not in processed_names:
-            name = le.best_candidate.preferred_name
-            processed_names.add(name)
-            
-            # Dùng tên đã link để tìm lại CUI chuẩn nhất
-            norm_results = umls_service.normalize(name, top_k=1)
-            if norm_results:
-                cui = norm_results[0].get('cui')
-                definition = umls_service.get_definition(cui)
-                if definition:
-                    context_definitions.append(f"- **{name}:** {definition}")
+    context_definitions = definitions if definitions is not None else collect_definitions(state)
     
     context_evidence = ""
     if context_definitions:
@@ -69,7 +82,7 @@ def run(state: MedCOTState) -> MedCOTState:
     if not final_evidence_text.strip():
         state.final_answer = "I could not find sufficient evidence in the Knowledge Graph to answer this question."
         state.log("8_SYNTHESIS", "SKIPPED", "No evidence found")
-        return state
+        return None, False
 
     # --- 2. Xây dựng PROMPT đã được làm giàu ---
     prompt = f"""
@@ -91,16 +104,53 @@ def run(state: MedCOTState) -> MedCOTState:
     **Final Answer:**
     """
 
+    return prompt, bool(context_definitions)
+
+def _apply_answer(state: MedCOTState, raw_answer: str, context_enriched: bool):
+    state.final_answer = clean_llm_output(raw_answer)
+    state.log("8_SYNTHESIS", "SUCCESS", {"model_used": "Local-LLM", "context_enriched": context_enriched})
+
+def _apply_failure(state: MedCOTState, error: Exception):
+    state.final_answer = f"**Raw Evidence found:**\n\n{state.gcot.get('compiled_cot', '')}"
+    state.log("8_SYNTHESIS", "FAILED", {"error": str(error)})
+
+def run(state: MedCOTState, definitions: dict = None) -> MedCOTState:
+    """`definitions`: {query_id: định nghĩa UMLS đã lấy trước} (tùy chọn)."""
+    prompt, context_enriched = _prepare_prompt(state, (definitions or {}).get(state.query_id))
+    if prompt is None:
+        return state
+
     # --- 3. THỰC THI (Sử dụng Local LLM) ---
-    raw_answer = ""
     try:
         logger.info("⚡ Using Local LLM for synthesis with enriched context...")
         raw_answer = local_llm.generate_cot(prompt)
-        state.final_answer = clean_llm_output(raw_answer)
-        state.log("8_SYNTHESIS", "SUCCESS", {"model_used": "Local-LLM", "context_enriched": bool(context_definitions)})
+        _apply_answer(state, raw_answer, context_enriched)
     except Exception as e:
          logger.error(f"❌ Local LLM failed: {e}", exc_info=True)
-         state.final_answer = f"**Raw Evidence found:**\n\n{final_evidence_text}"
-         state.log("8_SYNTHESIS", "FAILED", {"error": str(e)})
+         _apply_failure(state, e)
 
-    return state
\ No newline at end of file
+    return state
+
+def run_batch(states, definitions: dict = None):
+    """
+    Phiên bản batch của Step 8: dựng prompt cho mọi state rồi sinh câu trả lời bằng batch generate.
+    `definitions`: {query_id: định nghĩa UMLS đã lấy trước} (tùy chọn).
+    """
+    definitions = definitions or {}
+    prepared = []
+    for state in states:
+        prompt, context_enriched = _prepare_prompt(state, definitions.get(state.query_id))
+        if prompt is not None:
+            prepared.append((state, prompt, context_enriched))
+    if not prepared: return states
+
+    try:
+        logger.info(f"⚡ Using Local LLM for batch synthesis ({len(prepared)} prompts)...")
+        raw_answers = local_llm.generate_cot_batch([p for _, p, _ in prepared])
+        for (state, _, context_enriched), raw_answer in zip(prepared, raw_answers):
+            _apply_answer(state, raw_answer, context_enriched)
+    except Exception as e:
+        logger.error(f"❌ Local LLM batch failed: {e}", exc_info=True)
+        for state, _, _ in prepared:
+            _apply_failure(state, e)
+    return states
@@ -1,23 +1,42 @@
 # Tệp: src/utils/arax_client.py (PHIÊN BẢN RETRY + TỐI ƯU)
+import asyncio
+import atexit
 import requests
+import aiohttp
 import logging
-import json
-import time
-import hashlib
+import random
+import threading
 from pathlib import Path
 from itertools import combinations
+from src.utils.disk_cache import DiskCache
+from src.utils.profiler import current_profiler, profiled, profiling, span
 
 logger = logging.getLogger("ARAX_CLIENT")
 ARAX_BASE_URL = "https://arax.ncats.io/api/arax/v1.4"
 
-CACHE_DIR = Path(".cache/arax_queries")
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_PATH = Path(".cache/arax_cache.sqlite")
 CACHE_EXPIRATION_SECONDS = 86400 * 7
+CACHE_MAX_BYTES = 256 * 2**20     # Vượt ngưỡng -> xoá các cặp lâu không dùng nhất
+
+# --- CẤU HÌNH CLIENT ASYNC ---
+MAX_CONCURRENT_REQUESTS = 4       # Số cặp CURIE query cùng lúc (cũng là kích thước connection pool)
+REQUEST_TIMEOUT_SECONDS = 60      # Timeout cho MỘT request
+QUERY_DEADLINE_SECONDS = 45       # Hạn chót cho cả query_kg2 -> trả về kết quả từng phần
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 8.0
+KEEPALIVE_SECONDS = 60
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
 
 class ARAXClient:
     def __init__(self):
         self.headers = {"accept": "application/json", "Content-Type": "application/json"}
         self.curie_cache = {}
+        # Cache theo TỪNG CẶP CURIE: {A,B,C} dùng lại được kết quả {A,B} đã có
+        self.cache = DiskCache(CACHE_PATH, namespace="arax_kg2_pairs", ttl_seconds=CACHE_EXPIRATION_SECONDS, max_bytes=CACHE_MAX_BYTES)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._session = None
 
     def resolve_names_to_curies(self, names: list) -> list:
         # (Giữ nguyên logic resolve name vì đã hoạt động tốt)
@@ -57,94 +76,155 @@ class ARAXClient:
             self.curie_cache[name] = curie
             self.curie_cache[name.lower()] = curie
 
-    def _get_cache_key(self, identifiers):
-        key_str = "arax_v1.4_optimized_" + "_".join(sorted([str(i).lower() for i in identifiers]))
-        return hashlib.md5(key_str.encode()).hexdigest()
+    def _get_cache_key(self, id1, id2, max_results):
+        return f"arax_v1.4_optimized|{max_results}|" + "|".join(sorted([str(id1).lower(), str(id2).lower()]))
 
-    def query_kg2(self, identifiers: list, max_results=5):
-        if len(identifiers) < 2: return []
-            
-        cache_key = self._get_cache_key(identifiers)
-        cache_file = CACHE_DIR / f"{cache_key}.json"
+    def _build_payload(self, id1, id2, max_results):
+        # --- TỐI ƯU HÓA QUERY ---
+        # Chỉ tìm các cạnh có ý nghĩa tương tác thuốc để giảm tải server
+        return {
+            "message": {
+                "query_graph": {
+                    "nodes": {
+                        "n0": {"ids": [id1]},
+                        "n1": {"ids": [id2]}
+                    },
+                    "edges": {
+                        "e0": {
+                            "subject": "n0", 
+                            "object": "n1",
+                            # Chỉ tìm tương tác (interacts_with) hoặc liên quan (related_to)
+                            # Điều này giúp query chạy NHANH HƠN và ít bị lỗi 503
+                            "predicates": [
+                                "biolink:interacts_with",
+                                "biolink:affects",
+                                "biolink:related_to"
+                            ]
+                        }
+                    }
+                }
+            },
+            "max_results": max_results,
+            "submitter": "MedCOT_Agent"
+        }
 
-        if cache_file.exists() and time.time() - cache_file.stat().st_mtime < CACHE_EXPIRATION_SECONDS:
-            logger.info(f"⚡ [Cache Hit] Loading ARAX connecting path for {identifiers}")
+    @staticmethod
+    def _backoff_seconds(attempt: int) -> float:
+        # Exponential backoff + "full jitter" để các request lỗi không dội lại server cùng lúc
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+    async def _query_pair(self, session, semaphore, id1, id2, max_results):
+        """Trả về list cạnh (có thể rỗng) hoặc None nếu lỗi (kết quả lỗi không được cache)."""
+        payload = self._build_payload(id1, id2, max_results)
+        for attempt in range(MAX_RETRIES):
             try:
-                with open(cache_file, 'r', encoding='utf-8') as f: return json.load(f)
-            except Exception: pass
+                async with semaphore:
+                    with span("arax.post"):
+                        async with session.post(f"{ARAX_BASE_URL}/query", json=payload) as response:
+                            status = response.status
+                            data = await response.json(content_type=None) if status == 200 else None
+                            text = "" if status == 200 else (await response.text())[:200]
+
+                if status == 200:
+                    if data and "message" in data and "knowledge_graph" in data["message"]:
+                        kg = data["message"]["knowledge_graph"]
+                        if kg:
+                            parsed_edges = self._parse_trapi_to_medcot(kg.get("nodes", {}), kg.get("edges", {}))
+                            logger.info(f"  -> Found {len(parsed_edges)} interaction edges between '{id1}' and '{id2}'.")
+                            return parsed_edges
+                        logger.info(f"  -> ARAX returned 0 paths (Graph empty) for '{id1}' and '{id2}'.")
+                    return []
+                if status not in RETRYABLE_STATUSES:
+                    logger.warning(f"ARAX query failed {status}: {text}")
+                    return None
+                logger.warning(f"⚠️ ARAX Server busy ({status}) for '{id1}'/'{id2}'. Retry {attempt+1}/{MAX_RETRIES}...")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error(f"❌ Exception querying ARAX for '{id1}'/'{id2}': {e}")
+            if attempt < MAX_RETRIES - 1:
+                await asyncio.sleep(self._backoff_seconds(attempt))
+        logger.error(f"❌ Max retries exceeded for '{id1}'/'{id2}'.")
+        return None
+
+    async def query_kg2_async(self, identifiers: list, max_results=5, deadline_seconds: float = None) -> list:
+        """
+        Query ARAX cho mọi cặp CURIE song song (tối đa MAX_CONCURRENT_REQUESTS request cùng lúc).
+        Mỗi cặp được cache riêng; chỉ các cặp chưa có trong cache mới được gửi lên ARAX.
+        Hết `deadline_seconds` thì huỷ các cặp chưa xong và trả về kết quả từng phần.
+        """
+        if len(identifiers) < 2: return []
 
-        logger.info(f"🌍 Querying ARAX (v1.4) for interactions between: {identifiers}...")
-        
         id_pairs = list(combinations(identifiers, 2))
+        keys = [self._get_cache_key(id1, id2, max_results) for id1, id2 in id_pairs]
+        cached = self.cache.get_many(keys)
+        missing = [(pair, key) for pair, key in zip(id_pairs, keys) if key not in cached]
+        if not missing:
+            logger.info(f"⚡ [Cache Hit] Loading ARAX connecting path for {identifiers}")
+        else:
+            logger.info(f"🌍 Querying ARAX (v1.4) for {len(missing)}/{len(id_pairs)} uncached pairs between: {identifiers}...")
+            session = await self._get_session()
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            tasks = {key: asyncio.ensure_future(self._query_pair(session, semaphore, id1, id2, max_results)) for (id1, id2), key in missing}
+
+            deadline = QUERY_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+            done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                logger.warning(f"⏱️ ARAX deadline ({deadline}s) reached: {len(done)}/{len(tasks)} pairs finished, returning partial results.")
+
+            fresh = {}
+            for key, task in tasks.items():
+                if task not in done or task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    logger.error(f"❌ ARAX pair query crashed: {task.exception()}")
+                    continue
+                if task.result() is not None:
+                    fresh[key] = task.result()
+            self.cache.set_many(fresh)
+            cached.update(fresh)
+
+        # Giữ thứ tự kết quả theo thứ tự cặp (như bản tuần tự cũ)
         all_results = []
-        
-        for id1, id2 in id_pairs:
-            # --- TỐI ƯU HÓA QUERY ---
-            # Chỉ tìm các cạnh có ý nghĩa tương tác thuốc để giảm tải server
-            payload = {
-                "message": {
-                    "query_graph": {
-                        "nodes": {
-                            "n0": {"ids": [id1]},
-                            "n1": {"ids": [id2]}
-                        },
-                        "edges": {
-                            "e0": {
-                                "subject": "n0", 
-                                "object": "n1",
-                                # Chỉ tìm tương tác (interacts_with) hoặc liên quan (related_to)
-                                # Điều này giúp query chạy NHANH HƠN và ít bị lỗi 503
-                                "predicates": [
-                                    "biolink:interacts_with",
-                                    "biolink:affects",
-                                    "biolink:related_to"
-                                ]
-                            }
-                        }
-                    }
-                },
-                "max_results": max_results,
-                "submitter": "MedCOT_Agent"
-            }
-
-            # --- CƠ CHẾ RETRY (THỬ LẠI) ---
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = requests.post(f"{ARAX_BASE_URL}/query", headers=self.headers, json=payload, timeout=120)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        if "message" in data and "knowledge_graph" in data["message"]:
-                            kg = data["message"]["knowledge_graph"]
-                            if kg:
-                                parsed_edges = self._parse_trapi_to_medcot(kg.get("nodes", {}), kg.get("edges", {}))
-                                all_results.extend(parsed_edges)
-                                logger.info(f"  -> Found {len(parsed_edges)} interaction edges between '{id1}' and '{id2}'.")
-                            else:
-                                logger.info(f"  -> ARAX returned 0 paths (Graph empty) for '{id1}' and '{id2}'.")
-                        break # Thành công thì thoát vòng lặp retry
-                    
-                    elif response.status_code == 503:
-                        logger.warning(f"⚠️ ARAX Server busy (503). Retrying {attempt+1}/{max_retries} in 5s...")
-                        time.sleep(5) # Đợi 5 giây rồi thử lại
-                    else:
-                        logger.warning(f"ARAX query failed {response.status_code}: {response.text[:200]}")
-                        break # Lỗi khác 503 thì không thử lại
-
-                except Exception as e:
-                    logger.error(f"❌ Exception querying ARAX: {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(5)
-                    else:
-                        logger.error("❌ Max retries exceeded.")
-        
-        try:
-            with open(cache_file, 'w', encoding='utf-8') as f: json.dump(all_results, f, ensure_ascii=False)
-        except Exception: pass
-            
+        for key in keys:
+            all_results.extend(cached.get(key) or [])
         return all_results
 
+    async def _get_session(self):
+        # Một ClientSession (connection pool keep-alive) dùng chung cho mọi query, sống trên event loop nền
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS, keepalive_timeout=KEEPALIVE_SECONDS)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers, connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS),
+            )
+        return self._session
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="arax-event-loop", daemon=True).start()
+            return self._loop
+
+    @profiled("arax.query_kg2")
+    def query_kg2(self, identifiers: list, max_results=5, deadline_seconds: float = None):
+        """Bản đồng bộ: chạy `query_kg2_async` trên event loop nền (dùng được từ mọi thread)."""
+        if len(identifiers) < 2: return []
+        profiler = current_profiler()
+
+        async def _run():
+            # Truyền profiler của query hiện tại sang event loop để span "arax.post" vẫn được ghi
+            with profiling(profiler):
+                return await self.query_kg2_async(identifiers, max_results, deadline_seconds)
+
+        return asyncio.run_coroutine_threadsafe(_run(), self._ensure_loop()).result()
+
+    def close(self):
+        if self._loop is not None and self._session is not None and not self._session.closed:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=5)
+
     def _parse_trapi_to_medcot(self, nodes, edges):
         if not nodes or not edges: return []
         
@@ -172,4 +252,5 @@ class ARAXClient:
             })
         return medcot_edges
 
-arax_client = ARAXClient()
\ No newline at end of file
+arax_client = ARAXClient()
+atexit.register(arax_client.close)
@@ -0,0 +1,87 @@
+# src/utils/cpu_inference.py
+"""
+Chế độ suy luận trên CPU cho các model torch nhỏ của pipeline (GNN Step 5, verifier Step 7), không cần train lại:
+    "fp32" : như cũ
+    "int8" : `torch.ao.quantization.quantize_dynamic` cho các lớp Linear (trọng số int8, activation quantize động).
+             Linear của PyG được đổi sang `nn.Linear` trước; lớp bên trong HGTConv (HeteroDictLinear) giữ fp32.
+    "bf16" : `torch.autocast("cpu", dtype=torch.bfloat16)`, chỉ bật khi CPU có lệnh bf16 (AVX512-BF16 / AMX).
+Chọn bằng INFERENCE_PRECISION (env MEDCOT_INFERENCE_PRECISION); so sánh độ lệch với fp32 bằng
+`python -m benchmarks.gnn_precision`.
+
+Số thread intra-op của mỗi worker: TORCH_NUM_THREADS (env MEDCOT_TORCH_THREADS), áp dụng qua `configure_threads()`.
+"""
+import contextlib
+import copy
+import logging
+import torch
+from src.core import config
+
+logger = logging.getLogger("CPU_INFERENCE")
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def bf16_supported() -> bool:
+    """CPU có lệnh bf16 gốc (nếu không, autocast bf16 chạy giả lập và chậm hơn fp32)."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def resolve_precision(precision: str = None, device="cpu") -> str:
+    """Chế độ thực sự dùng được trên `device` (int8 động và bf16 autocast ở đây chỉ dành cho CPU)."""
+    precision = precision or config.INFERENCE_PRECISION
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown inference precision {precision!r}; expected one of {PRECISIONS}.")
+    if precision != "fp32" and torch.device(device).type != "cpu":
+        return "fp32"
+    if precision == "bf16" and not bf16_supported():
+        logger.warning("CPU has no native bf16 support; running fp32.")
+        return "fp32"
+    return precision
+
+
+def _to_torch_linear(module, skip=()):
+    """Đổi `torch_geometric.nn.Linear` (đã khởi tạo) thành `nn.Linear` để `quantize_dynamic` nhận ra."""
+    from torch.nn.parameter import UninitializedParameter
+    from torch_geometric.nn import Linear as PyGLinear
+    for name, child in module.named_children():
+        if isinstance(child, skip): continue
+        if isinstance(child, PyGLinear) and not isinstance(child.weight, UninitializedParameter):
+            linear = torch.nn.Linear(child.in_channels, child.out_channels, bias=child.bias is not None)
+            linear.weight.data.copy_(child.weight.data)
+            if child.bias is not None: linear.bias.data.copy_(child.bias.data)
+            setattr(module, name, linear)
+        else:
+            _to_torch_linear(child, skip)
+
+
+def quantize_int8(model, skip=()):
+    """Bản sao của model với các Linear quantize int8 động (model gốc giữ nguyên)."""
+    model = copy.deepcopy(model)
+    _to_torch_linear(model, skip)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def prepare_model(model, precision: str, skip=()):
+    """Model dùng cho `precision` (model phải ở eval mode và các lớp lazy đã được khởi tạo)."""
+    if precision == "int8":
+        return quantize_int8(model, skip)
+    return model
+
+
+def autocast(precision: str):
+    """Context chạy forward theo `precision` (bf16 -> autocast CPU)."""
+    if precision == "bf16":
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def configure_threads(num_threads: int = None) -> int:
+    """Đặt số thread intra-op cho process (worker) hiện tại; trả về số thread đang dùng."""
+    num_threads = config.TORCH_NUM_THREADS if num_threads is None else num_threads
+    if num_threads and num_threads > 0:
+        torch.set_num_threads(num_threads)
+        logger.info(f"🧵 torch intra-op threads: {num_threads}")
+    return torch.get_num_threads()
@@ -0,0 +1,290 @@
+# src/utils/disk_cache.py
+"""
+Cache key-value bền vững (SQLite) có TTL, kèm một tầng LRU trong RAM.
+
+- Giá trị phải serialize được bằng JSON. `None` là giá trị hợp lệ: dùng để lưu "kết quả âm"
+  (vd. tên không resolve được) và được phân biệt với "không có trong cache" qua `MISSING`.
+- Giá trị lớn được nén zlib. Khi tổng dung lượng một namespace vượt `max_bytes`, các entry
+  lâu không được đọc nhất bị xoá (LRU trên đĩa).
+- SQLite chạy ở chế độ WAL + busy_timeout nên nhiều worker process có thể dùng chung một file.
+  Mỗi thread dùng một connection riêng.
+
+Cách dùng:
+    cache = DiskCache(".cache/name_resolver.sqlite", namespace="sri", ttl_seconds=86400)
+    value = cache.get("aspirin")
+    if value is MISSING: ...
+    cache.set("aspirin", "CHEBI:15365")
+    cache.stats()   # hit/miss/eviction counters
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger("DISK_CACHE")
+
+MISSING = object()
+
+COMPRESS_MIN_BYTES = 512        # Giá trị nhỏ hơn ngưỡng này lưu thẳng (nén không có lợi)
+EVICTION_CHECK_EVERY = 64       # Kiểm tra dung lượng sau mỗi N lần ghi
+EVICTION_TARGET_RATIO = 0.9     # Khi vượt max_bytes, xoá tới còn 90%
+BUSY_TIMEOUT_MS = 30_000
+
+_RAW, _ZLIB = b"j", b"z"
+
+_instances = weakref.WeakSet()
+
+
+def _encode(value) -> bytes:
+    raw = json.dumps(value, ensure_ascii=False).encode("utf-8")
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        return _ZLIB + zlib.compress(raw, 6)
+    return _RAW + raw
+
+
+def _decode(blob: bytes):
+    blob = bytes(blob)
+    raw = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+    return json.loads(raw)
+
+
+class DiskCache:
+    def __init__(self, path, namespace: str = "default", ttl_seconds: float = 86400 * 7,
+                 negative_ttl_seconds: float = None, memory_items: int = 4096, max_bytes: int = None):
+        self.path = Path(path)
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = ttl_seconds if negative_ttl_seconds is None else negative_ttl_seconds
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._writes_since_check = EVICTION_CHECK_EVERY  # kiểm tra ngay lần ghi đầu tiên
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+        _instances.add(self)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        with self._conn() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+            if columns and "size" not in columns:
+                # Schema cũ (giá trị JSON dạng text, không có size/accessed_at): đây chỉ là cache -> tạo lại
+                logger.info(f"Upgrading cache schema at {self.path} (old entries dropped).")
+                conn.execute("DROP TABLE cache")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expiry ON cache (namespace, expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_access ON cache (namespace, accessed_at)")
+
+    def _count(self, name: str, n: int = 1):
+        if n:
+            with self._stats_lock:
+                self._stats[name] += n
+
+    # --- Tầng RAM (LRU) ---
+    def _memory_get(self, key):
+        with self._memory_lock:
+            item = self._memory.get(key)
+            if item is None:
+                return MISSING
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._memory[key]
+                return MISSING
+            self._memory.move_to_end(key)
+            return value
+
+    def _memory_put(self, key, value, expires_at):
+        if self.memory_items <= 0:
+            return
+        with self._memory_lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _expiry(self, value, ttl):
+        if ttl is None:
+            ttl = self.negative_ttl_seconds if value is None else self.ttl_seconds
+        return time.time() + ttl
+
+    # --- API ---
+    def get(self, key: str, default=MISSING):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys) -> dict:
+        """Trả về {key: value} cho các key có trong cache và chưa hết hạn."""
+        keys = list(dict.fromkeys(keys))
+        found, to_fetch = {}, []
+        for key in keys:
+            value = self._memory_get(key)
+            if value is MISSING:
+                to_fetch.append(key)
+            else:
+                found[key] = value
+        self._count("memory_hits", len(found))
+
+        now, disk_hits = time.time(), []
+        # SQLite giới hạn số tham số trong một câu lệnh -> chia nhỏ
+        for i in range(0, len(to_fetch), 500):
+            chunk = to_fetch[i:i + 500]
+            try:
+                rows = self._conn().execute(
+                    f"SELECT key, value, expires_at FROM cache WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                    [self.namespace, *chunk],
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"Cache read failed ({self.path}): {e}")
+                continue
+            for key, blob, expires_at in rows:
+                if expires_at < now:
+                    continue
+                try:
+                    value = _decode(blob)
+                except (ValueError, zlib.error) as e:
+                    logger.warning(f"Corrupted cache entry '{key}' in {self.path}: {e}")
+                    continue
+                found[key] = value
+                disk_hits.append(key)
+                self._memory_put(key, value, expires_at)
+
+        self._count("disk_hits", len(disk_hits))
+        self._count("misses", len(keys) - len(found))
+        if disk_hits:
+            # Cập nhật thời điểm truy cập cho LRU trên đĩa
+            try:
+                with self._conn() as conn:
+                    conn.executemany("UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                                     [(now, self.namespace, k) for k in disk_hits])
+            except sqlite3.Error as e:
+                logger.debug(f"Could not update access time in {self.path}: {e}")
+        return found
+
+    def set(self, key: str, value, ttl: float = None):
+        self.set_many({key: value}, ttl=ttl)
+
+    def set_many(self, items: dict, ttl: float = None):
+        rows, now = [], time.time()
+        for key, value in items.items():
+            expires_at = self._expiry(value, ttl)
+            self._memory_put(key, value, expires_at)
+            blob = _encode(value)
+            rows.append((self.namespace, key, blob, expires_at, now, len(blob) + len(key)))
+        if not rows:
+            return
+        try:
+            with self._conn() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at, size) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write failed ({self.path}): {e}")
+            return
+        self._count("writes", len(rows))
+        self._writes_since_check += len(rows)
+        if self.max_bytes and self._writes_since_check >= EVICTION_CHECK_EVERY:
+            self._writes_since_check = 0
+            self.evict()
+
+    def evict(self) -> int:
+        """Xoá entry hết hạn, sau đó xoá entry lâu không dùng nhất cho tới khi dung lượng <= 90% `max_bytes`."""
+        removed = self.purge_expired()
+        if self.max_bytes:
+            try:
+                with self._conn() as conn:
+                    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+                    if total > self.max_bytes:
+                        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+                        removed += conn.execute(
+                            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                            " SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS running"
+                            "  FROM cache WHERE namespace = ?) WHERE running > ?)",
+                            (self.namespace, self.namespace, target),
+                        ).rowcount
+            except sqlite3.Error as e:
+                logger.warning(f"Cache eviction failed ({self.path}): {e}")
+        if removed:
+            self._count("evictions", removed)
+            # Entry bị xoá trên đĩa có thể vẫn nằm trong RAM -> làm mới tầng RAM cho nhất quán
+            with self._memory_lock:
+                self._memory.clear()
+        return removed
+
+    def delete(self, key: str):
+        with self._memory_lock:
+            self._memory.pop(key, None)
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def purge_expired(self) -> int:
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (self.namespace, time.time())).rowcount
+
+    def clear(self):
+        """Xoá toàn bộ cache của namespace này (cả RAM lẫn đĩa)."""
+        with self._memory_lock:
+            self._memory.clear()
+        with self._conn() as conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def size_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None
+        stats["namespace"] = self.namespace
+        stats["path"] = str(self.path)
+        return stats
+
+    def __len__(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ? AND expires_at >= ?", (self.namespace, time.time())
+        ).fetchone()[0]
+
+
+def all_cache_stats() -> list:
+    """Số liệu của mọi DiskCache đang sống trong process."""
+    return [c.stats() for c in list(_instances)]
+
+
+def cache_prometheus_text() -> str:
+    """Counter hit/miss/eviction của mọi cache theo Prometheus text format."""
+    metrics = [
+        ("medcot_cache_hits_total", "Cache hits (memory + disk).", lambda s: s["memory_hits"] + s["disk_hits"]),
+        ("medcot_cache_misses_total", "Cache misses.", lambda s: s["misses"]),
+        ("medcot_cache_evictions_total", "Entries removed by TTL or size eviction.", lambda s: s["evictions"]),
+    ]
+    stats = all_cache_stats()
+    lines = []
+    for metric, help_text, getter in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for s in stats:
+            lines.append(f'{metric}{{cache="{s["namespace"]}"}} {getter(s)}')
+    return "\n".join(lines) + "\n"
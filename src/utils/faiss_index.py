@@ -0,0 +1,177 @@
+# src/utils/faiss_index.py
+"""
+Các loại FAISS index dùng cho node index (`scripts/2_build_faiss.py` + `FaissSearch`).
+
+- flat      : IndexFlatIP, brute-force, chính xác tuyệt đối (mặc định cũ).
+- ivf_flat  : IVF + vector gốc. Cần train; tham số search `nprobe`.
+- ivf_pq    : IVF + Product Quantization (nén vector còn `pq_m` byte). Cần train; tham số `nprobe`.
+- hnsw      : đồ thị HNSW. Không cần train; tham số search `ef_search`.
+
+Mọi loại đều dùng inner product trên vector đã normalize (= cosine).
+Tham số search không được `faiss.write_index` lưu lại đầy đủ, nên được ghi vào file
+`<index>.params.json` cạnh index và áp dụng lại khi load.
+
+Index được bọc trong `IndexIDMap2`: id của vector = số dòng trong node meta store, nên có thể
+thêm/xoá vector khi cập nhật tăng dần. File manifest `kg_index_manifest.json` trỏ tới cặp
+(index, metadata) hiện hành + watermark; đổi manifest (os.replace) là cách công bố một phiên bản
+mới một cách nguyên tử.
+"""
+import os
+import json
+import logging
+from pathlib import Path
+import faiss
+import numpy as np
+
+logger = logging.getLogger("FAISS_INDEX")
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+MANIFEST_NAME = "kg_index_manifest.json"
+DEFAULT_MANIFEST = {"version": 0, "index": "kg_faiss.index", "meta": "kg_nodes_meta", "watermark": 0}
+
+DEFAULT_PARAMS = {
+    "nlist": 1024,           # Số cụm IVF (~ sqrt(N) .. 4*sqrt(N))
+    "nprobe": 16,            # Số cụm được quét khi search
+    "pq_m": 48,              # Số sub-quantizer PQ (phải chia hết số chiều)
+    "pq_bits": 8,
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+}
+
+
+def params_path(index_path) -> Path:
+    index_path = Path(index_path)
+    return index_path.with_name(index_path.stem + ".params.json")
+
+
+def create_index(index_type: str, dim: int, **params):
+    """Tạo index rỗng. Với các loại IVF, phải `train` trước khi `add`."""
+    p = {**DEFAULT_PARAMS, **{k: v for k, v in params.items() if v is not None}}
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dim)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, p["nlist"], metric)
+    if index_type == "ivf_pq":
+        if dim % p["pq_m"] != 0:
+            raise ValueError(f"pq_m={p['pq_m']} must divide the embedding dimension {dim}.")
+        return faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, p["nlist"], p["pq_m"], p["pq_bits"], metric)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, p["hnsw_m"], metric)
+        index.hnsw.efConstruction = p["ef_construction"]
+        return index
+    raise ValueError(f"Unknown FAISS index type '{index_type}'. Choose one of {INDEX_TYPES}.")
+
+
+def base_index(index):
+    """Index bên trong lớp IndexIDMap/IndexIDMap2 (nếu có)."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def with_ids(index):
+    """
+    Bọc index trong IndexIDMap2 để add/remove theo id. Index cũ (chưa có id map, đã chứa vector)
+    được gán id = 0..ntotal-1, khớp với thứ tự dòng trong node meta store.
+    """
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+    wrapped = faiss.IndexIDMap2(index)
+    if index.ntotal:
+        faiss.copy_array_to_vector(np.arange(index.ntotal, dtype="int64"), wrapped.id_map)
+        wrapped.construct_rev_map()
+    return wrapped
+
+
+def index_type_of(index) -> str:
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSW) or hasattr(index, "hnsw"):
+        return "hnsw"
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return "flat"
+    return "ivf_pq" if isinstance(ivf, faiss.IndexIVFPQ) else "ivf_flat"
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Áp dụng tham số search (bỏ qua tham số không liên quan tới loại index)."""
+    kind = index_type_of(index)
+    if kind.startswith("ivf") and nprobe:
+        faiss.extract_index_ivf(index).nprobe = int(nprobe)
+    if kind == "hnsw" and ef_search:
+        base_index(index).hnsw.efSearch = int(ef_search)
+
+
+def save_params(index_path, index_type: str, **params):
+    with open(params_path(index_path), "w", encoding="utf-8") as f:
+        json.dump({"index_type": index_type, **params}, f, indent=2)
+
+
+def load_params(index_path) -> dict:
+    path = params_path(index_path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _mmap_flags(index_type: str):
+    """
+    Cờ đọc để map index vào bộ nhớ thay vì copy vào RAM của từng worker:
+    - IVF          : IO_FLAG_MMAP map các inverted list (centroid vẫn nằm trong RAM).
+    - flat / HNSW  : IO_FLAG_MMAP không có tác dụng; IO_FLAG_MMAP_IFC (FAISS >= 1.11) map mảng code
+                     phẳng (với HNSW: các vector, còn đồ thị lân cận vẫn nằm trong RAM).
+    Trả về None nếu phiên bản FAISS không map được loại index này.
+    """
+    if index_type.startswith("ivf"):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    return flag | faiss.IO_FLAG_READ_ONLY if flag is not None else None
+
+
+def read_index(index_path, mmap: bool = True):
+    """
+    Đọc index bất kể loại nào và áp dụng tham số search đã lưu. Trả về (index, params).
+    `mmap=True`: map phần lớn của index vào bộ nhớ (xem `_mmap_flags`) để nhiều worker dùng chung
+    qua page cache; nếu loại index/phiên bản FAISS không hỗ trợ thì đọc vào RAM.
+    """
+    params = load_params(index_path)
+    index = None
+    if mmap:
+        index_type = params.get("index_type", "flat")
+        flags = _mmap_flags(index_type)
+        if flags is None:
+            logger.info(f"This FAISS version cannot memory-map a {index_type} index; reading it into RAM.")
+        else:
+            try:
+                index = faiss.read_index(str(index_path), flags)
+                logger.info(f"🗺️ FAISS {index_type} index memory-mapped "
+                            f"({'inverted lists' if index_type.startswith('ivf') else 'flat codes'}).")
+            except (RuntimeError, AttributeError) as e:
+                logger.info(f"FAISS {index_type} index cannot be memory-mapped ({e}); reading it into RAM.")
+    if index is None:
+        index = faiss.read_index(str(index_path))
+    set_search_params(index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+    params.setdefault("index_type", index_type_of(index))
+    return index, params
+
+
+# --- Manifest: cặp (index, metadata) hiện hành ---
+def read_manifest(index_dir) -> dict:
+    path = Path(index_dir) / MANIFEST_NAME
+    if not path.exists():
+        return dict(DEFAULT_MANIFEST)   # Index build trước khi có manifest: tên file mặc định
+    with open(path, "r", encoding="utf-8") as f:
+        return {**DEFAULT_MANIFEST, **json.load(f)}
+
+
+def write_manifest(index_dir, manifest: dict):
+    """Ghi manifest nguyên tử: reader luôn thấy phiên bản cũ hoặc mới, không bao giờ thấy nửa vời."""
+    path = Path(index_dir) / MANIFEST_NAME
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
@@ -1,52 +1,189 @@
 # src/utils/faiss_search.py
 import logging
-import json
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
+from src.utils.faiss_index import MANIFEST_NAME, read_index, read_manifest
+from src.utils.model_registry import model_registry
+from src.utils.node_meta_store import NodeMetaStore, convert_json
 
 logger = logging.getLogger("FAISS_SEARCH")
 
+# Khi lọc theo label: lấy dư k * FILTER_OVERSAMPLE ứng viên rồi lọc (hoạt động với mọi loại index)
+FILTER_OVERSAMPLE = 20
+QUERY_CACHE_SIZE = 10_000   # Số embedding query giữ lại (LRU) cho search_batch(use_cache=True)
+RELOAD_CHECK_SECONDS = 30   # Chu kỳ kiểm tra manifest để nạp index mới sau khi 2_build_faiss.py cập nhật
+
 class FaissSearch:
     def __init__(self, index_dir: str = "data/kg_index", model_name: str = "BAAI/bge-small-en-v1.5"):
         self.index_dir = Path(index_dir)
-        self.index_path = self.index_dir / "kg_faiss.index"
-        self.meta_path = self.index_dir / "kg_nodes_meta.json"
+        self.legacy_meta_path = self.index_dir / "kg_nodes_meta.json"  # Định dạng cũ
         self.model_name = model_name
         
-        self.index = None
-        self.meta = None
-        self.encoder = None
+        # (manifest, index, index_params, meta) hiện hành; thay cả cụm một lần khi nạp phiên bản mới
+        self._current = (None, None, {}, None)
+        self._reload_lock = threading.Lock()
+        self._manifest_mtime = None
+        self._last_reload_check = time.time()
+        self._query_cache = OrderedDict()   # text -> vector đã normalize
+        self._cache_lock = threading.Lock()
         self._load_resources()
 
-    def _load_resources(self):
-        if not self.index_path.exists() or not self.meta_path.exists():
+    @property
+    def encoder(self):
+        return model_registry.sentence_transformer(self.model_name)
+
+    # Cặp (index, metadata) hiện hành theo manifest (mỗi lần cập nhật tăng dần là một phiên bản mới)
+    @property
+    def manifest(self) -> dict:
+        return self._current[0]
+
+    @property
+    def index(self):
+        return self._current[1]
+
+    @property
+    def index_params(self) -> dict:
+        return self._current[2]
+
+    @property
+    def meta(self):
+        return self._current[3]
+
+    def _manifest_stat(self):
+        try:
+            return (self.index_dir / MANIFEST_NAME).stat().st_mtime
+        except OSError:
+            return None
+
+    def _open(self, manifest: dict):
+        index_path = self.index_dir / manifest["index"]
+        meta_path = self.index_dir / manifest["meta"]       # Store dạng cột, memory-mapped
+        if not NodeMetaStore.exists(meta_path) and self.legacy_meta_path.exists():
+            # Chuyển đổi một lần từ JSON cũ; các lần khởi động sau chỉ mmap
+            logger.info(f"Converting legacy {self.legacy_meta_path.name} to columnar store...")
+            convert_json(self.legacy_meta_path, meta_path)
+        if not index_path.exists() or not NodeMetaStore.exists(meta_path):
             msg = f"FAISS index not found at {self.index_dir}. Please run 'scripts/2_build_faiss.py'."
             logger.error(msg)
             raise FileNotFoundError(msg)
-        
+        if manifest.get("id_space") != "node_id":
+            logger.warning("⚠️ FAISS index stores Neo4j elementIds, not node ids; dense-linked seeds may not resolve. Re-run 'scripts/2_build_faiss.py'.")
+        # Loại index (flat / IVF / IVF-PQ / HNSW) và tham số search đọc từ file, không cần cấu hình
+        index, index_params = read_index(index_path)
+        return manifest, index, index_params, NodeMetaStore(meta_path)
+
+    def _load_resources(self):
         logger.info("Loading FAISS resources...")
-        self.index = faiss.read_index(str(self.index_path))
-        with open(self.meta_path, "r", encoding="utf-8") as f:
-            self.meta = json.load(f)
-        self.encoder = SentenceTransformer(self.model_name)
-        logger.info(f"✅ FAISS resources loaded ({self.index.ntotal} vectors).")
+        self._manifest_mtime = self._manifest_stat()
+        self._current = self._open(read_manifest(self.index_dir))
+        model_registry.sentence_transformer(self.model_name)  # nạp sẵn encoder (dùng chung qua model registry)
+        logger.info(f"✅ FAISS resources loaded (v{self.manifest['version']}, {self.index.ntotal} vectors, {self.index_params['index_type']} index).")
 
-    def search(self, query_text: str, k: int = 5) -> list[dict]:
-        """Searches the index and returns top-k metadata."""
+    def _maybe_reload(self):
+        """
+        Nạp phiên bản mới nếu `2_build_faiss.py` vừa công bố (manifest đổi). Kiểm tra tối đa mỗi
+        RELOAD_CHECK_SECONDS; search đang chạy vẫn dùng cặp (index, meta) cũ cho tới khi xong.
+        """
+        now = time.time()
+        if now - self._last_reload_check < RELOAD_CHECK_SECONDS:
+            return
+        with self._reload_lock:
+            if now - self._last_reload_check < RELOAD_CHECK_SECONDS:
+                return
+            self._last_reload_check = now
+            mtime = self._manifest_stat()
+            if mtime is None or mtime == self._manifest_mtime:
+                return
+            manifest = read_manifest(self.index_dir)
+            self._manifest_mtime = mtime
+            if manifest["version"] == self.manifest["version"]:
+                self._current = (manifest, *self._current[1:])   # Chỉ đổi watermark
+                return
+            try:
+                self._current = self._open(manifest)
+            except Exception as e:
+                logger.error(f"❌ Could not load FAISS index v{manifest['version']} ({e}); keeping v{self.manifest['version']}.")
+                return
+        logger.info(f"🔄 FAISS index reloaded: v{manifest['version']} ({self.index.ntotal} vectors).")
+
+    def encode(self, texts: list[str], batch_size: int = 256) -> np.ndarray:
+        """Encode cả danh sách trong một lần gọi (vector đã normalize, float32)."""
+        vectors = self.encoder.encode(list(texts), batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype="float32")
+
+    def encode_cached(self, texts: list[str], batch_size: int = 256) -> np.ndarray:
+        """Như `encode` nhưng chỉ encode các text chưa có trong cache LRU (query lặp lại giữa các lần gọi)."""
+        vectors = [None] * len(texts)
+        with self._cache_lock:
+            for i, text in enumerate(texts):
+                if text in self._query_cache:
+                    self._query_cache.move_to_end(text)
+                    vectors[i] = self._query_cache[text]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            encoded = dict(zip(missing, self.encode(missing, batch_size=batch_size)))
+            with self._cache_lock:
+                for text, vector in encoded.items():
+                    self._query_cache[text] = vector
+                    self._query_cache.move_to_end(text)
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+            vectors = [encoded[t] if v is None else v for t, v in zip(texts, vectors)]
+        return np.stack(vectors).astype("float32", copy=False) if vectors else np.zeros((0, self.index.d), dtype="float32")
+
+    def search_batch(self, texts: list[str], k: int = 5, filters=None, batch_size: int = 256, use_cache: bool = False) -> list[list[dict]]:
+        """
+        Encode cả danh sách theo batch lớn rồi một lần `index.search` cho toàn bộ ma trận query.
+        `filters`: None, một label (áp dụng cho mọi query) hoặc danh sách mỗi query một phần tử
+        (label, list label, hoặc None). Trả về cho từng query danh sách hit
+        `{"node_id", "labels", "name", "score", "rank"}` theo score giảm dần.
+        """
         if self.index is None:
             raise RuntimeError("Index is not loaded.")
-        
-        query_vector = self.encoder.encode([query_text], normalize_embeddings=True)
-        distances, indices = self.index.search(np.asarray(query_vector, dtype="float32"), k)
-        
+        texts = list(texts)
+        if not texts: return []
+        if filters is None or isinstance(filters, str):
+            filters = [filters] * len(texts)
+        vectors = self.encode_cached(texts, batch_size) if use_cache else self.encode(texts, batch_size)
+        return self.search_vectors(vectors, k=k, labels=filters)
+
+    def search_vectors(self, vectors: np.ndarray, k: int = 5, labels: list = None) -> list[list[dict]]:
+        """
+        Một lần `index.search` cho cả ma trận query. `labels` (tuỳ chọn, mỗi query một label, list label
+        hoặc None) giữ lại các node có (một trong các) label đó. Trả về top-k metadata kèm `score` (cosine)
+        và `rank` cho từng query.
+        """
+        self._maybe_reload()
+        manifest, index, _, meta = self._current   # Một phiên bản nhất quán cho cả lần search
+        if index is None:
+            raise RuntimeError("Index is not loaded.")
+        labels = labels or [None] * len(vectors)
+        # Lấy dư khi lọc label hoặc khi index còn vector cũ chỉ bị tombstone (HNSW không remove_ids được);
+        # manifest cũ chưa ghi stale_vectors -> coi mọi tombstone là còn trong index
+        stale = manifest.get("stale_vectors", meta.num_deleted)
+        fetch = k * FILTER_OVERSAMPLE if any(labels) or stale else k
+        scores, indices = index.search(np.asarray(vectors, dtype="float32"), min(fetch, index.ntotal))
+
         results = []
-        for i in indices[0]:
-            if i != -1: # FAISS returns -1 for empty slots
-                results.append(self.meta[i])
+        for row_scores, row_indices, label in zip(scores, indices, labels):
+            wanted = {label} if isinstance(label, str) else set(label or [])
+            hits = []
+            for score, i in zip(row_scores, row_indices):
+                if i == -1 or meta.is_deleted(int(i)): continue  # FAISS returns -1 for empty slots
+                row = meta[int(i)]
+                if wanted and wanted.isdisjoint(row.get("labels", [])): continue
+                hits.append({**row, "score": float(score), "rank": len(hits)})
+                if len(hits) == k: break
+            results.append(hits)
         return results
 
+    def search(self, query_text: str, k: int = 5) -> list[dict]:
+        """Searches the index and returns top-k metadata (kèm score). Nhiều query: dùng `search_batch`."""
+        return self.search_batch([query_text], k=k)[0]
+
 # Singleton instance for easy import
 try:
     faiss_retriever = FaissSearch()
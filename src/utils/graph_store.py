@@ -0,0 +1,282 @@
+# src/utils/graph_store.py
+"""
+Graph store nhúng (in-process, chỉ đọc) cho PrimeKG: thay Neo4j trên đường đọc (linking, retrieval)
+mà không cần service ngoài. Neo4j chỉ còn dùng cho việc ghi (`scripts/ingest_custom_data.py`).
+
+Dựng từ `nodes.csv`/`edges.csv` của `scripts/0_preprocess_primekg.py`, lưu tại `data/graph_store/v<N>/` (công bố
+nguyên tử qua `current.json`, xem src/utils/mmap_store.py):
+    nodes/            : NodeMetaStore (node_id, labels, name) dạng cột, memory-mapped
+    node_label.i16    : mã label của từng node (label được intern trong manifest)
+    indptr.i64        : CSR vô hướng, lân cận của node i = nbr[indptr[i]:indptr[i+1]]
+    nbr.i64, edge_of.i64 : node lân cận + chỉ số cạnh tương ứng (mỗi cạnh xuất hiện ở cả 2 đầu)
+    edge_src.i64, edge_dst.i64, edge_rel.i16 : cạnh có hướng + mã loại quan hệ (intern trong manifest)
+    by_name.i64, by_id.i64 : thứ tự node theo tên (lower) / theo node_id -> tra cứu bằng tìm kiếm nhị phân
+    pagerank.f32      : (tuỳ chọn) PageRank tính sẵn, dùng cho ranker "pagerank" của Step 4
+Mọi mảng được mở bằng `np.memmap`, nên nhiều worker dùng chung một bản qua page cache.
+
+Cung cấp cùng interface đọc với `Neo4jConnection` (`link_bulk`, `expand_neighbors`, `expand_bounded`,
+`page_names`) bằng phép đọc CSR, không chạy Cypher. Node được nhận diện bằng node_id gốc (cột `id:ID`), giống
+`coalesce(n.id, elementId(n))` bên Neo4j. Chọn backend bằng biến môi trường `MEDCOT_GRAPH_BACKEND=embedded`
+(xem `graph_db` cuối file).
+"""
+import json
+import logging
+import numpy as np
+from src.core import config
+from src.utils.mmap_store import current_dir, open_memmap, publish_dir, staging_dir
+from src.utils.node_meta_store import NodeMetaStore, NodeMetaWriter
+
+logger = logging.getLogger("GRAPH_STORE")
+
+FORMAT_VERSION = 1
+ELEMENT_ID_PREFIX = "emb:"   # "elementId" của node trong store nhúng = vị trí dòng
+ARRAYS = {
+    "node_label.i16": np.int16, "indptr.i64": np.int64, "nbr.i64": np.int64, "edge_of.i64": np.int64,
+    "edge_src.i64": np.int64, "edge_dst.i64": np.int64, "edge_rel.i16": np.int16,
+    "by_name.i64": np.int64, "by_id.i64": np.int64,
+}
+
+
+def element_id(idx: int) -> str:
+    return f"{ELEMENT_ID_PREFIX}{int(idx)}"
+
+
+class EmbeddedGraphStore:
+    def __init__(self, path=config.GRAPH_STORE_DIR):
+        self.path = current_dir(path)
+        if self.path is None:
+            raise FileNotFoundError(f"No embedded graph store at {path}.")
+        with open(self.path / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported graph store version {manifest.get('version')} at {self.path}.")
+        self.relations = manifest["relations"]
+        self.labels = manifest["labels"]
+        self._relation_code = {r: i for i, r in enumerate(self.relations)}
+        self.nodes = NodeMetaStore(self.path / "nodes")
+        for file_name, dtype in ARRAYS.items():
+            setattr(self, "_" + file_name.split(".")[0], open_memmap(self.path / file_name, dtype))
+        pagerank = self.path / "pagerank.f32"
+        self._pagerank = open_memmap(pagerank, np.float32) if pagerank.exists() else None
+        self.query_count = 0
+        logger.info(f"✅ Embedded graph store loaded ({self.num_nodes} nodes, {self.num_edges} edges) from {self.path}.")
+
+    @staticmethod
+    def exists(path=config.GRAPH_STORE_DIR) -> bool:
+        return current_dir(path) is not None
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self._edge_src)
+
+    # --- Tra cứu ---
+    def _search(self, order, key: str, key_of) -> list:
+        """Tìm nhị phân trên thứ tự `order` (memmap); chỉ decode O(log N) chuỗi."""
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key_of(int(order[mid])) < key: lo = mid + 1
+            else: hi = mid
+        found = []
+        while lo < len(order) and key_of(int(order[lo])) == key:
+            found.append(int(order[lo]))
+            lo += 1
+        return sorted(found)
+
+    def _name_key(self, idx: int) -> str:
+        return self.nodes.name(idx).lower()
+
+    def lookup_name(self, name) -> list:
+        """Mọi node có tên trùng (không phân biệt hoa thường, như `toLower(n.name) = toLower(term)`)."""
+        return self._search(self._by_name, str(name).lower(), self._name_key)
+
+    def resolve(self, node_ref) -> int:
+        """Node từ element id ("emb:<i>") hoặc node_id gốc của PrimeKG; None nếu không có."""
+        node_ref = str(node_ref)
+        if node_ref.startswith(ELEMENT_ID_PREFIX):
+            idx = int(node_ref[len(ELEMENT_ID_PREFIX):])
+            return idx if 0 <= idx < self.num_nodes else None
+        found = self._search(self._by_id, node_ref, self.nodes.node_id)
+        return found[0] if found else None
+
+    def degree(self, idx: int) -> int:
+        return int(self._indptr[idx + 1] - self._indptr[idx])
+
+    def node(self, idx: int) -> dict:
+        return {"id": self.nodes.node_id(idx), "labels": [self.labels[self._node_label[idx]]], "name": self.nodes.name(idx),
+                "provenance": "PrimeKG", "element_id": element_id(idx)}
+
+    def edge(self, e: int) -> dict:
+        return {"id": f"{ELEMENT_ID_PREFIX}r{int(e)}", "source": self.nodes.node_id(int(self._edge_src[e])),
+                "target": self.nodes.node_id(int(self._edge_dst[e])), "type": self.relations[self._edge_rel[e]], "provenance": "PrimeKG"}
+
+    # --- Duyệt đồ thị ---
+    def neighbors(self, idx: int, rel_types=None, limit: int = None):
+        """(node lân cận, chỉ số cạnh) của một node, lọc theo loại quan hệ nếu có."""
+        lo, hi = self._indptr[idx], self._indptr[idx + 1]
+        nbr, edges = self._nbr[lo:hi], self._edge_of[lo:hi]
+        if rel_types:
+            codes = [self._relation_code[r] for r in rel_types if r in self._relation_code]
+            keep = np.isin(self._edge_rel[edges], codes)
+            nbr, edges = nbr[keep], edges[keep]
+        return (nbr[:limit], edges[:limit]) if limit else (nbr, edges)
+
+    def expand(self, seeds, hops: int = 1, rel_types=None, max_per_node: int = None):
+        """k-hop expansion. Trả về (mảng node, mảng cạnh), seed đứng đầu danh sách node."""
+        frontier = np.unique(np.asarray(list(seeds), dtype=np.int64))
+        nodes, edges = [frontier], []
+        visited = set(frontier.tolist())
+        for _ in range(hops):
+            if not len(frontier): break
+            parts = [self.neighbors(int(i), rel_types, max_per_node) for i in frontier]
+            hop_nodes = np.concatenate([p[0] for p in parts])
+            edges.extend(p[1] for p in parts)
+            frontier = np.array([n for n in np.unique(hop_nodes).tolist() if n not in visited], dtype=np.int64)
+            visited.update(frontier.tolist())
+            nodes.append(frontier)
+        edge_ids = np.unique(np.concatenate(edges)) if edges else np.zeros(0, np.int64)
+        return np.concatenate(nodes), edge_ids
+
+    # --- Interface đọc của pipeline, cùng chữ ký với Neo4jConnection (link_bulk, expand_*, page_names) ---
+    def run_query(self, query, parameters=None):
+        raise NotImplementedError(f"Embedded graph store does not run Cypher: {' '.join(query.split())[:160]} (use Neo4j).")
+
+    def stream_query(self, query, parameters=None, fetch_size: int = 2000):
+        yield from self.run_query(query, parameters)
+
+    def _seed_indices(self, seeds) -> list:
+        return sorted({i for i in (self.resolve(s) for s in seeds) if i is not None})
+
+    def link_bulk(self, queries) -> list:
+        # Như BULK_LINK_QUERY: term có rank nhỏ nhất khớp được + node_id các node trùng tên
+        self.query_count += 1
+        rows = []
+        for q in queries:
+            for rank, term in enumerate(q["terms"]):
+                matches = self.lookup_name(term)
+                if not matches: continue
+                node = self.node(matches[0])
+                best = {"rank": rank, "term": term, "node_id": node["id"], "node_label": node["labels"][0],
+                        "preferred_name": node["name"]}
+                rows.append({"mention": q["mention"], "best": best,
+                             "node_ids": [self.nodes.node_id(i) for i in matches if self.nodes.name(i) == node["name"]]})
+                break
+        return rows
+
+    def expand_neighbors(self, seeds) -> dict:
+        self.query_count += 1
+        seed_idx = self._seed_indices(seeds)
+        if not seed_idx: return {"nodes": [], "edges": []}
+        nodes, edges = self.expand(seed_idx, hops=1)
+        return {"nodes": [self.node(int(i)) for i in nodes], "edges": [self.edge(int(e)) for e in edges]}
+
+    def _ranked_node(self, idx: int) -> dict:
+        pagerank = float(self._pagerank[idx]) if self._pagerank is not None else None
+        return {**self.node(idx), "degree": self.degree(idx), "pagerank": pagerank}
+
+    def _scan_key(self, nbr, order):
+        if order == "degree":
+            return self._indptr[nbr + 1] - self._indptr[nbr]
+        if order == "pagerank" and self._pagerank is not None:
+            return self._pagerank[nbr]
+        return None
+
+    def expand_bounded(self, seeds, scan_limit: int, order: str = None) -> list:
+        # Như EXPAND_BOUNDED_QUERY: mỗi seed tối đa `scan_limit` cạnh (khoá `order` lớn nhất nếu có), kèm bậc của lân cận
+        self.query_count += 1
+        rows = []
+        for i in self._seed_indices(seeds):
+            nbr, edges = self.neighbors(i)
+            key = self._scan_key(nbr, order) if len(nbr) > scan_limit else None
+            if key is not None:
+                top = np.argsort(-np.asarray(key, dtype=np.float64), kind="stable")[:scan_limit]
+                nbr, edges = nbr[top], edges[top]
+            nbr, edges = nbr[:scan_limit], edges[:scan_limit]
+            candidates = [{"node": self._ranked_node(n), "rel": self.edge(e)} for n, e in zip(nbr.tolist(), edges.tolist())]
+            rows.append({"seed": self._ranked_node(i), "candidates": candidates})
+        return rows
+
+    def page_names(self, after=None, limit: int = 20_000) -> list:
+        # Cursor = vị trí dòng
+        self.query_count += 1
+        i, rows = (int(after) + 1 if after is not None else 0), []
+        while i < self.num_nodes and len(rows) < limit:
+            if self.nodes.name(i):
+                rows.append({"cursor": i, "node_id": self.nodes.node_id(i),
+                             "node_label": self.labels[self._node_label[i]], "name": self.nodes.name(i)})
+            i += 1
+        return rows
+
+    def close(self):
+        pass
+
+
+def build_from_csv(nodes_csv, edges_csv, out_dir=config.GRAPH_STORE_DIR) -> dict:
+    """Dựng store từ CSV định dạng neo4j-admin (`id:ID`, `:LABEL`, `name` / `:START_ID`, `:END_ID`, `:TYPE`)."""
+    import pandas as pd
+
+    tmp = staging_dir(out_dir)
+
+    nodes = pd.read_csv(nodes_csv, dtype=str, keep_default_na=False)
+    id_col = "id:ID" if "id:ID" in nodes.columns else ":ID"   # CSV cũ: cột `:ID` không có tên thuộc tính
+    nodes = nodes[[id_col, ":LABEL", "name"]].rename(columns={id_col: ":ID"})
+    nodes = nodes.drop_duplicates(subset=[":ID"]).reset_index(drop=True)
+    label_codes, labels = pd.factorize(nodes[":LABEL"])
+    with NodeMetaWriter(tmp / "nodes") as writer:
+        for node_id, label, name in zip(nodes[":ID"], nodes[":LABEL"], nodes["name"]):
+            writer.append(node_id, [label], name)
+
+    edges = pd.read_csv(edges_csv, usecols=[":START_ID", ":END_ID", ":TYPE"], dtype=str, keep_default_na=False)
+    id_to_idx = pd.Series(np.arange(len(nodes), dtype=np.int64), index=nodes[":ID"])
+    src = id_to_idx.reindex(edges[":START_ID"]).to_numpy()
+    dst = id_to_idx.reindex(edges[":END_ID"]).to_numpy()
+    keep = ~(np.isnan(src) | np.isnan(dst))
+    if (~keep).any():
+        logger.warning(f"Dropping {int((~keep).sum())} edges whose endpoints are not in {nodes_csv}.")
+    src, dst = src[keep].astype(np.int64), dst[keep].astype(np.int64)
+    rel_codes, relations = pd.factorize(edges[":TYPE"][keep])
+
+    # CSR vô hướng
+    endpoints = np.concatenate([src, dst])
+    nbr = np.concatenate([dst, src])
+    edge_of = np.concatenate([np.arange(len(src)), np.arange(len(src))])
+    order = np.argsort(endpoints, kind="stable")
+    indptr = np.searchsorted(endpoints[order], np.arange(len(nodes) + 1))
+
+    names_lower = nodes["name"].str.lower().to_numpy()
+    arrays = {
+        "node_label.i16": label_codes.astype(np.int16), "indptr.i64": indptr.astype(np.int64),
+        "nbr.i64": nbr[order], "edge_of.i64": edge_of[order].astype(np.int64),
+        "edge_src.i64": src, "edge_dst.i64": dst, "edge_rel.i16": rel_codes.astype(np.int16),
+        "by_name.i64": np.argsort(names_lower, kind="stable").astype(np.int64),
+        "by_id.i64": np.argsort(nodes[":ID"].to_numpy(), kind="stable").astype(np.int64),
+    }
+    for name, arr in arrays.items():
+        np.ascontiguousarray(arr).tofile(tmp / name)
+    manifest = {"version": FORMAT_VERSION, "num_nodes": len(nodes), "num_edges": int(len(src)),
+                "labels": [str(l) for l in labels], "relations": [str(r) for r in relations]}
+    with open(tmp / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    published = publish_dir(out_dir, tmp)
+    logger.info(f"✅ Embedded graph store built: {manifest['num_nodes']} nodes, {manifest['num_edges']} edges -> {published}")
+    return manifest
+
+
+# --- Backend đọc cho pipeline: store nhúng (MEDCOT_GRAPH_BACKEND=embedded) hoặc Neo4j ---
+def _open_read_backend():
+    if config.GRAPH_BACKEND == "embedded":
+        if EmbeddedGraphStore.exists(config.GRAPH_STORE_DIR):
+            try:
+                return EmbeddedGraphStore(config.GRAPH_STORE_DIR)
+            except Exception as e:
+                logger.error(f"❌ Could not open embedded graph store: {e}")
+        else:
+            logger.warning(f"Embedded graph store not found at {config.GRAPH_STORE_DIR} (run scripts/0_preprocess_primekg.py). Falling back to Neo4j.")
+    from src.utils.neo4j_connect import db_connector
+    return db_connector
+
+graph_db = _open_read_backend()
@@ -0,0 +1,117 @@
+# src/utils/hetero_graph.py
+"""
+Chuyển subgraph của Step 4 (list dict node/cạnh) sang `HeteroData` theo kiểu cột: id và label của node
+được factorize một lần bằng pandas, `edge_index` của từng quan hệ được dựng bằng phép toán mảng thay vì
+vòng lặp Python trên từng node/cạnh.
+
+`SubgraphIndex` là id map của một subgraph (node id -> dòng, node type, vị trí trong type).
+`subgraph_index(state)` dựng nó một lần cho `ckg_subgraph` hiện tại và dùng chung giữa Step 5, 6, 7
+(Step 5 lấy view của từng tower CKG/PSG bằng `subset`, không factorize lại).
+"""
+import numpy as np
+import pandas as pd
+import torch
+from torch_geometric.data import HeteroData
+
+
+def node_type_name(label) -> str:
+    """Tên node type hợp lệ cho PyG (không chứa '/' hay khoảng trắng)."""
+    return str(label).replace("/", "_").replace(" ", "_")
+
+
+def _factorize(values, normalize) -> tuple:
+    """`pd.factorize` theo thứ tự xuất hiện, gộp các giá trị trùng nhau sau khi `normalize`."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    merged, names = pd.factorize(pd.Index([normalize(u) for u in uniques], dtype=object))
+    return merged[codes], list(names)
+
+
+class SubgraphIndex:
+    def __init__(self, nodes):
+        type_of, node_types = _factorize([n.get("label") or "Unknown" for n in nodes], node_type_name)
+        self._set(nodes, pd.Index([n["id"] for n in nodes], dtype=object), type_of, node_types)
+
+    def _set(self, nodes, ids, type_of, node_types):
+        self.nodes = nodes
+        self.ids = ids
+        keep = ~self.ids.duplicated(keep="last")   # id trùng: dòng cuối được dùng (như dict)
+        self._unique_ids, self._rows = self.ids[keep], np.flatnonzero(keep)
+        self.type_of, self.node_types = type_of, node_types
+        # Vị trí của node trong type của nó (= chỉ số dòng trong data[type].x)
+        self.local = pd.Series(self.type_of).groupby(self.type_of).cumcount().to_numpy(dtype=np.int64)
+        self._node_map = None
+
+    def subset(self, mask) -> "SubgraphIndex":
+        """Id map của các node có `mask` True (giữ thứ tự), suy ra từ id/type đã factorize của index này."""
+        rows = np.flatnonzero(mask)
+        type_of, used = pd.factorize(self.type_of[rows])
+        view = SubgraphIndex.__new__(SubgraphIndex)
+        view._set([self.nodes[i] for i in rows], self.ids[rows], type_of.astype(self.type_of.dtype, copy=False),
+                  [self.node_types[t] for t in used])
+        return view
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def rows(self, node_ids) -> np.ndarray:
+        """Dòng của từng node id (-1 nếu không có trong subgraph)."""
+        if not len(self._rows): return np.full(len(node_ids), -1, dtype=np.int64)
+        pos = self._unique_ids.get_indexer(pd.Index(node_ids, dtype=object))
+        return np.where(pos >= 0, self._rows[pos], -1)
+
+    @property
+    def node_map(self) -> dict:
+        """node id -> dict node."""
+        if self._node_map is None:
+            self._node_map = dict(zip(self._unique_ids, (self.nodes[i] for i in self._rows)))
+        return self._node_map
+
+    def type_node_map(self) -> dict:
+        """{node type: {node id: vị trí trong type}} (định dạng của `graph_refs["node_map"]`)."""
+        return {t: dict(zip(self.ids[self.type_of == code], self.local[self.type_of == code].tolist()))
+                for code, t in enumerate(self.node_types)}
+
+    def edge_index_dict(self, edges) -> dict:
+        """{(src_type, RELATION, dst_type): LongTensor[2, E]}; bỏ cạnh có đầu mút không nằm trong subgraph."""
+        if not edges or not len(self._rows): return {}
+        src = self.rows([e["source"] for e in edges])
+        dst = self.rows([e["target"] for e in edges])
+        keep = (src >= 0) & (dst >= 0)
+        if not keep.any(): return {}
+        src, dst = src[keep], dst[keep]
+        rel_of, relations = _factorize([e.get("type") or "RELATED" for e, k in zip(edges, keep) if k], lambda r: str(r).upper())
+
+        # Mỗi bộ (src_type, relation, dst_type) một mã, giữ thứ tự xuất hiện
+        n_types, n_rels = len(self.node_types), len(relations)
+        groups, keys = pd.factorize((self.type_of[src] * n_rels + rel_of) * n_types + self.type_of[dst])
+        order = np.argsort(groups, kind="stable")
+        bounds = np.cumsum(np.bincount(groups, minlength=len(keys)))[:-1]
+        pairs = np.stack([self.local[src], self.local[dst]])[:, order]
+        edge_index = {}
+        for key, chunk in zip(keys.tolist(), np.split(pairs, bounds, axis=1)):
+            src_type, rest = divmod(key, n_rels * n_types)
+            rel, dst_type = divmod(rest, n_types)
+            edge_index[(self.node_types[src_type], relations[rel], self.node_types[dst_type])] = torch.from_numpy(np.ascontiguousarray(chunk))
+        return edge_index
+
+    def to_hetero_data(self, edges, features) -> HeteroData:
+        """`features`: [N, dim] theo thứ tự `nodes`; data[type].x gom đúng các dòng của type đó."""
+        data = HeteroData()
+        if not len(self.nodes): return data
+        features = torch.as_tensor(np.asarray(features), dtype=torch.float32)
+        order = np.argsort(self.type_of, kind="stable")
+        counts = np.bincount(self.type_of, minlength=len(self.node_types))
+        for node_type, rows in zip(self.node_types, np.split(order, np.cumsum(counts)[:-1])):
+            data[node_type].x = features[torch.from_numpy(rows)]
+        for triplet, edge_index in self.edge_index_dict(edges).items():
+            data[triplet].edge_index = edge_index
+        return data
+
+
+def subgraph_index(state) -> SubgraphIndex:
+    """Id map của `ckg_subgraph` hiện tại trong state (dựng một lần, dựng lại nếu subgraph đổi)."""
+    nodes = (state.graph_refs.get("ckg_subgraph") or {}).get("nodes", [])
+    cached = state._subgraph_index
+    if cached is None or cached.nodes is not nodes or len(cached) != len(nodes):
+        cached = state._subgraph_index = SubgraphIndex(nodes)
+    return cached
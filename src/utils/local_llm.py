@@ -2,11 +2,13 @@ import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 import logging
 import gc
+from src.core import config
+from src.utils.profiler import profiled
 
 logger = logging.getLogger("LOCAL_LLM")
 
 # Model 1.5B tối ưu cho 3050 Ti
-MODEL_ID = "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B"
+MODEL_ID = config.COT_LLM_MODEL
 
 class LocalCoTGenerator:
     _instance = None
@@ -54,14 +56,19 @@ class LocalCoTGenerator:
             logger.critical(f"❌ Lỗi load model: {e}")
             raise e
 
+    @staticmethod
+    def _build_messages(prompt: str) -> list:
+        return [
+            {"role": "system", "content": "You are a helpful AI assistant."},
+            {"role": "user", "content": prompt}
+        ]
+
+    @profiled("local_llm.generate_cot")
     def generate_cot(self, prompt: str) -> str:
         if self.model is None:
             self.load_model()
 
-        messages = [
-            {"role": "system", "content": "You are a helpful AI assistant."},
-            {"role": "user", "content": prompt}
-        ]
+        messages = self._build_messages(prompt)
         
         # Tokenize inputs
         input_ids = self.tokenizer.apply_chat_template(
@@ -88,6 +95,45 @@ class LocalCoTGenerator:
         response = self.tokenizer.decode(outputs[0][input_ids.shape[-1]:], skip_special_tokens=True)
         return response.strip()
 
+    @profiled("local_llm.generate_cot_batch")
+    def generate_cot_batch(self, prompts: list, batch_size: int = 8) -> list:
+        """
+        Sinh câu trả lời cho nhiều prompt, mỗi lần `batch_size` prompt trong một lệnh generate.
+        Dùng left-padding để các chuỗi kết thúc cùng vị trí trước khi sinh token mới.
+        """
+        if self.model is None:
+            self.load_model()
+
+        responses = []
+        original_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        try:
+            for i in range(0, len(prompts), batch_size):
+                chunk = prompts[i:i + batch_size]
+                texts = [
+                    self.tokenizer.apply_chat_template(self._build_messages(p), add_generation_prompt=True, tokenize=False)
+                    for p in chunk
+                ]
+                # Chat template đã chứa special tokens, không thêm lần nữa
+                inputs = self.tokenizer(texts, return_tensors="pt", padding=True, add_special_tokens=False).to(self.model.device)
+
+                with torch.no_grad():
+                    outputs = self.model.generate(
+                        **inputs,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        max_new_tokens=2048,
+                        temperature=0.6,
+                        do_sample=True,
+                        top_p=0.9
+                    )
+
+                prompt_len = inputs["input_ids"].shape[-1]
+                for out in outputs:
+                    responses.append(self.tokenizer.decode(out[prompt_len:], skip_special_tokens=True).strip())
+        finally:
+            self.tokenizer.padding_side = original_side
+        return responses
+
     def unload(self):
         """Giải phóng VRAM"""
         if self.model is not None:
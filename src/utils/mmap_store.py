@@ -0,0 +1,89 @@
+# src/utils/mmap_store.py
+"""
+Tiện ích chung cho các store chỉ đọc trên đĩa, mở bằng `np.memmap` (graph store nhúng, embedding node,
+metadata FAISS).
+
+Công bố nguyên tử theo phiên bản (giống manifest của FAISS index trong `scripts/2_build_faiss.py`):
+    <root>/v<N>/         : một phiên bản đầy đủ của store (ghi trong <root>/v<N>.tmp rồi rename)
+    <root>/current.json  : {"version": N, "dir": "v<N>"} -> phiên bản hiện hành, đổi bằng os.replace
+Reader đọc `current.json` rồi mở thư mục mà nó trỏ tới, nên không bao giờ thấy store ghi dở hay
+khoảng trống lúc đang build lại; phiên bản cũ chỉ bị xoá sau khi con trỏ đã đổi (process đang mmap
+file cũ vẫn đọc được trên Linux). Store kiểu cũ (manifest.json nằm thẳng trong <root>) vẫn mở được.
+
+Cách dùng:
+    staging = staging_dir(root)
+    ...ghi file vào staging...
+    publish_dir(root, staging)
+    store_dir = current_dir(root)   # None nếu chưa có phiên bản nào
+"""
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger("MMAP_STORE")
+
+POINTER_NAME = "current.json"
+
+
+def open_memmap(path, dtype, shape=None):
+    """`np.memmap` chỉ đọc; file rỗng (np.memmap không mở được) -> mảng rỗng trong RAM."""
+    path = Path(path)
+    if not path.stat().st_size:
+        return np.zeros(shape or 0, dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def _read_pointer(root: Path):
+    try:
+        with open(root / POINTER_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def current_dir(root):
+    """Thư mục phiên bản hiện hành của store tại `root` (None nếu chưa công bố phiên bản nào)."""
+    root = Path(root)
+    pointer = _read_pointer(root)
+    if pointer is not None:
+        return root / pointer["dir"]
+    if (root / "manifest.json").exists():   # Store kiểu cũ, chưa có phiên bản
+        return root
+    return None
+
+
+def staging_dir(root) -> Path:
+    """Thư mục tạm (rỗng) cho phiên bản kế tiếp; công bố bằng `publish_dir`."""
+    root = Path(root)
+    pointer = _read_pointer(root)
+    version = (pointer["version"] if pointer else 0) + 1
+    while (root / f"v{version}").exists():   # Phiên bản dở của lần build bị ngắt trước: không ghi đè
+        version += 1
+    staging = root / f"v{version}.tmp"
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+    return staging
+
+
+def publish_dir(root, staging) -> Path:
+    """Đổi tên `staging` thành phiên bản chính thức, trỏ `current.json` sang nó rồi dọn phiên bản cũ."""
+    root, staging = Path(root), Path(staging)
+    final = staging.with_name(staging.name[:-len(".tmp")])
+    os.replace(staging, final)
+    tmp = root / f"{POINTER_NAME}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": int(final.name[1:]), "dir": final.name}, f)
+    os.replace(tmp, root / POINTER_NAME)
+
+    # Dọn phiên bản cũ và file của layout cũ (không có phiên bản) còn nằm trong root
+    for path in root.iterdir():
+        if path == final or path.name == POINTER_NAME or ".tmp" in path.name: continue   # Bỏ qua build đang chạy
+        try:
+            shutil.rmtree(path) if path.is_dir() else path.unlink()
+        except OSError as e:
+            logger.warning(f"Could not remove old store file {path}: {e}")
+    return final
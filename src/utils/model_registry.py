@@ -0,0 +1,189 @@
+# src/utils/model_registry.py
+"""
+Registry dùng chung cho các model transformer (SentenceTransformer, CrossEncoder...).
+
+Mỗi model được khóa theo (kind, name, device) và chỉ được nạp MỘT lần cho cả process,
+dù Step 5, Step 6 và FaissSearch cùng xin "all-MiniLM-L6-v2".
+
+Cách dùng:
+    encoder = model_registry.sentence_transformer("all-MiniLM-L6-v2")
+    reranker = model_registry.cross_encoder(config.RERANKER_MODEL)
+    model_registry.footprint()      # bộ nhớ từng model
+    model_registry.evict("all-MiniLM-L6-v2")
+
+Các bước KHÔNG nên giữ tham chiếu lâu dài tới model (hãy gọi lại registry mỗi lần cần),
+để `evict()` thật sự giải phóng được bộ nhớ.
+"""
+import gc
+import logging
+import threading
+import time
+
+from src.utils.profiler import instrument
+
+logger = logging.getLogger("MODEL_REGISTRY")
+
+
+def _load_sentence_transformer(name: str, device: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name, device=device)
+
+
+def _load_cross_encoder(name: str, device: str):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(name, device=device)
+
+
+def _resolve_device(device: str = None) -> str:
+    if device:
+        return device
+    try:
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except ImportError:
+        return "cpu"
+
+
+def _torch_modules(obj) -> list:
+    """Tìm các nn.Module bên trong model (CrossEncoder bọc HF model trong `.model`)."""
+    try:
+        import torch
+    except ImportError:
+        return []
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    inner = getattr(obj, "model", None)
+    return [inner] if isinstance(inner, torch.nn.Module) else []
+
+
+def model_nbytes(obj) -> int:
+    """Tổng dung lượng parameters + buffers (bytes). Trả về None nếu không phải model torch."""
+    modules = _torch_modules(obj)
+    if not modules:
+        return None
+    from torch.nn.parameter import UninitializedParameter
+    total = 0
+    for m in modules:
+        for t in list(m.parameters()) + list(m.buffers()):
+            if isinstance(t, UninitializedParameter): continue   # Linear lazy chưa forward lần nào
+            total += t.numel() * t.element_size()
+    return total
+
+
+class _Entry:
+    __slots__ = ("model", "kind", "name", "device", "load_s", "nbytes", "hits", "lock")
+
+    def __init__(self, kind, name, device):
+        self.kind, self.name, self.device = kind, name, device
+        self.model = None
+        self.load_s = 0.0
+        self.nbytes = None
+        self.hits = 0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # kind -> (loader(name, device), method được profile)
+        self._loaders = {
+            "sentence_transformer": (_load_sentence_transformer, "encode"),
+            "cross_encoder": (_load_cross_encoder, "predict"),
+        }
+
+    def register_loader(self, kind: str, loader, profiled_method: str = None):
+        """Thêm một loại model mới: `loader(name, device)` trả về instance."""
+        with self._lock:
+            self._loaders[kind] = (loader, profiled_method)
+
+    def _entry(self, kind, name, device) -> _Entry:
+        key = (kind, name, device)
+        with self._lock:
+            if kind not in self._loaders:
+                raise KeyError(f"No loader registered for model kind '{kind}'.")
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(kind, name, device)
+            return entry
+
+    def _prepare(self, entry: _Entry, model):
+        method = self._loaders[entry.kind][1]
+        if method:
+            instrument(model, method, f"model[{entry.name}].{method}")
+        entry.model = model
+        entry.nbytes = model_nbytes(model)
+
+    def get(self, kind: str, name: str, device: str = None):
+        """Trả về instance dùng chung; nạp lần đầu (thread-safe, mỗi key chỉ nạp một lần)."""
+        device = _resolve_device(device)
+        entry = self._entry(kind, name, device)
+        model = entry.model
+        if model is None:
+            with entry.lock:
+                if entry.model is None:
+                    logger.info(f"📦 Loading {kind} '{name}' on {device}...")
+                    t0 = time.perf_counter()
+                    self._prepare(entry, self._loaders[kind][0](name, device))
+                    entry.load_s = time.perf_counter() - t0
+                    size = f"{entry.nbytes / 2**20:.1f} MB" if entry.nbytes is not None else "n/a"
+                    logger.info(f"✅ Loaded '{name}' in {entry.load_s:.2f}s ({size}).")
+                model = entry.model
+        with self._lock:
+            entry.hits += 1
+        return model
+
+    def sentence_transformer(self, name: str, device: str = None):
+        return self.get("sentence_transformer", name, device)
+
+    def cross_encoder(self, name: str, device: str = None):
+        return self.get("cross_encoder", name, device)
+
+    def register(self, kind: str, name: str, model, device: str = None):
+        """Đặt sẵn một instance (model đã nạp ở nơi khác, hoặc model giả lập khi test/benchmark)."""
+        entry = self._entry(kind, name, _resolve_device(device))
+        with entry.lock:
+            self._prepare(entry, model)
+            entry.load_s = 0.0
+        return model
+
+    def is_loaded(self, kind: str, name: str, device: str = None) -> bool:
+        entry = self._entries.get((kind, name, _resolve_device(device)))
+        return entry is not None and entry.model is not None
+
+    def evict(self, name: str = None, kind: str = None, device: str = None) -> int:
+        """Giải phóng các model khớp điều kiện (None = mọi giá trị). Trả về số model đã gỡ."""
+        with self._lock:
+            keys = [k for k, e in self._entries.items()
+                    if e.model is not None and (name is None or k[1] == name)
+                    and (kind is None or k[0] == kind) and (device is None or k[2] == device)]
+            entries = [self._entries.pop(k) for k in keys]
+        freed_cuda = False
+        for e in entries:
+            with e.lock:
+                e.model = None
+            freed_cuda = freed_cuda or e.device.startswith("cuda")
+            logger.info(f"🗑️ Evicted {e.kind} '{e.name}' ({e.device}).")
+        if entries:
+            gc.collect()
+            if freed_cuda:
+                import torch
+                torch.cuda.empty_cache()
+        return len(entries)
+
+    def footprint(self) -> list:
+        """Danh sách model đang nạp cùng dung lượng, thời gian nạp và số lần được dùng."""
+        with self._lock:
+            entries = [e for e in self._entries.values() if e.model is not None]
+        return [{
+            "kind": e.kind, "name": e.name, "device": e.device,
+            "size_mb": round(e.nbytes / 2**20, 2) if e.nbytes is not None else None,
+            "load_s": round(e.load_s, 3), "hits": e.hits,
+        } for e in entries]
+
+    def total_bytes(self) -> int:
+        return sum(e.nbytes or 0 for e in list(self._entries.values()) if e.model is not None)
+
+
+# Singleton dùng chung cho toàn bộ process
+model_registry = ModelRegistry()
@@ -0,0 +1,194 @@
+# src/utils/name_index.py
+"""
+Chỉ mục tên -> node cho Entity Linking (Step 2), thay cho `MATCH (n) WHERE toLower(n.name) = ...`
+(câu query không dùng được index nên quét toàn bộ PrimeKG cho mỗi mention/synonym).
+
+- Key: tên đã chuẩn hoá (Unicode NFKC + casefold + gộp khoảng trắng).
+- Value: danh sách node trùng tên, mỗi node gồm node_id, node_label, preferred_name. node_id = coalesce(n.id, elementId(n))
+  như mọi backend đọc trả về, nên seed dùng được với cả Neo4j lẫn graph store nhúng.
+- Dựng một lần từ backend đọc (`db.page_names`), lưu snapshot nén tại `data/kg_index/name_index.json.gz` và nạp lại khi khởi động.
+- `scripts/ingest_custom_data.py` thêm node mới vào index + ghi lại snapshot; các process khác
+  (server) tự nạp lại snapshot khi file thay đổi.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+logger = logging.getLogger("NAME_INDEX")
+
+NAME_INDEX_PATH = Path("data/kg_index/name_index.json.gz")
+BUILD_PAGE_SIZE = 20_000
+RELOAD_CHECK_SECONDS = 30
+SNAPSHOT_VERSION = 2   # v2: seed theo node_id thay vì elementId
+
+_WS = re.compile(r"\s+")
+
+def normalize_name(text) -> str:
+    """Chuẩn hoá tên để so khớp: NFKC + casefold + gộp khoảng trắng."""
+    if text is None:
+        return ""
+    return _WS.sub(" ", unicodedata.normalize("NFKC", str(text)).casefold()).strip()
+
+
+class NameIndex:
+    def __init__(self, snapshot_path: Path = NAME_INDEX_PATH):
+        self.snapshot_path = Path(snapshot_path)
+        self._entries = None           # normalized name -> [entry, ...]
+        self._lock = threading.Lock()
+        self._snapshot_mtime = None
+        self._last_reload_check = 0.0
+        self.built_at = None
+
+    # --- Dựng / lưu / nạp ---
+    @staticmethod
+    def _entry(row) -> dict:
+        return {
+            "node_id": str(row["node_id"]) if row["node_id"] is not None else None,
+            "node_label": row["node_label"],
+            "preferred_name": row["name"],
+        }
+
+    def _add_rows(self, entries: dict, rows) -> int:
+        added = 0
+        for row in rows:
+            key = normalize_name(row["name"])
+            if not key: continue
+            bucket = entries.setdefault(key, [])
+            entry = self._entry(row)
+            if any(e["node_id"] == entry["node_id"] for e in bucket):
+                continue
+            bucket.append(entry)
+            added += 1
+        return added
+
+    def build(self, db) -> int:
+        """Dựng lại toàn bộ index từ backend đọc (phân trang keyset bằng `db.page_names`) và ghi snapshot."""
+        logger.info("🏗️ Building name index from the graph backend...")
+        t0 = time.time()
+        entries, after, total = {}, None, 0
+        while True:
+            rows = db.page_names(after, BUILD_PAGE_SIZE)
+            if not rows: break
+            total += self._add_rows(entries, rows)
+            after = rows[-1]["cursor"]
+            if len(rows) < BUILD_PAGE_SIZE: break
+        with self._lock:
+            self._entries = entries
+            self.built_at = time.time()
+        self.save()
+        logger.info(f"✅ Name index built: {total} nodes / {len(entries)} names in {time.time() - t0:.2f}s.")
+        return total
+
+    def save(self):
+        with self._lock:
+            if self._entries is None: return
+            payload = {"version": SNAPSHOT_VERSION, "built_at": self.built_at, "entries": self._entries}
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            # Ghi ra file tạm rồi rename để process khác không bao giờ đọc phải file ghi dở
+            tmp = self.snapshot_path.with_name(self.snapshot_path.name + f".tmp{os.getpid()}")
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp, self.snapshot_path)
+            self._snapshot_mtime = self.snapshot_path.stat().st_mtime
+
+    def load(self) -> bool:
+        if not self.snapshot_path.exists():
+            return False
+        try:
+            mtime = self.snapshot_path.stat().st_mtime
+            with gzip.open(self.snapshot_path, "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") != SNAPSHOT_VERSION:
+                logger.warning(f"Name index snapshot has version {payload.get('version')}, expected {SNAPSHOT_VERSION}. Ignoring it.")
+                return False
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Could not load name index snapshot {self.snapshot_path}: {e}")
+            return False
+        with self._lock:
+            self._entries = payload["entries"]
+            self.built_at = payload.get("built_at")
+            self._snapshot_mtime = mtime
+        logger.info(f"✅ Name index loaded ({len(self._entries)} names) from {self.snapshot_path}.")
+        return True
+
+    def ensure_loaded(self, db=None) -> bool:
+        """Nạp snapshot; nếu chưa có thì dựng từ `db` (mặc định Neo4j). Trả về False nếu index không dùng được."""
+        if self._entries is not None:
+            self._maybe_reload()
+            return True
+        if self.load():
+            return True
+        if db is None:
+            from src.utils.neo4j_connect import db_connector as db
+        if db is None:
+            return False
+        try:
+            self.build(db)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Could not build name index: {e}")
+            return False
+
+    def _maybe_reload(self):
+        """Nạp lại snapshot nếu process khác (vd. ingest) vừa ghi đè nó. Kiểm tra tối đa mỗi RELOAD_CHECK_SECONDS."""
+        now = time.time()
+        if now - self._last_reload_check < RELOAD_CHECK_SECONDS:
+            return
+        self._last_reload_check = now
+        try:
+            mtime = self.snapshot_path.stat().st_mtime
+        except OSError:
+            return
+        if self._snapshot_mtime is not None and mtime > self._snapshot_mtime:
+            self.load()
+
+    # --- Cập nhật tăng dần ---
+    def add_nodes(self, rows) -> int:
+        """Thêm node mới (dict có node_id, node_label, name). Gọi `save()` để lưu lại."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = {}
+            return self._add_rows(self._entries, rows)
+
+    # --- Tra cứu ---
+    def lookup(self, text: str):
+        """Node tốt nhất cho một tên (None nếu không có)."""
+        bucket = self._entries.get(normalize_name(text)) if self._entries else None
+        return bucket[0] if bucket else None
+
+    def lookup_all(self, text: str) -> list:
+        """Mọi node có tên chuẩn hoá trùng với `text`."""
+        return list(self._entries.get(normalize_name(text), [])) if self._entries else []
+
+    def lookup_many(self, texts) -> dict:
+        """Tra cứu cả danh sách trong một lần: {text: entry} cho các text tìm thấy."""
+        if not self._entries: return {}
+        found = {}
+        for text in texts:
+            bucket = self._entries.get(normalize_name(text))
+            if bucket:
+                found[text] = bucket[0]
+        return found
+
+    def node_ids(self, preferred_names) -> list:
+        """Mọi node_id của các node có đúng tên `preferred_names` (thay cho `WHERE n.name IN $names`)."""
+        if not self._entries: return []
+        ids = []
+        for name in preferred_names:
+            for e in self._entries.get(normalize_name(name), []):
+                if e["preferred_name"] == name:
+                    ids.append(e["node_id"])
+        return list(dict.fromkeys(ids))
+
+    def __len__(self) -> int:
+        return len(self._entries or {})
+
+
+# Singleton
+name_index = NameIndex()
@@ -1,60 +1,118 @@
-# Tệp: src/utils/name_resolver.py (PHIÊN BẢN XỬ LÝ LIST AN TOÀN)
+# Tệp: src/utils/name_resolver.py (PHIÊN BẢN BULK LOOKUP + CACHE BỀN VỮNG)
 import requests
 import logging
+from pathlib import Path
 from typing import List
+from src.core.executor import run_parallel
+from src.utils.disk_cache import DiskCache
+from src.utils.profiler import profiled
 
 logger = logging.getLogger("NAME_RESOLVER")
 SRI_LOOKUP_URL = "https://name-resolution-sri.renci.org/lookup"
+SRI_BULK_LOOKUP_URL = "https://name-resolution-sri.renci.org/bulk-lookup"
+
+BULK_BATCH_SIZE = 50          # Số tên trong MỘT request bulk-lookup
+MAX_CONCURRENT_LOOKUPS = 8    # Khi phải quay về /lookup từng tên
+CACHE_PATH = Path(".cache/name_resolver.sqlite")
+CACHE_TTL_SECONDS = 86400 * 30          # Kết quả tìm thấy: giữ 30 ngày
+NEGATIVE_CACHE_TTL_SECONDS = 86400      # "Không tìm thấy": giữ 1 ngày
+MEMORY_CACHE_ITEMS = 10_000
+
+class BulkLookupUnavailable(Exception):
+    """Endpoint bulk-lookup không tồn tại trên server SRI (HTTP 404/405)."""
+
+def _best_curie(data):
+    """Lấy CURIE tốt nhất từ response của SRI (hỗ trợ cả dạng list lẫn dict)."""
+    # LOGIC XỬ LÝ LIST/DICT LINH HOẠT
+    if isinstance(data, dict) and data:
+        # {"CURIE": "Label"}
+        return list(data.keys())[0]
+    if isinstance(data, list) and len(data) > 0:
+        first = data[0]
+        if isinstance(first, dict):
+            # [{"curie": "...", ...}] HOẶC [{"CURIE": "Label"}]
+            return first.get('curie') or first.get('id') or next(iter(first), None)
+        if isinstance(first, str):
+            return first
+    return None
 
 class NameResolver:
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, cache_path: Path = CACHE_PATH):
+        # Cache bền vững (SQLite) + LRU trong RAM; lưu cả kết quả âm (None)
+        self.cache = DiskCache(
+            cache_path, namespace="sri_lookup", ttl_seconds=CACHE_TTL_SECONDS,
+            negative_ttl_seconds=NEGATIVE_CACHE_TTL_SECONDS, memory_items=MEMORY_CACHE_ITEMS,
+        )
+        self._bulk_supported = True
+
+    def _lookup_bulk(self, names: List[str]) -> dict:
+        """Một request cho cả batch. Trả về {name: curie|None}; raise nếu endpoint không dùng được."""
+        response = requests.post(SRI_BULK_LOOKUP_URL, json={"strings": names, "limit": 1}, timeout=30)
+        if response.status_code in (404, 405):
+            raise BulkLookupUnavailable(f"bulk-lookup not available (HTTP {response.status_code})")
+        response.raise_for_status()
+        data = response.json()
+        return {name: _best_curie(data.get(name)) for name in names}
+
+    def _lookup_one(self, name: str):
+        """Trả về (curie|None, ok). ok=False nghĩa là lỗi tạm thời -> không ghi cache."""
+        try:
+            params = {"string": name, "limit": 1}
+            response = requests.post(SRI_LOOKUP_URL, params=params, timeout=10)
+            if response.status_code == 200:
+                return _best_curie(response.json()), True
+            logger.warning(f"SRI lookup for '{name}' failed with HTTP {response.status_code}")
+        except Exception as e:
+            logger.error(f"Name Resolver failed for '{name}': {e}")
+        return None, False
 
+    def _lookup_many_single(self, names: List[str]) -> dict:
+        results = run_parallel({name: (lambda name=name: self._lookup_one(name)) for name in names},
+                               name="sri_lookup", max_workers=MAX_CONCURRENT_LOOKUPS)
+        return {name: curie for name, (curie, ok) in results.items() if ok}
+
+    def _lookup(self, names: List[str]) -> dict:
+        resolved = {}
+        for i in range(0, len(names), BULK_BATCH_SIZE):
+            batch = names[i:i + BULK_BATCH_SIZE]
+            if self._bulk_supported:
+                try:
+                    resolved.update(self._lookup_bulk(batch))
+                    continue
+                except BulkLookupUnavailable as e:
+                    logger.warning(f"SRI {e}; falling back to concurrent single lookups.")
+                    self._bulk_supported = False
+                except Exception as e:
+                    logger.warning(f"SRI bulk-lookup failed ({e}); retrying this batch with single lookups.")
+            resolved.update(self._lookup_many_single(batch))
+        return resolved
+
+    @profiled("sri.resolve_names_to_curies")
     def resolve_names_to_curies(self, names: List[str]) -> List[str]:
-        unique_names = list(set([n.strip() for n in names if n.strip()]))
-        resolved_curies = []
-
-        for name in unique_names:
-            if name.lower() in self.cache:
-                val = self.cache[name.lower()]
-                if val: resolved_curies.append(val)
-                continue
-
-            try:
-                params = {"string": name, "limit": 1}
-                response = requests.post(SRI_LOOKUP_URL, params=params, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    best_curie = None
-
-                    # LOGIC XỬ LÝ LIST/DICT LINH HOẠT
-                    if isinstance(data, dict) and data:
-                        # {"CURIE": "Label"}
-                        best_curie = list(data.keys())[0]
-                    elif isinstance(data, list) and len(data) > 0:
-                        first = data[0]
-                        if isinstance(first, dict):
-                            # [{"curie": "...", ...}] HOẶC [{"CURIE": "Label"}]
-                            best_curie = first.get('curie') or first.get('id')
-                            if not best_curie:
-                                best_curie = list(first.keys())[0]
-                        elif isinstance(first, str):
-                            best_curie = first
-
-                    if best_curie:
-                        self.cache[name.lower()] = best_curie
-                        resolved_curies.append(best_curie)
-                        logger.info(f"✅ SRI Resolved '{name}' -> {best_curie}")
-                    else:
-                        logger.warning(f"❌ No ID found for name: '{name}' (Response: {data})")
-                        self.cache[name.lower()] = None
+        # key cache = tên viết thường; giữ lại cách viết gốc đầu tiên để gửi lên SRI
+        unique = {}
+        for n in names:
+            if n and n.strip():
+                unique.setdefault(n.strip().lower(), n.strip())
+
+        cached = self.cache.get_many(list(unique))
+        misses = [key for key in unique if key not in cached]
+
+        if misses:
+            fetched = self._lookup([unique[key] for key in misses])
+            new_entries = {}
+            for key in misses:
+                name = unique[key]
+                if name not in fetched: continue  # lỗi tạm thời: không cache
+                curie = fetched[name]
+                new_entries[key] = curie
+                if curie:
+                    logger.info(f"✅ SRI Resolved '{name}' -> {curie}")
                 else:
-                    self.cache[name.lower()] = None
-            except Exception as e:
-                logger.error(f"Name Resolver failed for '{name}': {e}")
-                self.cache[name.lower()] = None
+                    logger.warning(f"❌ No ID found for name: '{name}'")
+            self.cache.set_many(new_entries)
+            cached.update(new_entries)
 
-        return list(set(resolved_curies))
+        return list(set(curie for curie in cached.values() if curie))
 
-name_resolver = NameResolver()
\ No newline at end of file
+name_resolver = NameResolver()
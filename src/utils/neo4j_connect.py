@@ -3,9 +3,77 @@ import os
 import time
 from neo4j import GraphDatabase, Driver
 from dotenv import load_dotenv
+from src.utils.profiler import profiled
 
 load_dotenv()
 
+# --- Cypher cho interface đọc của pipeline (cùng chữ ký với EmbeddedGraphStore, src/utils/graph_store.py) ---
+# node_id = coalesce(n.id, elementId(n)): id gốc (PrimeKG `id:ID`, ingest) nếu có, không phụ thuộc backend
+
+# Step 2: một round trip cho MỌI mention + synonym; rank 0 = chính mention, rank 1.. = synonym theo thứ tự UMLS.
+# Term được lowercase sẵn phía client thành một danh sách phẳng $terms (mention, rank, term, lower), nên node chỉ bị
+# quét MỘT lần cho cả batch (`IN $terms_lower`) thay vì một lần cho mỗi term. Match được nối lại với (mention, rank),
+# giữ rank nhỏ nhất cho từng mention và trả về luôn node_id các node trùng tên (seed cho Step 4).
+BULK_LINK_QUERY = """
+MATCH (n)
+WHERE toLower(n.name) IN $terms_lower
+WITH n, toLower(n.name) AS lower
+UNWIND [t IN $terms WHERE t.lower = lower] AS t
+WITH t.mention AS mention, t.rank AS rank, t.term AS term, n
+ORDER BY mention, rank, elementId(n)
+WITH mention, collect({
+    rank: rank, term: term,
+    node_id: coalesce(n.id, elementId(n)), node_label: labels(n)[0], preferred_name: n.name
+}) AS matches
+WITH mention, matches[0] AS best, matches
+RETURN mention, best,
+       [m IN matches WHERE m.rank = best.rank AND m.preferred_name = best.preferred_name | m.node_id] AS node_ids
+"""
+
+# Step 4 (EXPANSION_MODE=full): seed + mọi lân cận trực tiếp
+EXPAND_NEIGHBORS_QUERY = """
+MATCH (seed) WHERE seed.id IN $seeds OR elementId(seed) IN $seeds
+OPTIONAL MATCH (seed)-[r]-(neighbor)
+WITH collect(DISTINCT seed) + collect(DISTINCT neighbor) as all_nodes_list, collect(DISTINCT r) as all_rels_list
+RETURN [node in all_nodes_list WHERE node IS NOT NULL |
+        {id: coalesce(node.id, elementId(node)), labels: labels(node), name: node.name, provenance: 'PrimeKG', element_id: elementId(node)}] as nodes,
+       [rel in all_rels_list WHERE rel IS NOT NULL |
+        {id: elementId(rel), source: coalesce(startNode(rel).id, elementId(startNode(rel))), target: coalesce(endNode(rel).id, elementId(endNode(rel))), type: type(rel), provenance: 'PrimeKG'}] as relationships
+"""
+
+# Step 4 (bounded): mỗi seed chỉ đọc tối đa $scan_limit cạnh, Python xếp hạng rồi áp quota.
+# /*order*/ được thay bằng SCAN_ORDERS[order] để lấy $scan_limit lân cận tốt nhất theo ranker thay vì các cạnh bất kỳ.
+EXPAND_BOUNDED_QUERY = """
+MATCH (seed) WHERE seed.id IN $seeds OR elementId(seed) IN $seeds
+CALL {
+    WITH seed
+    MATCH (seed)-[r]-(neighbor)
+    WITH r, neighbor /*order*/ LIMIT $scan_limit
+    RETURN collect({
+        node: {id: coalesce(neighbor.id, elementId(neighbor)), labels: labels(neighbor), name: neighbor.name, provenance: 'PrimeKG',
+               element_id: elementId(neighbor), degree: COUNT { (neighbor)--() }, pagerank: neighbor.pagerank},
+        rel: {id: elementId(r), source: coalesce(startNode(r).id, elementId(startNode(r))), target: coalesce(endNode(r).id, elementId(endNode(r))),
+              type: type(r), provenance: 'PrimeKG'}
+    }) AS candidates
+}
+RETURN {id: coalesce(seed.id, elementId(seed)), labels: labels(seed), name: seed.name, provenance: 'PrimeKG',
+        element_id: elementId(seed), degree: COUNT { (seed)--() }, pagerank: seed.pagerank} AS seed, candidates
+"""
+# Khoá xếp hạng đẩy xuống trước LIMIT (whitelist, không nội suy chuỗi tuỳ ý vào Cypher); null pagerank xếp cuối
+SCAN_ORDERS = {
+    "degree": "ORDER BY COUNT { (neighbor)--() } DESC",
+    "pagerank": "ORDER BY coalesce(neighbor.pagerank, 0.0) DESC",
+}
+
+# NameIndex: phân trang keyset theo elementId (cursor), không dùng SKIP
+PAGE_NAMES_QUERY = """
+MATCH (n)
+WHERE n.name IS NOT NULL AND elementId(n) > $after
+RETURN elementId(n) AS cursor, coalesce(n.id, elementId(n)) AS node_id, labels(n)[0] AS node_label, n.name AS name
+ORDER BY elementId(n)
+LIMIT $limit
+"""
+
 class Neo4jConnection:
     """
     Quản lý kết nối Neo4j với cấu hình Timeout cao hơn và Retry.
@@ -48,6 +116,7 @@ class Neo4jConnection:
             self._driver = None
             print("🔌 Kết nối Neo4j đã đóng.")
 
+    @profiled("neo4j.run_query")
     def run_query(self, query, parameters=None):
         if self._driver is None:
             self.connect()
@@ -69,6 +138,51 @@ class Neo4jConnection:
                     raise e
         return []
 
+    def stream_query(self, query, parameters=None, fetch_size: int = 2000):
+        """
+        Generator: đọc kết quả trên MỘT cursor phía server, mỗi lần kéo `fetch_size` record
+        (không dồn cả kết quả vào RAM như `run_query`). Không tự retry: nếu kết nối rớt giữa chừng,
+        caller tự chạy lại từ vị trí đã đọc (vd. keyset theo elementId).
+        """
+        if self._driver is None:
+            self.connect()
+            if self._driver is None: return
+        with self._driver.session(fetch_size=fetch_size) as session:
+            result = session.run(query, parameters)
+            for record in result:
+                yield record
+
+    # --- Interface đọc của pipeline (Step 2, Step 4, NameIndex); EmbeddedGraphStore trả lời giống hệt ---
+    def link_bulk(self, queries) -> list:
+        """`queries` = [{"mention", "terms"}] -> [{"mention", "best": {rank, term, node_id, node_label, preferred_name}, "node_ids"}].
+        Term được lowercase và làm phẳng ở đây để Cypher chỉ quét node một lần cho cả batch; node_ids là node_id, không phải elementId."""
+        terms = [
+            {"mention": q["mention"], "rank": rank, "term": term, "lower": term.lower()}
+            for q in queries for rank, term in enumerate(q["terms"]) if term
+        ]
+        if not terms: return []
+        params = {"terms": terms, "terms_lower": list({t["lower"] for t in terms})}
+        return [dict(r) for r in self.run_query(BULK_LINK_QUERY, params) or []]
+
+    def expand_neighbors(self, seeds) -> dict:
+        """Seed (node_id) + mọi lân cận trực tiếp: {"nodes": [...], "edges": [...]}."""
+        rows = self.run_query(EXPAND_NEIGHBORS_QUERY, {"seeds": list(seeds)})
+        if not rows: return {"nodes": [], "edges": []}
+        return {"nodes": rows[0].get("nodes", []), "edges": rows[0].get("relationships", [])}
+
+    def expand_bounded(self, seeds, scan_limit: int, order: str = None) -> list:
+        """
+        Mỗi seed tối đa `scan_limit` cạnh: [{"seed": node, "candidates": [{"node", "rel"}]}] (node kèm degree, pagerank).
+        `order` ("degree" | "pagerank") chọn `scan_limit` lân cận có khoá lớn nhất; None = các cạnh đọc được đầu tiên.
+        """
+        query = EXPAND_BOUNDED_QUERY.replace("/*order*/", SCAN_ORDERS.get(order, ""))
+        rows = self.run_query(query, {"seeds": list(seeds), "scan_limit": scan_limit})
+        return [{"seed": r["seed"], "candidates": r["candidates"]} for r in rows or []]
+
+    def page_names(self, after=None, limit: int = 20_000) -> list:
+        """Một trang node có tên: [{"cursor", "node_id", "node_label", "name"}]; trang sau bắt đầu từ `rows[-1]["cursor"]`."""
+        return [dict(r) for r in self.run_query(PAGE_NAMES_QUERY, {"after": after or "", "limit": limit}) or []]
+
 # --- Singleton Instance ---
 db_connector = None
 try:
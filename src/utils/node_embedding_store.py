@@ -0,0 +1,130 @@
+# src/utils/node_embedding_store.py
+"""
+Embedding tên node của KG tính sẵn một lần (offline), để Step 5 không phải chạy sentence encoder trên
+tên của mọi node trong subgraph ở mỗi query.
+
+Dựng bằng `scripts/build_node_embeddings.py`, lưu tại `data/node_embeddings/v<N>/` (công bố nguyên tử qua
+`current.json`, xem src/utils/mmap_store.py):
+    vectors.f16 | vectors.f32 : ma trận [N, dim] theo thứ tự dòng (float16 mặc định, xem NODE_EMBEDDING_DTYPE)
+    ids.S     : node id (bytes độ rộng cố định) đã sắp xếp -> tra cả batch bằng `np.searchsorted`
+    order.i64 : dòng trong ma trận của từng id trong ids.S
+Mọi mảng được mở bằng `np.memmap`, nên nhiều worker dùng chung một bản qua page cache.
+
+Node id là id mà Step 4 trả về cho node (`coalesce(n.id, elementId(n))` / node_id của graph store nhúng).
+Node không có trong store (mới ingest, PSG, ARAX) được caller encode như cũ.
+"""
+import json
+import logging
+import time
+import numpy as np
+from src.core import config
+from src.utils.mmap_store import current_dir, open_memmap, publish_dir, staging_dir
+
+logger = logging.getLogger("NODE_EMBEDDING_STORE")
+
+FORMAT_VERSION = 1
+VECTOR_FILES = {"float16": "vectors.f16", "float32": "vectors.f32"}
+
+
+class NodeEmbeddingStore:
+    def __init__(self, path=config.NODE_EMBEDDING_DIR):
+        self.path = current_dir(path)
+        if self.path is None:
+            raise FileNotFoundError(f"No node embedding store at {path}.")
+        with open(self.path / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported node embedding store version {manifest.get('version')} at {self.path}.")
+        self.model = manifest["model"]
+        self.dim = manifest["dim"]
+        self.count = manifest["count"]
+        self._vectors = open_memmap(self.path / VECTOR_FILES[manifest["dtype"]], manifest["dtype"], (self.count, self.dim))
+        self._ids = open_memmap(self.path / "ids.S", f"S{manifest['id_width']}")
+        self._order = open_memmap(self.path / "order.i64", np.int64)
+
+    @staticmethod
+    def exists(path=config.NODE_EMBEDDING_DIR) -> bool:
+        return current_dir(path) is not None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lookup(self, node_ids) -> np.ndarray:
+        """Dòng trong ma trận của từng node id (-1 nếu không có), tra cả batch một lần."""
+        raw = [str(i).encode("utf-8") for i in node_ids]
+        rows = np.full(len(raw), -1, dtype=np.int64)
+        if not raw or not self.count: return rows
+        keys = np.array(raw, dtype=self._ids.dtype)   # id dài hơn độ rộng bị cắt -> loại bên dưới
+        pos = np.minimum(np.searchsorted(self._ids, keys), self.count - 1)
+        fits = np.fromiter((len(r) <= self._ids.dtype.itemsize for r in raw), dtype=bool, count=len(raw))
+        hit = fits & (self._ids[pos] == keys)
+        rows[hit] = self._order[pos[hit]]
+        return rows
+
+    def gather(self, node_ids):
+        """(vectors float32 [n, dim], mask có trong store); dòng không có trong store để 0."""
+        rows = self.lookup(node_ids)
+        hit = rows >= 0
+        vectors = np.zeros((len(rows), self.dim), dtype=np.float32)
+        if hit.any():
+            vectors[hit] = self._vectors[rows[hit]]
+        return vectors, hit
+
+
+def build_node_embeddings(rows, encode, out_dir=config.NODE_EMBEDDING_DIR, model_name: str = None,
+                          dtype: str = config.NODE_EMBEDDING_DTYPE, batch_size: int = 1024) -> dict:
+    """
+    Encode tên node theo batch và ghi store. `rows`: iterable (node_id, name); `encode(texts)` -> [n, dim].
+    Ghi vào một phiên bản mới rồi mới trỏ `current.json` sang nó (worker đang chạy không thấy khoảng trống).
+    """
+    if dtype not in VECTOR_FILES:
+        raise ValueError(f"dtype must be one of {list(VECTOR_FILES)}, got {dtype!r}")
+    tmp = staging_dir(out_dir)
+
+    ids, dim, batch = [], None, []
+    with open(tmp / VECTOR_FILES[dtype], "wb") as f:
+        def flush():
+            nonlocal dim
+            embs = np.asarray(encode([name for _, name in batch]), dtype=dtype)
+            dim = embs.shape[1]
+            f.write(np.ascontiguousarray(embs).tobytes())
+            ids.extend(str(node_id).encode("utf-8") for node_id, _ in batch)
+            batch.clear()
+
+        for node_id, name in rows:
+            batch.append((node_id, name or "Unknown"))
+            if len(batch) == batch_size:
+                flush()
+                logger.info(f"   ... {len(ids)} nodes encoded")
+        if batch: flush()
+
+    id_array = np.array(ids, dtype="S") if ids else np.zeros(0, dtype="S1")
+    order = np.argsort(id_array, kind="stable").astype(np.int64)
+    np.ascontiguousarray(id_array[order]).tofile(tmp / "ids.S")
+    order.tofile(tmp / "order.i64")
+    manifest = {"version": FORMAT_VERSION, "model": model_name, "dim": dim or 0, "dtype": dtype, "count": len(ids),
+                "id_width": id_array.dtype.itemsize, "built_at": time.time()}
+    with open(tmp / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    published = publish_dir(out_dir, tmp)
+    logger.info(f"✅ Node embedding store built: {manifest['count']} x {manifest['dim']} ({dtype}) -> {published}")
+    return manifest
+
+
+def _open_store():
+    if not NodeEmbeddingStore.exists(config.NODE_EMBEDDING_DIR):
+        logger.info(f"No precomputed node embeddings at {config.NODE_EMBEDDING_DIR}; Step 5 encodes node names per query.")
+        return None
+    try:
+        store = NodeEmbeddingStore(config.NODE_EMBEDDING_DIR)
+    except Exception as e:
+        logger.error(f"❌ Could not open node embedding store: {e}")
+        return None
+    # Vector phải khớp encoder Step 5 đang dùng (vd. sau khi đổi SENTENCE_ENCODER_MODEL thì phải build lại)
+    if store.model != config.SENTENCE_ENCODER_MODEL:
+        logger.warning(f"Node embeddings were built with {store.model}, not {config.SENTENCE_ENCODER_MODEL}. Ignoring them.")
+        return None
+    logger.info(f"✅ Node embedding store loaded ({len(store)} nodes) from {config.NODE_EMBEDDING_DIR}.")
+    return store
+
+node_embeddings = _open_store()
@@ -0,0 +1,278 @@
+# src/utils/node_meta_store.py
+"""
+Metadata node của FAISS index (node_id, labels, name) dạng cột, memory-mapped.
+
+Thay cho `kg_nodes_meta.json` (một dict Python cho mỗi node -> hàng GB RAM và startup lâu ở quy mô
+hàng triệu node). Mỗi cột chuỗi được lưu thành:
+    <col>.blob     : các chuỗi UTF-8 nối liền
+    <col>.offsets  : int64[N+1], chuỗi i = blob[offsets[i]:offsets[i+1]]
+    deleted.u8     : (tuỳ chọn) uint8[N], 1 = dòng đã bị xoá/thay thế (tombstone, dùng khi cập nhật tăng dần)
+    ids.S          : node_id (bytes độ rộng cố định) đã sắp xếp + order.i64 (dòng tương ứng), để tra
+                     dòng theo node_id bằng `np.searchsorted` (`rows_of`) thay vì quét cả cột
+Mọi file được mở bằng `np.memmap`, chỉ decode các dòng được hỏi (top-k hit), nên nhiều worker process
+dùng chung một bản qua page cache của OS.
+
+Cách dùng:
+    with NodeMetaWriter("data/kg_index/kg_nodes_meta") as w:
+        w.append("4:abc:1", ["Drug"], "Aspirin")
+    store = NodeMetaStore("data/kg_index/kg_nodes_meta")
+    store[0]  # {"node_id": "4:abc:1", "labels": ["Drug"], "name": "Aspirin"}
+"""
+import array
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+from src.utils.mmap_store import open_memmap
+
+logger = logging.getLogger("NODE_META_STORE")
+
+COLUMNS = ("node_id", "labels", "name")
+LABEL_SEP = "\x1f"   # Ký tự phân tách label (không xuất hiện trong tên label)
+FORMAT_VERSION = 1
+SORT_CHUNK = 100_000   # Số dòng mỗi lần khi dựng ids.S từ cột node_id
+
+
+def _sort_ids(offsets, blob):
+    """(ids đã sắp xếp dạng bytes độ rộng cố định, order) dựng từ cột node_id bằng numpy (không decode từng dòng)."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(offsets) - 1
+    lengths = np.diff(offsets)
+    width = max(int(lengths.max()) if n else 0, 1)
+    ids = np.zeros(n, dtype=f"S{width}")
+    cols = np.arange(width)
+    for start in range(0, n, SORT_CHUNK):
+        stop = min(start + SORT_CHUNK, n)
+        mask = cols < lengths[start:stop, None]
+        padded = np.zeros((stop - start, width), dtype=np.uint8)
+        padded[mask] = blob[(offsets[start:stop, None] + cols)[mask]]
+        ids[start:stop] = padded.view(f"S{width}").ravel()
+    order = np.argsort(ids, kind="stable").astype(np.int64)
+    return ids[order], order
+
+
+def _merge_ids(ids, order, new_ids, new_rows):
+    """Chèn vài id mới vào mảng đã sắp xếp (searchsorted + insert, O(N) trong numpy, không sắp xếp lại)."""
+    keys = np.array(new_ids, dtype="S") if new_ids else np.zeros(0, dtype="S1")
+    dtype = f"S{max(ids.dtype.itemsize, keys.dtype.itemsize)}"
+    ids, keys = ids.astype(dtype), keys.astype(dtype)
+    k = np.argsort(keys, kind="stable")
+    pos = np.searchsorted(ids, keys[k], side="right")
+    return np.insert(ids, pos, keys[k]), np.insert(np.asarray(order, dtype=np.int64), pos, np.asarray(new_rows, dtype=np.int64)[k])
+
+
+class NodeMetaWriter:
+    """
+    Ghi tuần tự (streaming), không giữ metadata trong RAM. Ghi vào thư mục tạm rồi rename khi `close()`;
+    không bao giờ ghi đè store đã có (worker khác có thể đang mmap nó) -> mỗi lần build là một đường dẫn mới.
+    `checkpoint()` lưu trạng thái đang ghi; `NodeMetaWriter(path, resume=True)` ghi tiếp từ checkpoint gần nhất.
+    """
+
+    def __init__(self, path, resume: bool = False):
+        self.path = Path(path)
+        self._tmp = self.path.with_name(self.path.name + ".tmp")
+        # array int64 thay vì list Python: gọn hơn nhiều khi có hàng triệu node
+        self._offsets = {c: array.array("q", [0]) for c in COLUMNS}
+        self.resume_state = None   # Dữ liệu kèm theo checkpoint (vd. vị trí keyset) khi resume
+        self._deleted = set()
+        self._sorted = None        # (ids, order) của store gốc khi ghi tiếp (`from_store`)
+        self._appended = []        # node_id (bytes) ghi thêm sau store gốc, để trộn vào ids.S
+        if resume and (self._tmp / "checkpoint.json").exists():
+            with open(self._tmp / "checkpoint.json", "r", encoding="utf-8") as f:
+                self.resume_state = json.load(f)
+            self.count = self.resume_state["count"]
+            for c in COLUMNS:
+                self._offsets[c] = array.array("q", np.fromfile(self._tmp / f"{c}.offsets.partial", dtype=np.int64)[:self.count + 1].tobytes())
+                # Bỏ phần đã ghi sau checkpoint
+                with open(self._tmp / f"{c}.blob", "r+b") as f:
+                    f.truncate(self._offsets[c][-1])
+            self._blobs = {c: open(self._tmp / f"{c}.blob", "ab") for c in COLUMNS}
+            return
+        if self._tmp.exists():
+            shutil.rmtree(self._tmp)
+        self._tmp.mkdir(parents=True)
+        self._blobs = {c: open(self._tmp / f"{c}.blob", "wb") for c in COLUMNS}
+        self.count = 0
+
+    @classmethod
+    def from_store(cls, store_path, out_path):
+        """Writer ghi tiếp vào BẢN SAO của một store đã có (store gốc không bị đụng tới cho tới khi `close()`)."""
+        src = Path(store_path)
+        writer = cls(out_path)
+        with open(src / "manifest.json", "r", encoding="utf-8") as f:
+            writer.count = json.load(f)["count"]
+        for c in COLUMNS:
+            writer._blobs[c].close()
+            shutil.copyfile(src / f"{c}.blob", writer._tmp / f"{c}.blob")
+            writer._offsets[c] = array.array("q", np.fromfile(src / f"{c}.offsets", dtype=np.int64).tobytes())
+            writer._blobs[c] = open(writer._tmp / f"{c}.blob", "ab")
+        if (src / "deleted.u8").exists():
+            writer._deleted = set(np.flatnonzero(np.fromfile(src / "deleted.u8", dtype=np.uint8)).tolist())
+        ids, order = NodeMetaStore(src).sorted_ids()
+        writer._sorted = (np.array(ids), np.array(order))
+        return writer
+
+    def delete(self, row: int):
+        """Đánh dấu tombstone cho dòng `row` (node bị xoá hoặc đã được thay bằng dòng mới)."""
+        self._deleted.add(int(row))
+
+    def checkpoint(self, **extra):
+        """
+        Flush xuống đĩa để có thể `resume` từ đây sau khi process bị ngắt. `extra` (JSON) được lưu
+        nguyên tử cùng checkpoint và trả lại qua `resume_state`.
+        """
+        for column, f in self._blobs.items():
+            f.flush()
+            os.fsync(f.fileno())
+            with open(self._tmp / f"{column}.offsets.partial", "wb") as f_off:
+                self._offsets[column].tofile(f_off)
+        tmp = self._tmp / "checkpoint.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**extra, "count": self.count}, f)
+        os.replace(tmp, self._tmp / "checkpoint.json")
+
+    def _write(self, column: str, text: str):
+        data = text.encode("utf-8")
+        self._blobs[column].write(data)
+        self._offsets[column].append(self._offsets[column][-1] + len(data))
+
+    def append(self, node_id, labels, name):
+        if self._sorted is not None:
+            self._appended.append(str(node_id).encode("utf-8"))
+        self._write("node_id", str(node_id))
+        self._write("labels", LABEL_SEP.join(labels or []))
+        self._write("name", "" if name is None else str(name))
+        self.count += 1
+
+    def close(self):
+        for column, f in self._blobs.items():
+            f.close()
+            with open(self._tmp / f"{column}.offsets", "wb") as f_off:
+                self._offsets[column].tofile(f_off)
+        if self._deleted:
+            deleted = np.zeros(self.count, dtype=np.uint8)
+            deleted[sorted(self._deleted)] = 1
+            deleted.tofile(self._tmp / "deleted.u8")
+        if self._sorted is not None:
+            base = self.count - len(self._appended)
+            ids, order = _merge_ids(*self._sorted, self._appended, np.arange(base, self.count))
+        else:
+            ids, order = _sort_ids(np.frombuffer(self._offsets["node_id"], dtype=np.int64),
+                                   open_memmap(self._tmp / "node_id.blob", np.uint8))
+        np.ascontiguousarray(ids).tofile(self._tmp / "ids.S")
+        order.tofile(self._tmp / "order.i64")
+        for leftover in [self._tmp / "checkpoint.json", *self._tmp.glob("*.offsets.partial")]:
+            leftover.unlink(missing_ok=True)
+        with open(self._tmp / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "count": self.count, "columns": list(COLUMNS),
+                       "id_width": ids.dtype.itemsize}, f)
+        if self.path.exists():
+            raise FileExistsError(f"Node meta store already exists at {self.path}; write a new version instead of replacing it.")
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def abort(self, keep_checkpoint: bool = False):
+        """Đóng file mà không công bố store; giữ thư mục tạm nếu còn muốn `resume`."""
+        for f in self._blobs.values():
+            f.close()
+        if not keep_checkpoint:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class NodeMetaStore:
+    """Đọc metadata theo chỉ số vector FAISS; hỗ trợ `len()`, `store[i]` và `get_many(ids)`."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported node meta store version {manifest.get('version')} at {self.path}.")
+        self._count = manifest["count"]
+        self._blobs, self._offsets = {}, {}
+        for column in COLUMNS:
+            self._offsets[column] = np.memmap(self.path / f"{column}.offsets", dtype=np.int64, mode="r")
+            self._blobs[column] = open_memmap(self.path / f"{column}.blob", np.uint8)
+        deleted_path = self.path / "deleted.u8"
+        self._deleted = np.fromfile(deleted_path, dtype=np.uint8) if deleted_path.exists() else None
+        self.num_deleted = int(self._deleted.sum()) if self._deleted is not None else 0
+        self._sorted = None
+        if "id_width" in manifest:
+            self._sorted = (open_memmap(self.path / "ids.S", f"S{manifest['id_width']}"), open_memmap(self.path / "order.i64", np.int64))
+
+    def _get(self, column: str, i: int) -> str:
+        offsets = self._offsets[column]
+        return self._blobs[column][offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def node_id(self, i: int) -> str:
+        return self._get("node_id", i)
+
+    def name(self, i: int) -> str:
+        return self._get("name", i)
+
+    def is_deleted(self, i: int) -> bool:
+        return self._deleted is not None and bool(self._deleted[i])
+
+    def __getitem__(self, i: int) -> dict:
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        labels = self._get("labels", i)
+        return {"node_id": self._get("node_id", i), "labels": labels.split(LABEL_SEP) if labels else [], "name": self._get("name", i)}
+
+    def get_many(self, ids) -> list:
+        return [self[int(i)] for i in ids]
+
+    def sorted_ids(self):
+        """(node_id đã sắp xếp, dòng tương ứng). Store cũ chưa có ids.S: dựng trong RAM ở lần gọi đầu."""
+        if self._sorted is None:
+            self._sorted = _sort_ids(self._offsets["node_id"], self._blobs["node_id"])
+        return self._sorted
+
+    def rows_of(self, node_ids) -> dict:
+        """{node_id: [dòng chưa bị xoá]} cho các node_id có trong store, tra cả batch bằng `np.searchsorted`."""
+        ids, order = self.sorted_ids()
+        raw = {str(i): str(i).encode("utf-8") for i in node_ids}
+        # id dài hơn độ rộng của ids.S chắc chắn không có trong store (và sẽ bị cắt nếu đưa vào mảng)
+        raw = {k: v for k, v in raw.items() if len(v) <= ids.dtype.itemsize}
+        if not raw or not len(ids): return {}
+        keys = np.array(list(raw.values()), dtype=ids.dtype)
+        lo, hi = np.searchsorted(ids, keys, side="left"), np.searchsorted(ids, keys, side="right")
+        found = {}
+        for node_id, a, b in zip(raw, lo, hi):
+            rows = [int(r) for r in order[a:b] if not self.is_deleted(int(r))]
+            if rows: found[node_id] = rows
+        return found
+
+    def live_rows(self) -> np.ndarray:
+        """Chỉ số các dòng chưa bị xoá (tombstone)."""
+        if self._deleted is None:
+            return np.arange(self._count, dtype=np.int64)
+        return np.flatnonzero(self._deleted[:self._count] == 0).astype(np.int64)
+
+    @staticmethod
+    def exists(path) -> bool:
+        return (Path(path) / "manifest.json").exists()
+
+
+def convert_json(json_path, out_path) -> int:
+    """Chuyển `kg_nodes_meta.json` (định dạng cũ) sang store dạng cột. Trả về số node."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with NodeMetaWriter(out_path) as writer:
+        for m in meta:
+            writer.append(m.get("node_id"), m.get("labels", []), m.get("name"))
+    logger.info(f"✅ Converted {len(meta)} node metadata rows from {json_path} to {out_path}.")
+    return len(meta)
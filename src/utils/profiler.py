@@ -0,0 +1,218 @@
+# src/utils/profiler.py
+"""
+Đo hiệu năng từng stage của pipeline: wall time, CPU time, peak RSS delta và số lần gọi.
+
+Cách dùng:
+    profiler = PipelineProfiler()
+    with profiling(profiler):
+        with span("step4_retrieval.run"):
+            ...
+    state.log("PROFILE", "SUCCESS", metadata={"profile": profiler.summary()})
+
+Các helper nóng được đánh dấu bằng `@profiled("...")` hoặc `instrument(model, "encode", "...")`.
+Khi không có profiler nào đang hoạt động, các hook này gần như không tốn chi phí.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger("PROFILER")
+
+_current_profiler = contextvars.ContextVar("medcot_profiler", default=None)
+
+try:
+    import resource
+
+    def _peak_rss_bytes() -> int:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về bytes
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+except ImportError:  # Windows không có module `resource`
+    import psutil
+
+    def _peak_rss_bytes() -> int:
+        mem = psutil.Process().memory_info()
+        return getattr(mem, "peak_wset", mem.rss)
+
+
+class StageStats:
+    __slots__ = ("calls", "wall_s", "cpu_s", "peak_rss_delta_bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_delta_bytes = 0
+
+    def add(self, wall_s: float, cpu_s: float, rss_delta: int, calls: int = 1):
+        self.calls += calls
+        self.wall_s += wall_s
+        self.cpu_s += cpu_s
+        self.peak_rss_delta_bytes = max(self.peak_rss_delta_bytes, rss_delta)
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "wall_ms": round(self.wall_s * 1000, 3),
+            "cpu_ms": round(self.cpu_s * 1000, 3),
+            "peak_rss_delta_mb": round(self.peak_rss_delta_bytes / 2**20, 3),
+        }
+
+
+class PipelineProfiler:
+    """Thu thập số liệu của MỘT lần chạy pipeline (một query hoặc một batch)."""
+
+    def __init__(self, label: str = "pipeline"):
+        self.label = label
+        self.stats = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        wall0, cpu0, rss0 = time.perf_counter(), time.process_time(), _peak_rss_bytes()
+        try:
+            yield
+        finally:
+            wall1, cpu1, rss1 = time.perf_counter(), time.process_time(), _peak_rss_bytes()
+            self.record(name, wall1 - wall0, cpu1 - cpu0, rss1 - rss0, start=wall0)
+
+    def record(self, name: str, wall_s: float, cpu_s: float, rss_delta: int, start: float = None):
+        with self._lock:
+            self.stats.setdefault(name, StageStats()).add(wall_s, cpu_s, rss_delta)
+            if start is not None:
+                self.events.append({
+                    "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                    "ts": round((start - self._origin) * 1e6, 1), "dur": round(wall_s * 1e6, 1),
+                    "args": {"cpu_ms": round(cpu_s * 1000, 3), "rss_delta_bytes": rss_delta},
+                })
+        _global_metrics.add(name, wall_s, cpu_s, rss_delta)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: st.to_dict() for name, st in self.stats.items()}
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            return render_prometheus(self.stats, {"run": self.label})
+
+    def to_chrome_trace(self) -> dict:
+        with self._lock:
+            return {"traceEvents": list(self.events), "displayTimeUnit": "ms", "otherData": {"run": self.label}}
+
+    def export(self, output_dir: str, stem: str) -> dict:
+        """Ghi `<stem>.trace.json` (chrome://tracing / Perfetto) và `<stem>.prom`."""
+        out = Path(output_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        trace_path, prom_path = out / f"{stem}.trace.json", out / f"{stem}.prom"
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        return {"chrome_trace": str(trace_path), "prometheus": str(prom_path)}
+
+
+class _GlobalMetrics:
+    """Tổng cộng dồn của mọi lần chạy trong process (phục vụ endpoint /metrics)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, name, wall_s, cpu_s, rss_delta):
+        with self._lock:
+            self._stats.setdefault(name, StageStats()).add(wall_s, cpu_s, rss_delta)
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            return render_prometheus(self._stats)
+
+
+_global_metrics = _GlobalMetrics()
+
+
+def _format_labels(labels: dict) -> str:
+    return ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+
+
+def render_prometheus(stats: dict, extra_labels: dict = None) -> str:
+    """Xuất số liệu theo Prometheus text exposition format."""
+    extra_labels = extra_labels or {}
+    metrics = [
+        ("medcot_stage_calls_total", "counter", "Number of calls per stage.", lambda st: st.calls),
+        ("medcot_stage_wall_seconds_total", "counter", "Wall-clock time spent per stage.", lambda st: st.wall_s),
+        ("medcot_stage_cpu_seconds_total", "counter", "Process CPU time spent per stage.", lambda st: st.cpu_s),
+        ("medcot_stage_peak_rss_delta_bytes", "gauge", "Largest peak-RSS growth observed during the stage.",
+         lambda st: st.peak_rss_delta_bytes),
+    ]
+    lines = []
+    for metric, mtype, help_text, getter in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {mtype}")
+        for name, st in sorted(stats.items()):
+            labels = _format_labels({"stage": name, **extra_labels})
+            lines.append(f"{metric}{{{labels}}} {getter(st)}")
+    return "\n".join(lines) + "\n"
+
+
+def global_prometheus_text() -> str:
+    return _global_metrics.to_prometheus()
+
+
+@contextmanager
+def profiling(profiler: PipelineProfiler):
+    """Kích hoạt `profiler` cho context hiện tại (thread/task hiện tại)."""
+    token = _current_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current_profiler.reset(token)
+
+
+def current_profiler():
+    return _current_profiler.get()
+
+
+@contextmanager
+def span(name: str):
+    """Đo một đoạn code nếu đang có profiler hoạt động, nếu không thì bỏ qua."""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def profiled(name: str):
+    """Decorator: đo mọi lần gọi hàm dưới tên `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_profiler.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument(obj, method_name: str, name: str):
+    """
+    Bọc method của một object bên thứ 3 (vd. `SentenceTransformer.encode`) ngay trên instance.
+    Gọi nhiều lần vẫn an toàn: method chỉ bị bọc một lần.
+    """
+    method = getattr(obj, method_name, None)
+    if method is None or getattr(method, "_medcot_profiled", False):
+        return obj
+    wrapper = profiled(name)(method)
+    wrapper._medcot_profiled = True
+    setattr(obj, method_name, wrapper)
+    return obj
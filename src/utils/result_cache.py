@@ -0,0 +1,216 @@
+# src/utils/result_cache.py
+"""
+Cache kết quả pipeline theo query (đặt trước `run_pipeline`) + cache kết quả trung gian theo stage.
+
+- Key kết quả cuối: `normalized_query` + `normalized_patient_context` (đã che PHI ở Step 0, chuẩn hoá
+  NFKC + casefold + gộp khoảng trắng), config của lần chạy và "fingerprint" phiên bản model/index.
+- Stage cache: Step 1+2 (mention, entity đã link) theo cùng text đã chuẩn hoá; Step 4 (subgraph) theo
+  tập seed node -> câu hỏi khác chữ nhưng link ra cùng entity vẫn bỏ qua được retrieval (Neo4j + ARAX).
+- Lưu trong `DiskCache` (tầng RAM LRU + SQLite có TTL, giới hạn dung lượng, dùng chung giữa các worker).
+- Fingerprint gồm tên model, các tham số ảnh hưởng kết quả và dấu (mtime, size) của FAISS manifest,
+  name index, graph store, trọng số GNN/verifier -> KG hoặc trọng số đổi thì key đổi theo.
+  `invalidate()` xoá toàn bộ và tăng "generation" (file cạnh DB) để mọi process khác cũng bỏ cache cũ.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from src.core import config
+from src.core.state import MedCOTState
+from src.utils.disk_cache import MISSING, DiskCache
+from src.utils.name_index import normalize_name
+
+logger = logging.getLogger("RESULT_CACHE")
+
+RESULT_CACHE_PATH = Path(".cache/pipeline_results.sqlite")
+CACHE_FORMAT_VERSION = 1
+FINGERPRINT_CHECK_SECONDS = 30   # Kiểm tra lại mtime các artifact tối đa mỗi N giây
+
+# Artifact mà kết quả phụ thuộc vào: đổi file nào thì mọi key đổi theo
+ARTIFACTS = [
+    "data/kg_index/kg_index_manifest.json",
+    "data/kg_index/name_index.json.gz",
+    f"{config.GRAPH_STORE_DIR}/current.json",      # Con trỏ phiên bản (src/utils/mmap_store.py)
+    f"{config.NODE_EMBEDDING_DIR}/current.json",
+    "models/gnn_dual_tower_weights.pth",
+    "models/verifier_weights.pth",
+]
+
+# Trường của state được lưu cho từng loại entry
+RESULT_FIELDS = ("mentions", "linked_entities", "seed_nodes", "unlinked_mentions", "candidate_paths",
+                 "verified_path", "global_confidence", "reasoning_mode", "final_answer", "safety_flags")
+GCOT_TEXT_FIELDS = ("verified_path_text", "compiled_cot")   # gcot còn chứa tensor -> chỉ giữ phần text
+LINKING_FIELDS = ("mentions", "linked_entities", "seed_nodes", "unlinked_mentions")
+
+
+def _stamp(path) -> list:
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+def _digest(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class PipelineResultCache:
+    def __init__(self, path=RESULT_CACHE_PATH, ttl_seconds: float = config.RESULT_CACHE_TTL_SECONDS,
+                 stage_ttl_seconds: float = config.STAGE_CACHE_TTL_SECONDS, memory_items: int = 1024,
+                 max_bytes: int = config.RESULT_CACHE_MAX_BYTES):
+        self.path = Path(path)
+        self.results = DiskCache(self.path, namespace="pipeline_results", ttl_seconds=ttl_seconds,
+                                 memory_items=memory_items, max_bytes=max_bytes)
+        self.stages = DiskCache(self.path, namespace="pipeline_stages", ttl_seconds=stage_ttl_seconds,
+                                memory_items=memory_items, max_bytes=max_bytes)
+        self._generation_path = self.path.with_suffix(".generation")
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # --- Phiên bản model/index ---
+    def _generation(self) -> int:
+        try:
+            return int(self._generation_path.read_text().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def fingerprint(self) -> str:
+        with self._lock:
+            if self._fingerprint is None or time.time() - self._checked_at >= FINGERPRINT_CHECK_SECONDS:
+                self._fingerprint = _digest({
+                    "format": CACHE_FORMAT_VERSION,
+                    "generation": self._generation(),
+                    "models": [config.EXTRACTION_MODEL_NAME, config.SENTENCE_ENCODER_MODEL, config.DENSE_RETRIEVAL_MODEL,
+                               config.RERANKER_MODEL, config.NLI_MODEL_NAME, config.COT_LLM_MODEL],
+                    "params": [config.LINKING_THRESHOLD, config.WEIGHTS, config.GRAPH_BACKEND, config.EXPANSION_MODE,
+                               config.EXPANSION_SCAN_LIMIT, config.EXPANSION_MAX_PER_SEED, config.EXPANSION_MAX_PER_RELATION,
+                               config.EXPANSION_HOPS, config.EXPANSION_HOP2_FRONTIER, config.EXPANSION_HOP2_MAX_PER_NODE,
+                               config.EXPANSION_HOP2_MAX_DEGREE, config.EXPANSION_RANKER, config.INFERENCE_PRECISION],
+                    "artifacts": {p: _stamp(p) for p in ARTIFACTS},
+                })
+                self._checked_at = time.time()
+            return self._fingerprint
+
+    def invalidate(self):
+        """Bỏ mọi entry (vd. sau khi nạp dữ liệu mới vào KG hoặc train lại model), kể cả ở process khác."""
+        self._generation_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._generation_path.with_name(self._generation_path.name + f".tmp{os.getpid()}")
+        tmp.write_text(str(self._generation() + 1))
+        os.replace(tmp, self._generation_path)
+        self.results.clear()
+        self.stages.clear()
+        with self._lock:
+            self._fingerprint = None
+        logger.info("🧹 Pipeline result cache invalidated.")
+
+    # --- Key ---
+    @staticmethod
+    def _texts(state: MedCOTState) -> list:
+        return [normalize_name(state.normalized_query or state.raw_query), normalize_name(state.normalized_patient_context)]
+
+    def result_key(self, state: MedCOTState, cfg: dict) -> str:
+        run_cfg = {k: v for k, v in (cfg or {}).items() if k not in ("profile_dir", "use_cache")}
+        return _digest(["result", self._texts(state), run_cfg, self.fingerprint()])
+
+    def linking_key(self, state: MedCOTState) -> str:
+        return _digest(["linking", self._texts(state), self.fingerprint()])
+
+    def retrieval_key(self, state: MedCOTState, top_k_nodes: int = None) -> str:
+        # Subgraph chỉ phụ thuộc seed + mention (tra SRI/ARAX) + ngữ cảnh bệnh nhân (PSG), không phụ thuộc câu chữ
+        mentions = sorted({(m.text.lower(), m.source) for m in state.mentions})
+        return _digest(["retrieval", sorted(state.seed_nodes), mentions, normalize_name(state.normalized_patient_context),
+                        top_k_nodes, self.fingerprint()])
+
+    # --- Đọc / ghi ---
+    @staticmethod
+    def _dump(state: MedCOTState, fields) -> dict:
+        from src.modules.step10_logging import clean_for_json
+        return clean_for_json(state.model_dump(mode="python", include=set(fields)))
+
+    @staticmethod
+    def _restore(state: MedCOTState, payload: dict) -> MedCOTState:
+        # Validate lại để các trường lồng nhau (Mention, LinkedEntity...) trở về đúng kiểu
+        return MedCOTState.model_validate({**state.model_dump(mode="python"), **payload})
+
+    def get_result(self, state: MedCOTState, cfg: dict):
+        """State đã có kết quả cuối (từ cache) hoặc None."""
+        payload = self.results.get(self.result_key(state, cfg))
+        if payload is MISSING: return None
+        restored = self._restore(state, {k: v for k, v in payload.items() if k != "gcot"})
+        restored.gcot.update(payload.get("gcot", {}))
+        return restored
+
+    def set_result(self, state: MedCOTState, cfg: dict):
+        if not state.final_answer: return   # không cache lần chạy lỗi giữa chừng
+        payload = self._dump(state, RESULT_FIELDS)
+        payload["gcot"] = {k: state.gcot[k] for k in GCOT_TEXT_FIELDS if isinstance(state.gcot.get(k), str)}
+        self.results.set(self.result_key(state, cfg), payload)
+
+    def get_stage(self, key: str):
+        return self.stages.get(key)
+
+    def set_stage(self, key: str, payload: dict):
+        self.stages.set(key, payload)
+
+    # --- Bọc các stage ---
+    def linking_stage(self, extraction_fn, linking_fn):
+        """Step 1 + 2 có cache: cùng text (đã chuẩn hoá) -> dùng lại mention và entity đã link."""
+        def run(state: MedCOTState) -> MedCOTState:
+            key = self.linking_key(state)
+            payload = self.get_stage(key)
+            if payload is not MISSING:
+                state = self._restore(state, payload)
+                state.log("2_LINKING", "CACHE_HIT", {"count": len(state.seed_nodes)})
+                return state
+            state = linking_fn(extraction_fn(state))
+            self.set_stage(key, self._dump(state, LINKING_FIELDS))
+            return state
+        return run
+
+    def linking_stage_batch(self, extraction_fn, linking_fn):
+        """
+        Như `linking_stage` cho cả batch (`run_pipeline_batch`): state trúng cache được khôi phục tại chỗ (giữ nguyên
+        object), Step 1 + 2 chỉ chạy một batch cho các state còn lại. `extraction_fn`/`linking_fn` nhận và trả về list state.
+        """
+        def run(states: list) -> list:
+            hits, misses = set(), []
+            for state in states:
+                payload = self.get_stage(self.linking_key(state))
+                if payload is MISSING:
+                    misses.append(state)
+                    continue
+                restored = self._restore(state, payload)
+                for field in LINKING_FIELDS:
+                    setattr(state, field, getattr(restored, field))
+                state.log("2_LINKING", "CACHE_HIT", {"count": len(state.seed_nodes)})
+                hits.add(id(state))
+            linked = linking_fn(extraction_fn(misses)) if misses else []
+            for state in linked:
+                self.set_stage(self.linking_key(state), self._dump(state, LINKING_FIELDS))
+            done = hits | {id(s) for s in linked}
+            return [s for s in states if id(s) in done]
+        return run
+
+    def retrieval_stage(self, retrieval_fn, top_k_nodes: int = None):
+        """Step 4 có cache theo tập seed: lưu subgraph + seed sau khi đã thêm CURIE từ SRI/ARAX."""
+        def run(state: MedCOTState) -> MedCOTState:
+            key = self.retrieval_key(state, top_k_nodes)
+            payload = self.get_stage(key)
+            if payload is not MISSING:
+                state.seed_nodes = payload["seed_nodes"]
+                state.graph_refs["ckg_subgraph"] = payload["ckg_subgraph"]
+                state.log("4_RETRIEVAL", "CACHE_HIT", {"nodes": len(payload["ckg_subgraph"].get("nodes", []))})
+                return state
+            state = retrieval_fn(state)
+            if "ckg_subgraph" in state.graph_refs:
+                self.set_stage(key, {"seed_nodes": list(state.seed_nodes), "ckg_subgraph": state.graph_refs["ckg_subgraph"]})
+            return state
+        return run
+
+
+result_cache = PipelineResultCache()
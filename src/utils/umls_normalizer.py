@@ -66,6 +66,32 @@ class UMLSNormalizer:
             scored_results.append({"cui": cui, "pref_name": best_atom['str'], "stys": list(data['stys']), "sab": best_atom['sab'], "score": score})
         return sorted(scored_results, key=lambda x: x['score'], reverse=True)[:top_k]
 
+    @lru_cache(maxsize=1024)
+    def get_synonyms(self, text: str, max_synonyms: int = 20) -> list[str]:
+        """
+        Các tên khác (atoms) của những CUI khớp với `text`, ưu tiên tên chuẩn và nguồn uy tín (SAB_RANKING).
+        Không bao gồm chính `text`. Trả về list rỗng nếu không có kết nối hoặc không tìm thấy.
+        """
+        cuis = [c["cui"] for c in self.normalize(text)]
+        if not self.conn or not cuis: return []
+        placeholders = ','.join('?' for _ in cuis)
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f"SELECT cui, str, str_lower, is_pref, sab FROM atoms WHERE cui IN ({placeholders})", cuis)
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Lỗi truy vấn `get_synonyms` cho '{text}': {e}")
+            return []
+        cui_order = {cui: i for i, cui in enumerate(cuis)}
+        rows = sorted(rows, key=lambda r: (cui_order[r['cui']], -r['is_pref'], SAB_RANKING.get(r['sab'], 99)))
+        seen, synonyms = {text.lower()}, []
+        for row in rows:
+            if row['str_lower'] in seen: continue
+            seen.add(row['str_lower'])
+            synonyms.append(row['str'])
+            if len(synonyms) >= max_synonyms: break
+        return synonyms
+
     # ==============================================================================
     # NÂNG CẤP: Thêm hàm lấy định nghĩa từ bảng definitions
     # ==============================================================================
@@ -0,0 +1,88 @@
+# tests/test_arax_client.py
+import json
+import threading
+import time
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from src.utils import arax_client as arax_module
+from src.utils.arax_client import ARAXClient
+
+class _FakeARAX(BaseHTTPRequestHandler):
+    delay_s = 0.2
+    calls = []
+    busy_once = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        a = body["message"]["query_graph"]["nodes"]["n0"]["ids"][0]
+        b = body["message"]["query_graph"]["nodes"]["n1"]["ids"][0]
+        self.calls.append((a, b))
+        # Lần đầu gặp cặp có "BUSY" -> trả 503 để kiểm tra retry
+        if "BUSY" in a + b and (a, b) not in self.busy_once:
+            self.busy_once.add((a, b))
+            self.send_response(503); self.end_headers()
+            return
+        time.sleep(10 if "SLOW" in a + b else self.delay_s)
+        payload = json.dumps({"message": {"knowledge_graph": {
+            "nodes": {a: {"name": a}, b: {"name": b}},
+            "edges": {"e0": {"subject": a, "object": b, "predicate": "biolink:interacts_with"}},
+        }}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: ASYNC ARAX CLIENT")
+    print("="*50)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeARAX)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    arax_module.ARAX_BASE_URL = f"http://127.0.0.1:{httpd.server_address[1]}"
+    arax_module.CACHE_PATH = Path(tempfile.mkdtemp()) / "arax_cache.sqlite"
+    arax_module.BACKOFF_BASE_SECONDS = 0.05
+    client = ARAXClient()
+
+    try:
+        # 4 CURIE -> 6 cặp, mỗi cặp 0.2s, tối đa 4 song song -> ~0.4s thay vì 1.2s
+        t0 = time.perf_counter()
+        edges = client.query_kg2(["A", "B", "C", "D"])
+        elapsed = time.perf_counter() - t0
+        print(f"🔸 {len(edges)} edges in {elapsed:.2f}s")
+        assert len(edges) == 6 and elapsed < 1.0
+        assert [(e["source_id"], e["target_id"]) for e in edges][:2] == [("A", "B"), ("A", "C")]
+
+        # Lần 2: cache hit, không gọi server
+        n_calls = len(_FakeARAX.calls)
+        assert len(client.query_kg2(["D", "C", "B", "A"])) == 6
+        assert len(_FakeARAX.calls) == n_calls
+
+        # Cache theo cặp: {A, B, E} chỉ phải query 2 cặp mới (A-E, B-E)
+        assert len(client.query_kg2(["A", "B", "E"])) == 3
+        assert len(_FakeARAX.calls) == n_calls + 2
+        print(f"🔸 Cache stats: {client.cache.stats()}")
+
+        # 503 -> retry rồi thành công
+        assert len(client.query_kg2(["BUSY1", "X"])) == 1
+
+        # Deadline: cặp chậm bị huỷ, vẫn trả về kết quả từng phần
+        t0 = time.perf_counter()
+        partial = client.query_kg2(["P", "Q", "SLOW"], deadline_seconds=1.0)
+        elapsed = time.perf_counter() - t0
+        print(f"🔸 Partial result: {len(partial)} edges in {elapsed:.2f}s")
+        assert len(partial) == 1 and elapsed < 2.0
+    finally:
+        client.close()
+        httpd.shutdown()
+
+    print("\n🎉 TEST ASYNC ARAX CLIENT THÀNH CÔNG!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# tests/test_disk_cache.py
+import tempfile
+import threading
+import time
+from pathlib import Path
+from src.utils.disk_cache import DiskCache, MISSING
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: DISK CACHE (SQLITE + LRU)")
+    print("="*50)
+
+    path = Path(tempfile.mkdtemp()) / "cache.sqlite"
+    cache = DiskCache(path, namespace="test", ttl_seconds=60, negative_ttl_seconds=0.2, memory_items=2)
+
+    assert cache.get("aspirin") is MISSING
+    cache.set_many({"aspirin": "CHEBI:15365", "warfarin": "CHEBI:10033", "unknownium": None})
+
+    # Kết quả âm (None) được cache và phân biệt với MISSING
+    assert cache.get("unknownium") is None
+    assert cache.get_many(["aspirin", "warfarin", "nope"]) == {"aspirin": "CHEBI:15365", "warfarin": "CHEBI:10033"}
+
+    # Tầng RAM bị giới hạn 2 phần tử nhưng dữ liệu vẫn còn trên đĩa
+    assert len(cache._memory) <= 2
+
+    # Instance mới (giả lập restart) đọc lại được từ đĩa
+    reopened = DiskCache(path, namespace="test", ttl_seconds=60)
+    assert reopened.get("aspirin") == "CHEBI:15365"
+    assert DiskCache(path, namespace="other").get("aspirin") is MISSING
+
+    # TTL của kết quả âm ngắn hơn
+    time.sleep(0.3)
+    assert cache.get("unknownium") is MISSING
+    assert cache.get("aspirin") == "CHEBI:15365"
+    assert cache.purge_expired() == 1
+
+    # Ghi/đọc từ nhiều thread
+    def worker(i):
+        cache.set(f"k{i}", i)
+        assert cache.get(f"k{i}") == i
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(cache) == 2 + 8
+
+    cache.clear()
+    assert len(cache) == 0 and reopened.get_many(["warfarin"]) == {}
+
+    stats = cache.stats()
+    print(f"🔸 Stats: {stats}")
+    assert stats["misses"] >= 1 and stats["memory_hits"] + stats["disk_hits"] >= 1
+
+    # Giá trị lớn được nén; vượt max_bytes -> xoá entry lâu không dùng nhất
+    bounded = DiskCache(path, namespace="bounded", ttl_seconds=60, memory_items=0, max_bytes=20_000)
+    big = [{"source": "warfarin", "target": "aspirin", "type": "INTERACTS_WITH"}] * 200
+    bounded.set("big", big)
+    assert bounded.get("big") == big
+    assert bounded.size_bytes() < len(str(big)) / 5
+    for i in range(200):
+        bounded.set(f"pair{i}", ["x" * 300, i])
+    bounded.evict()
+    assert bounded.size_bytes() <= 20_000
+    assert bounded.get("pair199") == ["x" * 300, 199]
+    assert bounded.get("pair0") is MISSING
+    assert bounded.stats()["evictions"] > 0
+
+    print("\n🎉 TEST DISK CACHE THÀNH CÔNG!")
+
+if __name__ == "__main__":
+    main()
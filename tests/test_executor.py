@@ -0,0 +1,72 @@
+# tests/test_executor.py
+import threading
+import time
+from src.core.executor import DAGExecutor, run_parallel
+from src.utils.profiler import PipelineProfiler, profiling, span
+
+def _io_task(name, delay=0.1):
+    def fn(results):
+        with span(name):
+            time.sleep(delay)
+        return name
+    return fn
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: DAG EXECUTOR")
+    print("="*50)
+
+    # Hai nhánh độc lập (mỗi nhánh 0.1s) phải chạy chồng lên nhau
+    profiler = PipelineProfiler(label="dag")
+    order = []
+    lock = threading.Lock()
+
+    def merge(results):
+        with lock: order.append("merge")
+        return results["local"] + "+" + results["remote"]
+
+    dag = DAGExecutor(name="test")
+    dag.add("local", _io_task("local"))
+    dag.add("remote", _io_task("remote"))
+    dag.add("merge", merge, deps=["local", "remote"])
+
+    t0 = time.perf_counter()
+    with profiling(profiler):
+        results = dag.run()
+    elapsed = time.perf_counter() - t0
+    print(f"🔸 Results: {results} ({elapsed:.3f}s)")
+
+    assert results["merge"] == "local+remote"
+    assert elapsed < 0.18, f"Independent tasks did not overlap ({elapsed:.3f}s)"
+    # Profiler (contextvar) phải được truyền sang thread worker
+    summary = profiler.summary()
+    assert summary["local"]["calls"] == 1 and summary["remote"]["calls"] == 1
+
+    # Task lỗi -> task phụ thuộc không chạy, exception được raise lại
+    ran = []
+    dag = DAGExecutor(name="failing")
+    dag.add("boom", lambda r: 1 / 0)
+    dag.add("after", lambda r: ran.append("after"), deps=["boom"])
+    try:
+        dag.run()
+        raise AssertionError("Expected ZeroDivisionError")
+    except ZeroDivisionError:
+        pass
+    assert ran == []
+
+    # Vòng lặp phụ thuộc bị phát hiện
+    dag = DAGExecutor(name="cycle")
+    dag.add("a", lambda r: 1, deps=["b"])
+    dag.add("b", lambda r: 2, deps=["a"])
+    try:
+        dag.run()
+        raise AssertionError("Expected ValueError for cycle")
+    except ValueError:
+        pass
+
+    assert run_parallel({"x": lambda: 1, "y": lambda: 2}) == {"x": 1, "y": 2}
+
+    print("\n🎉 TEST DAG EXECUTOR THÀNH CÔNG!")
+
+if __name__ == "__main__":
+    main()
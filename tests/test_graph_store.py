@@ -0,0 +1,75 @@
+# tests/test_graph_store.py
+import tempfile
+from pathlib import Path
+from src.utils.graph_store import EmbeddedGraphStore, build_from_csv, element_id
+
+NODES_CSV = """id:ID,:LABEL,name,source
+D1,Drug,Warfarin,DrugBank
+D2,Drug,Aspirin,DrugBank
+X1,Disease,Hypertension,MONDO
+P1,Effect/Phenotype,Bleeding,HPO
+G1,Gene/Protein,CYP2C9,NCBI
+"""
+EDGES_CSV = """:START_ID,:END_ID,:TYPE,display_relation
+D1,D2,DRUG_DRUG,synergistic interaction
+D1,P1,DRUG_EFFECT,side effect
+D2,X1,INDICATION,indication
+D1,G1,DRUG_PROTEIN,target
+G1,X1,DISEASE_PROTEIN,associated with
+D9,D1,DRUG_DRUG,unknown start node
+"""
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: EMBEDDED GRAPH STORE (CSR + MMAP)")
+    print("="*50)
+
+    tmp = Path(tempfile.mkdtemp())
+    (tmp / "nodes.csv").write_text(NODES_CSV, encoding="utf-8")
+    (tmp / "edges.csv").write_text(EDGES_CSV, encoding="utf-8")
+    manifest = build_from_csv(tmp / "nodes.csv", tmp / "edges.csv", tmp / "store")
+    assert manifest["num_nodes"] == 5 and manifest["num_edges"] == 5   # cạnh có đầu mút lạ bị bỏ
+
+    store = EmbeddedGraphStore(tmp / "store")
+    warfarin = store.lookup_name("WARFARIN")
+    assert len(warfarin) == 1 and store.node(warfarin[0])["id"] == "D1"
+    assert store.resolve("D1") == warfarin[0] and store.resolve(element_id(warfarin[0])) == warfarin[0]
+    assert store.resolve("NOPE") is None and store.lookup_name("nope") == []
+    assert store.degree(warfarin[0]) == 3
+
+    # k-hop + lọc loại quan hệ
+    nodes, edges = store.expand([warfarin[0]], hops=1)
+    assert {store.node(int(i))["name"] for i in nodes} == {"Warfarin", "Aspirin", "Bleeding", "CYP2C9"}
+    nodes, _ = store.expand([warfarin[0]], hops=2)
+    assert "Hypertension" in {store.node(int(i))["name"] for i in nodes}
+    nodes, edges = store.expand([warfarin[0]], hops=1, rel_types=["DRUG_EFFECT"])
+    assert [store.edge(int(e))["type"] for e in edges] == ["DRUG_EFFECT"]
+
+    # Cùng interface đọc với Neo4jConnection (Step 2 / Step 4 / NameIndex), seed theo node_id
+    rows = store.link_bulk([{"mention": "asa", "terms": ["asa", "aspirin"]}])
+    assert rows[0]["best"]["preferred_name"] == "Aspirin" and rows[0]["best"]["rank"] == 1 and rows[0]["node_ids"] == ["D2"]
+    rows = store.expand_bounded(["D1", "NOPE"], scan_limit=2)
+    assert len(rows) == 1 and len(rows[0]["candidates"]) == 2 and rows[0]["seed"]["degree"] == 3
+    # Khoá xếp hạng áp trước giới hạn quét: giữ 2 lân cận bậc cao nhất (Aspirin, CYP2C9), bỏ Bleeding (bậc 1)
+    rows = store.expand_bounded(["D1"], scan_limit=2, order="degree")
+    assert {c["node"]["id"] for c in rows[0]["candidates"]} == {"D2", "G1"}
+    graph = store.expand_neighbors(["D1"])
+    assert {n["id"] for n in graph["nodes"]} == {"D1", "D2", "P1", "G1"} and len(graph["edges"]) == 3
+    page = store.page_names(None, 3)
+    assert len(page) == 3 and [r["node_id"] for r in page + store.page_names(page[-1]["cursor"], 3)] == ["D1", "D2", "X1", "P1", "G1"]
+    try:
+        store.run_query("CREATE (n:Drug {name: 'x'})")
+        raise AssertionError("Phải báo lỗi với Cypher")
+    except NotImplementedError:
+        pass
+
+    # Build lại: phiên bản mới được công bố qua current.json, store đang mở vẫn đọc được
+    build_from_csv(tmp / "nodes.csv", tmp / "edges.csv", tmp / "store")
+    rebuilt = EmbeddedGraphStore(tmp / "store")
+    assert rebuilt.path != store.path and rebuilt.path.name == "v2" and not store.path.exists()
+    assert store.lookup_name("aspirin") == rebuilt.lookup_name("aspirin")
+
+    print("\n✅ TẤT CẢ TEST GRAPH STORE ĐỀU PASS!")
+
+if __name__ == "__main__":
+    main()
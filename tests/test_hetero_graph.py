@@ -0,0 +1,59 @@
+# tests/test_hetero_graph.py
+import numpy as np
+import torch
+from src.core.state import MedCOTState
+from src.utils.hetero_graph import SubgraphIndex, subgraph_index
+
+NODES = [
+    {"id": "D1", "label": "Drug", "name": "Warfarin"},
+    {"id": "P1", "label": "Effect/Phenotype", "name": "Bleeding"},
+    {"id": "D2", "label": "Drug", "name": "Aspirin"},
+    {"id": "G1", "label": "Gene Protein", "name": "CYP2C9"},
+]
+EDGES = [
+    {"source": "D1", "target": "P1", "type": "drug_effect"},
+    {"source": "D1", "target": "D2", "type": "DRUG_DRUG"},
+    {"source": "D2", "target": "P1", "type": "DRUG_EFFECT"},
+    {"source": "D1", "target": "X9", "type": "DRUG_DRUG"},   # đầu mút không có trong subgraph
+    {"source": "G1", "target": "D2"},                         # thiếu type -> RELATED
+]
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: SUBGRAPH -> HETERODATA (THEO CỘT)")
+    print("="*50)
+
+    index = SubgraphIndex(NODES)
+    assert index.node_types == ["Drug", "Effect_Phenotype", "Gene_Protein"]
+    assert index.rows(["D2", "nope", "G1"]).tolist() == [2, -1, 3]
+    assert index.type_node_map() == {"Drug": {"D1": 0, "D2": 1}, "Effect_Phenotype": {"P1": 0}, "Gene_Protein": {"G1": 0}}
+    assert index.node_map["P1"]["name"] == "Bleeding"
+
+    features = np.arange(len(NODES) * 2, dtype=np.float32).reshape(len(NODES), 2)
+    data = index.to_hetero_data(EDGES, features)
+    assert torch.equal(data["Drug"].x, torch.tensor(features[[0, 2]]))
+    assert data.edge_types == [("Drug", "DRUG_EFFECT", "Effect_Phenotype"), ("Drug", "DRUG_DRUG", "Drug"),
+                               ("Gene_Protein", "RELATED", "Drug")]
+    assert data["Drug", "DRUG_EFFECT", "Effect_Phenotype"].edge_index.tolist() == [[0, 1], [0, 0]]
+    assert data["Gene_Protein", "RELATED", "Drug"].edge_index.tolist() == [[0], [1]]
+
+    # View của một tower (Step 5): giống hệt index dựng riêng từ các node đó
+    mask = np.array([True, False, True, True])
+    view, own = index.subset(mask), SubgraphIndex([n for n, m in zip(NODES, mask) if m])
+    assert view.node_types == own.node_types == ["Drug", "Gene_Protein"]
+    assert view.type_node_map() == own.type_node_map() and view.rows(["G1", "P1"]).tolist() == [2, -1]
+    assert view.edge_index_dict(EDGES).keys() == own.edge_index_dict(EDGES).keys()
+    assert index.subset(np.zeros(len(NODES), dtype=bool)).node_types == []
+
+    # Id map dùng chung trong state, dựng lại khi subgraph đổi
+    state = MedCOTState(raw_query="q")
+    state.graph_refs["ckg_subgraph"] = {"nodes": NODES, "edges": EDGES}
+    assert subgraph_index(state) is subgraph_index(state)
+    state.graph_refs["ckg_subgraph"] = {"nodes": NODES[:2], "edges": []}
+    assert len(subgraph_index(state)) == 2
+    assert SubgraphIndex([]).to_hetero_data(EDGES, np.zeros((0, 2))).node_types == []
+
+    print("\n✅ TẤT CẢ TEST HETERODATA ĐỀU PASS!")
+
+if __name__ == "__main__":
+    main()
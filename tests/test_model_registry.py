@@ -0,0 +1,64 @@
+# tests/test_model_registry.py
+import threading
+import time
+from src.utils.model_registry import ModelRegistry
+
+_load_calls = []
+
+class _FakeEncoder:
+    def __init__(self, name, device):
+        self.name, self.device = name, device
+
+    def encode(self, texts):
+        return [len(t) for t in texts]
+
+def _slow_loader(name, device):
+    _load_calls.append((name, device))
+    time.sleep(0.05)
+    return _FakeEncoder(name, device)
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: MODEL REGISTRY")
+    print("="*50)
+
+    registry = ModelRegistry()
+    registry.register_loader("fake", _slow_loader, "encode")
+
+    # 8 thread cùng xin một model -> chỉ được nạp đúng một lần
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("fake", "mini", "cpu"))) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert len(_load_calls) == 1, _load_calls
+    assert all(r is results[0] for r in results)
+    assert results[0].encode(["abc"]) == [3]
+
+    # Khác device -> instance khác
+    other = registry.get("fake", "mini", "cuda:1")
+    assert other is not results[0] and len(_load_calls) == 2
+
+    footprint = registry.footprint()
+    print(f"🔸 Footprint: {footprint}")
+    assert {(m["name"], m["device"]) for m in footprint} == {("mini", "cpu"), ("mini", "cuda:1")}
+    assert next(m for m in footprint if m["device"] == "cpu")["hits"] == 8
+
+    assert registry.evict("mini", device="cpu") == 1
+    assert not registry.is_loaded("fake", "mini", "cpu")
+    assert registry.is_loaded("fake", "mini", "cuda:1")
+
+    # Sau khi evict, lần gọi tiếp theo nạp lại
+    registry.get("fake", "mini", "cpu")
+    assert len(_load_calls) == 3
+
+    try:
+        registry.get("unknown_kind", "x", "cpu")
+        raise AssertionError("Expected KeyError for unknown kind")
+    except KeyError:
+        pass
+
+    print("\n🎉 TEST MODEL REGISTRY THÀNH CÔNG!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# tests/test_name_index.py
+import os
+import tempfile
+from pathlib import Path
+from src.utils import name_index as name_index_module
+from src.utils.name_index import NameIndex, normalize_name
+
+class FakeNeo4j:
+    """Trả lời `page_names` của NameIndex (keyset theo cursor = elementId)."""
+    def __init__(self, nodes):
+        self.rows = sorted(nodes, key=lambda r: r["cursor"])
+        self.calls = 0
+
+    def page_names(self, after=None, limit=20_000):
+        self.calls += 1
+        return [r for r in self.rows if r["cursor"] > (after or "")][:limit]
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: NAME INDEX (ENTITY LINKING)")
+    print("="*50)
+
+    assert normalize_name("  Ａｓｐｉｒｉｎ \n Tablet ") == "aspirin tablet"   # NFKC (full-width) + casefold
+    assert normalize_name("STRASSE") == normalize_name("straße")
+
+    db = FakeNeo4j([
+        {"cursor": "4:x:1", "node_id": "DB00945", "node_label": "Drug", "name": "Aspirin"},
+        {"cursor": "4:x:2", "node_id": "4:x:2", "node_label": "Disease", "name": "Type 2 Diabetes"},
+        {"cursor": "4:x:3", "node_id": "MONDO:1", "node_label": "Disease", "name": "Headache"},
+        {"cursor": "4:x:4", "node_id": "HP:1", "node_label": "Effect/Phenotype", "name": "Headache"},
+    ])
+    name_index_module.BUILD_PAGE_SIZE = 3   # ép phân trang qua nhiều lần query
+    path = Path(tempfile.mkdtemp()) / "name_index.json.gz"
+    index = NameIndex(path)
+
+    assert index.ensure_loaded(db)
+    assert db.calls == 2 and path.exists()
+    assert len(index) == 3
+
+    hits = index.lookup_many(["aspirin", "TYPE 2  diabetes", "unknown", "headache"])
+    print(f"🔸 Hits: {hits}")
+    assert set(hits) == {"aspirin", "TYPE 2  diabetes", "headache"}
+    assert hits["aspirin"]["node_id"] == "DB00945" and hits["aspirin"]["preferred_name"] == "Aspirin"
+    assert index.lookup("nope") is None
+
+    # Seed nodes: node_id của mọi node trùng đúng tên
+    assert index.node_ids(["Headache", "Aspirin"]) == ["MONDO:1", "HP:1", "DB00945"]
+
+    # Restart: nạp từ snapshot, không query lại Neo4j
+    reopened = NameIndex(path)
+    assert reopened.ensure_loaded(db) and db.calls == 2
+    assert reopened.lookup("aspirin")["node_id"] == "DB00945"
+
+    # Cập nhật tăng dần (như ingest_custom_data, row có thêm element_id) + process khác tự nạp lại snapshot
+    added = index.add_nodes([
+        {"element_id": "4:x:9", "node_id": "Diệp hạ châu", "node_label": "Drug", "name": "Diệp hạ châu"},
+        {"element_id": "4:x:1", "node_id": "DB00945", "node_label": "Drug", "name": "Aspirin"},   # trùng -> bỏ qua
+    ])
+    assert added == 1
+    stat = path.stat()
+    index.save()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 5))
+    reopened._last_reload_check = 0
+    assert reopened.ensure_loaded(db)
+    assert reopened.lookup("DIỆP HẠ CHÂU")["node_label"] == "Drug"
+
+    # Không có snapshot và không có DB -> báo không dùng được để Step 2 quay về Cypher
+    empty = NameIndex(Path(tempfile.mkdtemp()) / "missing.json.gz")
+    class BrokenDB:
+        def page_names(self, *a, **k): raise RuntimeError("Neo4j down")
+    assert not empty.ensure_loaded(BrokenDB())
+    assert empty.lookup_many(["aspirin"]) == {}
+
+    print("\n✅ TẤT CẢ TEST NAME INDEX ĐỀU PASS!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# tests/test_node_embedding_store.py
+import tempfile
+from pathlib import Path
+import numpy as np
+from src.utils.node_embedding_store import NodeEmbeddingStore, build_node_embeddings
+
+DIM = 8
+
+def fake_encode(texts):
+    # Vector tất định theo tên để so sánh
+    return np.stack([np.random.default_rng(sum(t.encode())).standard_normal(DIM) for t in texts]).astype(np.float32)
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: NODE EMBEDDING STORE (MMAP)")
+    print("="*50)
+
+    tmp = Path(tempfile.mkdtemp())
+    rows = [("DB00682", "Warfarin"), ("DB00945", "Aspirin"), ("4:abc:12", "Bleeding"), ("MONDO:5044", "Hypertension")]
+    manifest = build_node_embeddings(iter(rows), fake_encode, tmp / "emb", model_name="test-model", dtype="float16", batch_size=3)
+    assert manifest["count"] == 4 and manifest["dim"] == DIM and manifest["model"] == "test-model"
+
+    store = NodeEmbeddingStore(tmp / "emb")
+    assert len(store) == 4
+    # Tra cả batch, thứ tự tuỳ ý, có id không tồn tại và id dài hơn mọi id trong store
+    query = ["MONDO:5044", "nope", "DB00682", "DB00682-but-much-longer-than-any-id", "4:abc:12"]
+    assert store.lookup(query).tolist() == [3, -1, 0, -1, 2]
+
+    vectors, hit = store.gather(query)
+    assert vectors.dtype == np.float32 and vectors.shape == (5, DIM)
+    assert hit.tolist() == [True, False, True, False, True]
+    expected = fake_encode(["Hypertension", "Warfarin", "Bleeding"])
+    assert np.allclose(vectors[hit], expected, atol=1e-2)   # float16
+    assert not vectors[~hit].any()
+
+    # float32 giữ nguyên giá trị; store rỗng không lỗi
+    build_node_embeddings(iter(rows), fake_encode, tmp / "emb32", model_name="test-model", dtype="float32")
+    vectors, _ = NodeEmbeddingStore(tmp / "emb32").gather(["DB00945"])
+    assert np.array_equal(vectors[0], fake_encode(["Aspirin"])[0])
+    build_node_embeddings(iter([]), fake_encode, tmp / "empty", model_name="test-model")
+    assert NodeEmbeddingStore(tmp / "empty").lookup(["DB00682"]).tolist() == [-1]
+
+    print("\n✅ TẤT CẢ TEST NODE EMBEDDING STORE ĐỀU PASS!")
+
+if __name__ == "__main__":
+    main()
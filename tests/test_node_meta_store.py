@@ -0,0 +1,81 @@
+# tests/test_node_meta_store.py
+import json
+import tempfile
+from pathlib import Path
+from src.utils.node_meta_store import NodeMetaStore, NodeMetaWriter, convert_json
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: NODE META STORE (COLUMNAR + MMAP)")
+    print("="*50)
+
+    tmp = Path(tempfile.mkdtemp())
+    rows = [
+        {"node_id": "4:x:1", "labels": ["Drug"], "name": "Aspirin"},
+        {"node_id": "4:x:2", "labels": ["Effect/Phenotype", "User_Upload"], "name": "Đau đầu"},
+        {"node_id": "4:x:3", "labels": [], "name": ""},
+    ]
+    with NodeMetaWriter(tmp / "meta") as writer:
+        for r in rows:
+            writer.append(r["node_id"], r["labels"], r["name"])
+
+    store = NodeMetaStore(tmp / "meta")
+    assert len(store) == 3
+    assert [store[i] for i in range(3)] == rows
+    assert store.get_many([2, 0]) == [rows[2], rows[0]]
+    try:
+        store[3]
+        raise AssertionError("Phải báo IndexError")
+    except IndexError:
+        pass
+
+    # Chuyển đổi từ định dạng JSON cũ
+    legacy = tmp / "kg_nodes_meta.json"
+    legacy.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+    assert convert_json(legacy, tmp / "converted") == 3
+    assert NodeMetaStore(tmp / "converted")[1]["name"] == "Đau đầu"
+
+    # Lỗi giữa chừng -> store cũ vẫn nguyên vẹn
+    try:
+        with NodeMetaWriter(tmp / "meta") as writer:
+            writer.append("4:x:9", ["Drug"], "Broken")
+            raise RuntimeError("crash")
+    except RuntimeError:
+        pass
+    assert len(NodeMetaStore(tmp / "meta")) == 3 and not (tmp / "meta.tmp").exists()
+
+    # Checkpoint + resume: phần ghi sau checkpoint bị bỏ, ghi tiếp từ đúng vị trí
+    writer = NodeMetaWriter(tmp / "resumable")
+    writer.append("4:x:1", ["Drug"], "Aspirin")
+    writer.checkpoint(after="4:x:1")
+    writer.append("4:x:2", ["Drug"], "Lost after crash")
+    writer.abort(keep_checkpoint=True)
+
+    resumed = NodeMetaWriter(tmp / "resumable", resume=True)
+    assert resumed.count == 1 and resumed.resume_state["after"] == "4:x:1"
+    resumed.append("4:x:2", ["Drug"], "Warfarin")
+    resumed.close()
+    store = NodeMetaStore(tmp / "resumable")
+    assert [store[i]["name"] for i in range(len(store))] == ["Aspirin", "Warfarin"]
+    assert not list((tmp / "resumable").glob("*.partial"))
+
+    # Cập nhật tăng dần: sao chép store, tombstone dòng cũ, thêm dòng mới; store gốc không đổi
+    writer = NodeMetaWriter.from_store(tmp / "resumable", tmp / "resumable.v2")
+    writer.delete(1)
+    writer.append("4:x:2", ["Drug"], "Warfarin sodium")
+    writer.close()
+    updated = NodeMetaStore(tmp / "resumable.v2")
+    assert len(updated) == 3 and updated.num_deleted == 1
+    assert updated.is_deleted(1) and not updated.is_deleted(2) and updated.node_id(2) == "4:x:2"
+    assert updated[2]["name"] == "Warfarin sodium"
+    assert len(NodeMetaStore(tmp / "resumable")) == 2 and NodeMetaStore(tmp / "resumable").num_deleted == 0
+
+    # Tra dòng theo node_id qua ids.S (dòng tombstone bị bỏ; id mới được trộn vào khi ghi tiếp)
+    assert updated.rows_of(["4:x:2", "4:x:1", "4:x:404"]) == {"4:x:2": [2], "4:x:1": [0]}
+    assert updated.live_rows().tolist() == [0, 2]
+    assert NodeMetaStore(tmp / "meta").rows_of(["4:x:3", "4:x:1"]) == {"4:x:3": [2], "4:x:1": [0]}
+
+    print("\n✅ TẤT CẢ TEST NODE META STORE ĐỀU PASS!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# tests/test_profiler.py
+import json
+import time
+from src.utils.profiler import PipelineProfiler, profiling, profiled, span, instrument
+
+@profiled("helper.sleep")
+def _slow_helper():
+    time.sleep(0.01)
+
+class _FakeModel:
+    def encode(self, texts):
+        return [len(t) for t in texts]
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: PIPELINE PROFILER")
+    print("="*50)
+
+    # Khi không có profiler hoạt động, hook không ghi gì cả
+    _slow_helper()
+
+    model = instrument(_FakeModel(), "encode", "fake.encode")
+    instrument(model, "encode", "fake.encode")  # Bọc lần 2 phải không có tác dụng
+
+    profiler = PipelineProfiler(label="test")
+    with profiling(profiler):
+        with span("STAGE_A"):
+            _slow_helper()
+            _slow_helper()
+            assert model.encode(["abc", "de"]) == [3, 2]
+
+    summary = profiler.summary()
+    print(f"🔸 Summary: {json.dumps(summary, indent=2)}")
+
+    assert summary["helper.sleep"]["calls"] == 2
+    assert summary["fake.encode"]["calls"] == 1
+    assert summary["STAGE_A"]["wall_ms"] >= summary["helper.sleep"]["wall_ms"]
+
+    prom = profiler.to_prometheus()
+    assert 'medcot_stage_calls_total{stage="helper.sleep",run="test"} 2' in prom
+
+    trace = profiler.to_chrome_trace()
+    assert len(trace["traceEvents"]) == 4
+    assert all(e["ph"] == "X" for e in trace["traceEvents"])
+
+    print("\n🎉 TEST PROFILER THÀNH CÔNG!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# tests/test_result_cache.py
+import tempfile
+from pathlib import Path
+from src.core import config
+from src.core.state import MedCOTState, Mention
+from src.utils.result_cache import PipelineResultCache
+
+def _state(query, context=None):
+    return MedCOTState(raw_query=query, normalized_query=query, normalized_patient_context=context)
+
+def main():
+    print("="*50)
+    print("🧪 BẮT ĐẦU TEST: PIPELINE RESULT CACHE")
+    print("="*50)
+
+    cache = PipelineResultCache(Path(tempfile.mkdtemp()) / "results.sqlite")
+    cfg = {"use_gcot": True}
+
+    # Chưa chạy xong (không có final_answer) thì không cache
+    state = _state("Warfarin và Aspirin?")
+    cache.set_result(state, cfg)
+    assert cache.get_result(state, cfg) is None
+
+    state.final_answer = "Tăng nguy cơ chảy máu."
+    state.seed_nodes = ["D1", "D2"]
+    state.gcot = {"compiled_cot": "Warfarin -> Bleeding", "tensor": object()}
+    cache.set_result(state, cfg)
+
+    # Khác hoa/thường, khoảng trắng vẫn trúng; khác config hoặc ngữ cảnh thì trượt
+    hit = cache.get_result(_state("  warfarin   VÀ aspirin? "), cfg)
+    assert hit is not None and hit.final_answer == "Tăng nguy cơ chảy máu." and hit.seed_nodes == ["D1", "D2"]
+    assert hit.gcot == {"compiled_cot": "Warfarin -> Bleeding"}
+    assert cache.get_result(_state("Warfarin và Aspirin?"), {"use_gcot": False}) is None
+    assert cache.get_result(_state("Warfarin và Aspirin?", "Bệnh nhân 70 tuổi"), cfg) is None
+
+    # Stage cache của Step 4 theo tập seed: thứ tự seed không quan trọng
+    calls = []
+    def retrieval(s):
+        calls.append(s.raw_query)
+        s.graph_refs["ckg_subgraph"] = {"nodes": [{"id": "D1"}], "edges": []}
+        return s
+    stage = cache.retrieval_stage(retrieval)
+    first = _state("q1"); first.seed_nodes = ["D1", "D2"]; first.mentions = [Mention(text="Warfarin", label="CHEMICAL", span=(0, 8), score=0.9, source="query")]
+    second = _state("q2"); second.seed_nodes = ["D2", "D1"]; second.mentions = [Mention(text="warfarin", label="CHEMICAL", span=(5, 13), score=0.8, source="query")]
+    stage(first)
+    out = stage(second)
+    assert calls == ["q1"] and out.graph_refs["ckg_subgraph"]["nodes"] == [{"id": "D1"}]
+
+    # Step 1+2 theo batch: chỉ các state trượt cache đi qua extraction/linking, state trúng giữ nguyên object
+    batches = []
+    def extract(batch):
+        batches.append([s.raw_query for s in batch])
+        return batch
+    def link(batch):
+        for s in batch: s.seed_nodes = ["D1"]
+        return batch
+    linking = cache.linking_stage_batch(extract, link)
+    linking([_state("q1"), _state("q2")])
+    again = [_state("Q2"), _state("q3")]
+    out = linking(again)
+    assert batches == [["q1", "q2"], ["q3"]] and out[0] is again[0] and again[0].seed_nodes == ["D1"]
+
+    # Tham số mở rộng nào cũng là một phần của fingerprint
+    before = cache.fingerprint()
+    config.EXPANSION_HOP2_FRONTIER += 1
+    cache._fingerprint = None
+    assert cache.fingerprint() != before
+    config.EXPANSION_HOP2_FRONTIER -= 1
+    cache._fingerprint = None
+
+    # invalidate() bỏ mọi entry
+    cache.invalidate()
+    assert cache.get_result(_state("Warfarin và Aspirin?"), cfg) is None
+    stage(second)
+    assert calls == ["q1", "q2"]
+
+    print("\n✅ TẤT CẢ TEST RESULT CACHE ĐỀU PASS!")
+
+if __name__ == "__main__":
+    main()
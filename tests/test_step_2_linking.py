@@ -40,7 +40,17 @@ def main():
     print(state.seed_nodes)
 
     assert len(state.seed_nodes) > 0, "Phải link được ít nhất 1 node"
-    
+
+    # Đường dự phòng (một lần `link_bulk` trên backend) phải cho cùng kết quả với NameIndex
+    texts = list(dict.fromkeys(m.text for m in state.mentions))
+    bulk = step2_linking._link_neo4j_bulk(step2_linking._expand_terms(texts))
+    via_index = step2_linking._link_via_index(texts)
+    print(f"\n🔸 Bulk Neo4j linked: {sorted(bulk)} | NameIndex linked: {sorted(via_index)}")
+    assert set(bulk) == set(via_index)
+    for text in bulk:
+        assert bulk[text]["match"]["preferred_name"] == via_index[text]["match"]["preferred_name"]
+        assert set(bulk[text]["node_ids"]) == set(via_index[text]["node_ids"])
+
     if db_connector:
         db_connector.close()
     print("\n🎉 TEST BƯỚC 2 THÀNH CÔNG!")
@@ -40,6 +40,13 @@ def main():
     # Test này giờ sẽ PASS vì code Step 5 đã có vòng lặp
     assert len(thought_vectors) == 2, "Phải sinh đủ số thought vectors"
     assert len(final_embeddings) > 0, "Phải có final node embeddings"
+
+    # Chạy lại cùng subgraph: model GNN lấy từ cache, không dựng lại
+    gnn_before = [m for m in step5_reasoning.model_registry.footprint() if m["kind"] == "gnn"]
+    state = step5_reasoning.run(state, num_think_steps=2)
+    gnn_after = [m for m in step5_reasoning.model_registry.footprint() if m["kind"] == "gnn"]
+    assert len(gnn_after) == len(gnn_before) == 1, "Cùng metadata phải dùng lại một model GNN"
+    assert gnn_after[0]["hits"] == gnn_before[0]["hits"] + 1
     
     if db_connector:
         db_connector.close()